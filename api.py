@@ -0,0 +1,158 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Inject chaos from Python, without the runner.
+
+    from api import chaos
+
+    with chaos('delay'):
+        run_test()
+
+    fault = enable('deny-incoming')
+    run_test()
+    fault.disable()
+
+Unlike the runner, the API takes no workspace lock, installs no boot hook
+and does not configure logging: the chaos commands log to the
+"chaos_monkey" logger, which has no handler until the application adds
+one. Faults that change the same resources can not be enabled at the same
+time, see scheduler.conflicts().
+"""
+from contextlib import contextmanager
+import logging
+import threading
+
+from chaos_monkey import ChaosMonkey
+from scheduler import conflicts
+from utility import (
+    BadRequest,
+    log,
+    NotFound,
+    set_shell_helper,
+)
+from utils.shell_helper import ShellHelper
+
+__metaclass__ = type
+
+
+log.addHandler(logging.NullHandler())
+
+# The enabled faults, and the lock guarding them.
+_active = []
+_lock = threading.Lock()
+
+
+class Fault:
+    """Handle enabling and disabling a chaos command.
+
+    A Fault is a context manager, enabled on entry and disabled on exit.
+    """
+
+    def __init__(self, chaos):
+        self.chaos = chaos
+        self.enabled = False
+
+    @property
+    def command_str(self):
+        return self.chaos.command_str
+
+    def enable(self):
+        """Enable the chaos.
+
+        :raises BadRequest: When the fault, or a fault changing the same
+            resources, is enabled.
+        """
+        with _lock:
+            for fault in _active:
+                if conflicts(self.chaos, fault.chaos):
+                    raise BadRequest('{} conflicts with enabled {}'.format(
+                        self.command_str, fault.command_str))
+            # Hold the resources while the chaos is enabled, outside the
+            # lock so faults on other resources are not serialized.
+            _active.append(self)
+        enabled = False
+        try:
+            self.chaos.enable()
+            enabled = True
+        finally:
+            # Chaos without a disable, such as kill-mongod, is done at once.
+            if enabled and self.chaos.disable:
+                self.enabled = True
+            else:
+                with _lock:
+                    _active.remove(self)
+
+    def disable(self):
+        """Disable the chaos, if it is enabled.
+
+        The fault stays enabled when the disable fails.
+        """
+        if not self.enabled:
+            return
+        self.chaos.disable()
+        with _lock:
+            self.enabled = False
+            _active.remove(self)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+
+def chaos(command_str):
+    """Return the Fault of a chaos command, not enabled yet.
+
+    :raises NotFound: When command_str is not a chaos command.
+    """
+    chaos = ChaosMonkey.find_command(command_str)
+    if chaos is None:
+        raise NotFound('Unknown chaos command: {}'.format(command_str))
+    return Fault(chaos)
+
+
+def enable(command_str):
+    """Enable a chaos command and return its Fault."""
+    fault = chaos(command_str)
+    fault.enable()
+    return fault
+
+
+def commands(group=None):
+    """Return the chaos commands, of group if given."""
+    registry = ChaosMonkey.registry()
+    if group is None:
+        return [c.command_str for c in registry.chaos]
+    return [c.command_str for c in registry.groups.get(group, [])]
+
+
+def configure(**settings):
+    """Configure the chaos plugins, see ChaosMonkey.configure()."""
+    ChaosMonkey.configure(**settings)
+
+
+def active():
+    """Return the enabled faults."""
+    with _lock:
+        return list(_active)
+
+
+def disable_all():
+    """Disable every enabled fault, latest first."""
+    for fault in reversed(active()):
+        fault.disable()
+
+
+@contextmanager
+def shell_helper():
+    """Run the shell commands of the chaos through a persistent helper
+    process in the block, which makes enabling short faults cheaper.
+    """
+    helper = ShellHelper.start()
+    set_shell_helper(helper)
+    try:
+        yield helper
+    finally:
+        set_shell_helper(None)
+        helper.stop()
@@ -0,0 +1,256 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Measure the overhead Chaos Monkey adds to the chaos it runs.
+
+Run from the Chaos Monkey directory:
+    python -m bench.control_path --output bench.json
+
+Shell commands are stubbed and waits run on a virtual clock, so only the
+control path of the runner is measured: startup, command selection, event
+logging and loading replay files. The results are written as JSON, to be
+compared between commits.
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import json
+import logging
+import os
+import platform
+import random
+import sys
+from time import time
+
+import chaos_monkey
+from chaos_monkey import (
+    ChaosMonkey,
+    ChaosRegistry,
+)
+from chaos_monkey_base import Chaos
+from event_log import (
+    ENABLE,
+    EventMessage,
+)
+from replay import read_replay
+from runner import (
+    parse_args,
+    Runner,
+)
+from scheduler import VirtualClock
+from utility import (
+    monotonic,
+    set_shell_helper,
+    setup_logging,
+    stop_log_queues,
+    StructuredMessage,
+    temp_dir,
+)
+
+__metaclass__ = type
+
+
+CATALOGUE_SIZES = (10, 100, 1000, 10000)
+REPLAY_SIZES = (10, 1000, 100000, 1000000)
+
+
+class StubShell:
+    """Answer every shell command with empty output, like a ShellHelper."""
+
+    def run(self, cmd, input_data=None):
+        return ''
+
+
+def noop():
+    pass
+
+
+def make_registry(size, groups=10):
+    """Return a ChaosRegistry of size commands that do nothing."""
+    registry = ChaosRegistry([])
+    for i in range(size):
+        registry.add(Chaos(
+            noop, noop, 'group-{}'.format(i % groups),
+            'command-{}'.format(i), 'Benchmark command {}.'.format(i)))
+    return registry
+
+
+@contextmanager
+def catalogue(size):
+    """Make the process-wide registry a catalogue of size commands."""
+    chaos_monkey._registry = make_registry(size)
+    try:
+        yield chaos_monkey._registry
+    finally:
+        ChaosMonkey.reset_registry()
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """Return the best seconds per call of func and the calls per timing.
+
+    The calls are timed in batches, grown until a batch lasts min_time.
+    """
+    number = 1
+    while True:
+        elapsed = _time_calls(func, number)
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, _time_calls(func, number))
+    return best / number, number
+
+
+def _time_calls(func, number):
+    start = monotonic()
+    for _ in xrange(number):
+        func()
+    return monotonic() - start
+
+
+def result(benchmark, size, seconds, calls, items=1):
+    """Return a result, with the cost of each item in microseconds."""
+    return {
+        'benchmark': benchmark,
+        'size': size,
+        'calls': calls,
+        'seconds': seconds,
+        'item_us': seconds / items * 1e6,
+    }
+
+
+def bench_startup(size, workspace):
+    """Parse the command line, which lists every command in its help."""
+    with catalogue(size):
+        seconds, calls = measure(lambda: parse_args([workspace]))
+    return [result('startup', size, seconds, calls)]
+
+
+def bench_selection(size, workspace):
+    """Filter the catalogue, select commands and run them."""
+    results = []
+    with catalogue(size):
+        runner = Runner(workspace, ChaosMonkey.factory(),
+                        cmd_log_name='bench-cmd-log')
+        seconds, calls = measure(runner.filter_commands)
+        results.append(result('filter_commands', size, seconds, calls))
+        selector = runner.chaos_monkey.selector()
+        rng = random.Random(0)
+        seconds, calls = measure(lambda: selector.choose(0, rng))
+        results.append(result('select', size, seconds, calls))
+        # Enable, log and disable without waiting.
+        runner.waiter.wait = VirtualClock().wait
+        seconds, calls = measure(lambda: runner._run_command(1))
+        results.append(result('run_command', size, seconds, calls))
+    return results
+
+
+def bench_logging(workspace):
+    """Log one event directly to a file and through a queue."""
+    results = []
+    chaos = Chaos(noop, noop, 'bench', 'command-0', 'Benchmark command.')
+    for name, queue_size in (('log_event', 0), ('log_event_queued', 10000)):
+        log_name = 'bench-{}'.format(name)
+        setup_logging(os.path.join(workspace, log_name + '.log'), 1,
+                      name=log_name, add_stream=False,
+                      disable_formatter=True, queue_size=queue_size)
+        runner = Runner(workspace, None, cmd_log_name=log_name)
+        seconds, calls = measure(
+            lambda: runner._log_event(ENABLE, chaos, 1, 0.001))
+        results.append(result(name, 1, seconds, calls))
+        stop_log_queues()
+    return results
+
+
+def bench_replay_load(size, workspace, replay_format):
+    """Read and check every command of a replay file of size entries."""
+    path = os.path.join(workspace, 'replay.{}'.format(replay_format))
+    write_replay(path, size, replay_format)
+    commands = make_registry(min(size, 1000)).commands
+
+    def load():
+        with open(path) as f:
+            for command_str, _, _, _ in read_replay(f):
+                if command_str not in commands:
+                    raise ValueError(command_str)
+
+    seconds, calls = measure(load, repeat=1 if size > 10000 else 3)
+    os.remove(path)
+    return [result('replay_load_{}'.format(replay_format), size, seconds,
+                   calls, size)]
+
+
+def write_replay(path, size, replay_format):
+    """Write a replay file of size entries as YAML or as an event log."""
+    with open(path, 'w') as f:
+        for i in xrange(size):
+            command_str = 'command-{}'.format(i % 1000)
+            if replay_format == 'yaml':
+                f.write(str(StructuredMessage(command_str, 1)) + '\n')
+            else:
+                f.write(str(EventMessage(
+                    ENABLE, command_str, 1, 0.001, offset=i)) + '\n')
+
+
+def run(catalogue_sizes=CATALOGUE_SIZES, replay_sizes=REPLAY_SIZES):
+    """Run every benchmark and return the report."""
+    results = []
+    set_shell_helper(StubShell())
+    try:
+        with temp_dir() as workspace:
+            setup_logging(os.path.join(workspace, 'results.log'), 1,
+                          add_stream=False)
+            for size in catalogue_sizes:
+                results.extend(bench_startup(size, workspace))
+                results.extend(bench_selection(size, workspace))
+            results.extend(bench_logging(workspace))
+            for size in replay_sizes:
+                for replay_format in ('yaml', 'events'):
+                    results.extend(
+                        bench_replay_load(size, workspace, replay_format))
+    finally:
+        set_shell_helper(None)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+    return {
+        'time': time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def parse_sizes(sizes):
+    return [int(size) for size in sizes.split(',')]
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        description='Benchmark the control path of the Chaos Monkey runner.')
+    parser.add_argument(
+        '-o', '--output', help='Write the JSON results to this file.')
+    parser.add_argument(
+        '--catalogue-sizes', type=parse_sizes,
+        default=list(CATALOGUE_SIZES),
+        help='Comma-separated numbers of commands in the catalogue.')
+    parser.add_argument(
+        '--replay-sizes', type=parse_sizes, default=list(REPLAY_SIZES),
+        help='Comma-separated numbers of entries in the replay files.')
+    args = parser.parse_args(argv)
+    report = run(args.catalogue_sizes, args.replay_sizes)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+    for r in report['results']:
+        print('{benchmark:>20} {size:>8} {item_us:12.3f} us'.format(**r),
+              file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
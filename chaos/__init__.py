@@ -0,0 +1,28 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from chaos_monkey_base import ChaosPlugin
+
+# Metadata for the built-in chaos. The modules are only imported when one of
+# their commands is run, so keep this in sync with their get_chaos().
+plugins = [
+    ChaosPlugin('chaos.net', 'Net', 'net', [
+        ['deny-all',
+         'Deny all incoming and outgoing network traffic except ssh.'],
+        ['deny-incoming', 'Deny all incoming network traffic except ssh.'],
+        ['deny-outgoing', 'Deny all outgoing network traffic except ssh.'],
+        ['deny-state-server', 'Deny network traffic to the Juju State-Server'],
+        ['deny-api-server', 'Deny network traffic to the Juju API Server.'],
+        ['deny-sys-log', 'Deny network traffic to the Juju SysLog.'],
+        ['delay', 'Delay network traffic.'],
+        ['delay-long', 'Delay network traffic.'],
+        ['drop', 'Drop network packets.'],
+        ['corrupt', 'Corrupt network packets.'],
+        ['duplicate', 'Duplicate network packets.'],
+        ['partition', 'Partition the machine from its peers, except ssh.'],
+    ]),
+    ChaosPlugin('chaos.kill', 'Kill', 'kill', [
+        ['kill-jujud', 'Kill jujud process.'],
+        ['kill-mongod', 'Kill mongod process.'],
+        ['restart-unit', 'Restart the unit.'],
+    ]),
+]
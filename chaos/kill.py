@@ -1,20 +1,50 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
-import logging
+import errno
+import os
+import signal
 from subprocess import CalledProcessError
 
 from chaos_monkey_base import (
     Chaos,
     ChaosMonkeyBase,
+    EXCLUSIVE,
 )
 from utility import (
+    BadRequest,
+    log,
     NotFound,
     run_shell_command,
 )
+from utils.process import ProcessFinder
 
 __metaclass__ = type
 
 
+# The ProcessFinder.find() arguments a process match can use.
+match_keys = ('name', 'exe', 'cmdline', 'cgroup', 'unit')
+
+
+def parse_match(spec):
+    """Return the ProcessFinder.find() arguments of a process match spec.
+
+    For example 'name=jujud,unit=jujud-machine-0.service' gives
+    {'name': 'jujud', 'unit': 'jujud-machine-0.service'}. An empty spec
+    gives {}.
+
+    :raises BadRequest: When a key is unknown or has no value.
+    """
+    match = {}
+    for item in (spec or '').split(','):
+        if not item:
+            continue
+        key, _, value = item.partition('=')
+        if key not in match_keys or not value:
+            raise BadRequest('Invalid process match: {}'.format(item))
+        match[key] = value
+    return match
+
+
 class Kill(ChaosMonkeyBase):
     """Kill processes including shutting down a machine and restarting."""
 
@@ -23,45 +53,71 @@ class Kill(ChaosMonkeyBase):
     restart_cmd = 'restart-unit'
     group = 'kill'
 
-    def __init__(self):
+    def __init__(self, finder=None, jujud_match=None, mongod_match=None):
+        """
+        :param finder: ProcessFinder used to look up processes.
+        :param jujud_match: ProcessFinder.find() arguments selecting the
+            jujud process, e.g. {'unit': 'jujud-machine-0.service'}.
+        :param mongod_match: ProcessFinder.find() arguments selecting the
+            mongod process.
+        """
         super(Kill, self).__init__()
+        self.finder = finder or ProcessFinder()
+        self.jujud_match = jujud_match or {'name': 'jujud'}
+        self.mongod_match = mongod_match or {'name': 'mongod'}
 
     @classmethod
     def factory(cls):
         return cls()
 
-    def get_pids(self, process):
-        """Return a list of process IDs."""
-        pids = run_shell_command('pidof ' + process, quiet_mode=True)
+    def configure(self, settings):
+        """Select the jujud and mongod processes from settings.
+
+        jujud_match and mongod_match are parse_match() specs, such as
+        'unit=jujud-machine-0.service'.
+        """
+        self.jujud_match = parse_match(
+            settings.get('jujud_match')) or {'name': 'jujud'}
+        self.mongod_match = parse_match(
+            settings.get('mongod_match')) or {'name': 'mongod'}
+
+    def get_pids(self, name=None, **match):
+        """Return a list of process IDs, newest first.
+
+        :param name: Process name, as matched by pidof.
+        :param match: Other ProcessFinder.find() arguments.
+        """
+        pids = self.finder.find(name=name, **match)
         if not pids:
             return None
-        return pids.strip().split(' ')
+        return pids
+
+    def _kill(self, match, label, quiet_mode):
+        pids = self.get_pids(**match)
+        if pids:
+            try:
+                os.kill(pids[0], signal.SIGKILL)
+                return
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+        log.error("{} process ID not found".format(label))
+        if not quiet_mode:
+            raise NotFound('Process id not found')
 
     def kill_jujud(self, quiet_mode=True):
         """Kill a jujud process.
 
         :param quiet_mode: When False, generates an exception on error.
         """
-        pids = self.get_pids('jujud')
-        if not pids:
-            logging.error("Jujud process ID not found")
-            if not quiet_mode:
-                raise NotFound('Process id not found')
-            return
-        run_shell_command('kill -s SIGKILL ' + pids[0])
+        self._kill(self.jujud_match, 'Jujud', quiet_mode)
 
     def kill_mongodb(self, quiet_mode=True):
         """Kill mongod process.
 
         :param quiet_mode: When False, generates an exception on error.
         """
-        pids = self.get_pids('mongod')
-        if not pids:
-            logging.error("MongoDB process ID not found")
-            if not quiet_mode:
-                raise NotFound('Process id not found')
-            return
-        run_shell_command('kill -s SIGKILL ' + pids[0])
+        self._kill(self.mongod_match, 'MongoDB', quiet_mode)
 
     def restart_unit(self, quiet_mode=False):
         """Reboot the unit at the operating system level.
@@ -71,7 +127,7 @@ class Kill(ChaosMonkeyBase):
         try:
             run_shell_command('shutdown -r now')
         except CalledProcessError:
-            logging.error("Error while executing command: shutdown -r now ")
+            log.error("Error while executing command: shutdown -r now ")
             if not quiet_mode:
                 raise
 
@@ -98,5 +154,6 @@ class Kill(ChaosMonkeyBase):
                 disable=None,
                 group=self.group,
                 command_str=self.restart_cmd,
-                description='Restart the unit.'))
+                description='Restart the unit.',
+                resources=[EXCLUSIVE]))
         return chaos
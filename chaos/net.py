@@ -1,22 +1,273 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
+import hashlib
+import re
+import socket
+from subprocess import CalledProcessError
+
 from chaos_monkey_base import (
     Chaos,
     ChaosMonkeyBase,
+    join_command,
 )
 from utility import (
+    BadRequest,
+    NotFound,
     run_shell_command,
 )
+from utils.netdev import (
+    FALLBACK_INTERFACE,
+    resolve_interfaces,
+)
+
+try:
+    from pyroute2 import IPRoute
+except ImportError:
+    IPRoute = None
 
 __metaclass__ = type
 
 
+# tc netem option: (pyroute2 argument, pyroute2 correlation argument).
+netem_options = {
+    'loss': ('loss', 'loss_corr'),
+    'duplicate': ('duplicate', 'dup_corr'),
+    'corrupt': ('prob_corrupt', 'corr_corrupt'),
+    'reorder': ('prob_reorder', 'corr_reorder'),
+}
+
+time_units = {'s': 1000000, 'sec': 1000000, 'ms': 1000, 'msec': 1000,
+              'us': 1, 'usec': 1}
+
+
+def _usec(value):
+    number = value.rstrip('abcdefghijklmnopqrstuvwxyz')
+    unit = value[len(number):] or 'us'
+    if unit not in time_units:
+        raise BadRequest('Invalid netem time: {}'.format(value))
+    return int(float(number) * time_units[unit])
+
+
+def _percent(value):
+    return float(value.rstrip('%'))
+
+
+def _u32(percent):
+    # The netem probability the kernel takes: 100% is 2 ** 32 - 1.
+    return int((2 ** 32 - 1) * percent / 100)
+
+
+def parse_netem(netem):
+    """Return the pyroute2 netem arguments for a tc netem rule.
+
+    For example 'netem delay 300ms 20ms distribution normal' gives
+    {'delay': 300000, 'jitter': 20000}. pyroute2 has no delay
+    distributions, so 'distribution' is ignored. pyroute2 0.5 passes the
+    duplicate probability to the kernel as is, so it is given as a u32.
+    """
+    tokens = netem.split()
+    if tokens and tokens[0] == 'netem':
+        tokens = tokens[1:]
+    params = {}
+    i = 0
+    while i < len(tokens):
+        option = tokens[i]
+        i += 1
+        if option == 'distribution':
+            i += 1
+            continue
+        values = []
+        while i < len(tokens) and tokens[i][:1].isdigit():
+            values.append(tokens[i])
+            i += 1
+        if not values:
+            raise BadRequest('Missing netem value: {}'.format(option))
+        if option == 'limit':
+            params['limit'] = int(values[0])
+        elif option == 'delay':
+            params['delay'] = _usec(values[0])
+            if len(values) > 1:
+                params['jitter'] = _usec(values[1])
+            if len(values) > 2:
+                params['delay_corr'] = _percent(values[2])
+        elif option in netem_options:
+            name, corr_name = netem_options[option]
+            params[name] = _percent(values[0])
+            if option == 'duplicate':
+                params[name] = _u32(params[name])
+            if len(values) > 1:
+                params[corr_name] = _percent(values[1])
+        else:
+            raise BadRequest('Unsupported netem option: {}'.format(option))
+    return params
+
+
+# Netem chaos: command -> (description, netem option, the parameters of the
+# option in tc order with their defaults). Every netem chaos also takes a
+# rate parameter, limiting the bandwidth of the interfaces.
+netem_specs = {
+    'delay': ('Delay network traffic.', 'delay', (
+        ('latency', '300ms'), ('jitter', '20ms'), ('correlation', None))),
+    'delay-long': ('Delay network traffic.', 'delay', (
+        ('latency', '5s'), ('jitter', '1s'), ('correlation', None))),
+    'drop': ('Drop network packets.', 'loss', (
+        ('percent', '50%'), ('correlation', '30%'))),
+    'corrupt': ('Corrupt network packets.', 'corrupt', (
+        ('percent', '50%'), ('correlation', '30%'))),
+    'duplicate': ('Duplicate network packets.', 'duplicate', (
+        ('percent', '50%'), ('correlation', '30%'))),
+}
+
+_netem_time = re.compile(r'\d+(\.\d+)?(s|sec|ms|msec|us|usec)$')
+_netem_percent = re.compile(r'\d+(\.\d+)?%$')
+netem_values = {
+    'latency': _netem_time,
+    'jitter': _netem_time,
+    'correlation': _netem_percent,
+    'percent': _netem_percent,
+    'rate': re.compile(r'\d+(\.\d+)?[kmgt]?(bit|bps)$'),
+}
+
+# Rules built by compile_netem(), by command and parameters.
+_netem_rules = {}
+
+
+def compile_netem(name, params):
+    """Return the tc netem rule of a netem chaos run with params.
+
+    For example ('delay', {'latency': '100ms', 'rate': '1mbit'}) gives
+    'netem delay 100ms 20ms distribution normal rate 1mbit'. Rules are
+    cached, so compiling the same parameters again is a dict lookup.
+
+    :raises BadRequest: When a parameter is unknown or its value is not
+        valid.
+    """
+    key = (name, tuple(sorted(params.items())))
+    rule = _netem_rules.get(key)
+    if rule is None:
+        rule = _netem_rules[key] = _compile_netem(name, params)
+    return rule
+
+
+def _compile_netem(name, params):
+    _, option, defaults = netem_specs[name]
+    names = set(param for param, _ in defaults)
+    names.add('rate')
+    for param, value in params.items():
+        if param not in names:
+            raise BadRequest('Invalid {} parameter: {}'.format(name, param))
+        if not netem_values[param].match(value) or (
+                value.endswith('%') and _percent(value) > 100):
+            raise BadRequest('Invalid {} value: {}={}'.format(
+                name, param, value))
+    values = [params.get(param, default) for param, default in defaults]
+    tokens = ['netem', option]
+    if option == 'delay':
+        latency, jitter, correlation = values
+        tokens.append(latency)
+        # tc only takes a correlation and a distribution with a jitter.
+        if _usec(jitter):
+            tokens.append(jitter)
+            if correlation is not None:
+                tokens.append(correlation)
+            tokens.extend(['distribution', 'normal'])
+    else:
+        tokens.extend(value for value in values if value is not None)
+    if 'rate' in params:
+        tokens.extend(['rate', params['rate']])
+    return ' '.join(tokens)
+
+
+# Partition parameters and their defaults: every peer and every port.
+partition_defaults = (('peers', 'any'), ('ports', 'any'))
+
+
+def _network(value):
+    address, slash, prefix = value.partition('/')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    try:
+        socket.inet_pton(family, address)
+    except (socket.error, ValueError):
+        return False
+    bits = 128 if family == socket.AF_INET6 else 32
+    # ipset hash:net sets do not take a zero prefix.
+    return not slash or (prefix.isdigit() and 0 < int(prefix) <= bits)
+
+
+def _port_range(value):
+    ports = value.split('-')
+    if len(ports) > 2 or not all(port.isdigit() for port in ports):
+        return False
+    return 0 < int(ports[0]) <= int(ports[-1]) <= 65535
+
+
+def parse_partition(params):
+    """Return the peer networks and the ports of a partition run with params.
+
+    peers lists addresses and networks, and ports lists ports and port
+    ranges, separated by '+'. For example
+    {'peers': '10.0.0.2+fd00::/64', 'ports': '17070+37017-37019'} gives
+    (['10.0.0.2', 'fd00::/64'], ['17070', '37017-37019']). 'any' gives
+    None, for every peer or every port.
+
+    :raises BadRequest: When a parameter is unknown or its value is not
+        valid.
+    """
+    values = dict(partition_defaults)
+    for param, value in params.items():
+        if param not in values:
+            raise BadRequest('Invalid partition parameter: {}'.format(param))
+        values[param] = value
+    parsed = []
+    for param, valid in (('peers', _network), ('ports', _port_range)):
+        if values[param] == 'any':
+            parsed.append(None)
+            continue
+        items = values[param].split('+')
+        if not all(valid(item) for item in items):
+            raise BadRequest('Invalid partition value: {}={}'.format(
+                param, values[param]))
+        parsed.append(items)
+    return tuple(parsed)
+
+
+def short_name(name):
+    """Return a name of at most 20 characters for the iptables chains and
+    the ipsets of a chaos command.
+
+    A parameterized command is named after its base command and a digest
+    of its parameters, so each parameterization has its own chains.
+    """
+    if '(' not in name:
+        return name[:20]
+    return '{}-{}'.format(name.partition('(')[0][:11],
+                          hashlib.sha1(name).hexdigest()[:8])
+
+
 class FirewallAction:
     """FirewallAction encapsulates a ufw command and a means of undoing it."""
 
-    def __init__(self, do_command, undo_command):
+    # The ipsets the iptables rules match against, as (name, type, entries)
+    # tuples. Sets are created in order and destroyed in reverse order.
+    ipsets = ()
+
+    # iptables rules equivalent to the ufw rules used by Net.
+    iptables_rules = {
+        'allow ssh': [('INPUT', '-p tcp --dport 22 -j ACCEPT'),
+                      ('OUTPUT', '-p tcp --sport 22 -j ACCEPT')],
+        'allow in to any': [('INPUT', '-j ACCEPT')],
+        'deny in to any': [('INPUT', '-j DROP')],
+        'deny out to any': [('OUTPUT', '-j DROP')],
+    }
+
+    def __init__(self, do_command, undo_command, iptables=None):
+        """
+        :param iptables: List of (chain, rule) pairs doing the same as
+            do_command, or None if it can not be done with iptables.
+        """
         self.do_command = do_command
         self.undo_command = undo_command
+        self.iptables = iptables
 
     def __repr__(self):
         return "{}({!r}, {!r})".format(
@@ -25,20 +276,28 @@ class FirewallAction:
     @classmethod
     def enable(cls):
         """Gives an action for enabling and disabling the firewalling."""
-        return cls("ufw --force enable", "ufw disable")
+        return cls("ufw --force enable", "ufw disable", iptables=[])
 
     @classmethod
-    def rule(cls, rule):
-        """Gives an action for creating and deleting a given firewall rule."""
+    def rule(cls, rule, devices=None, qdisc=None):
+        """Gives an action for creating and deleting a given firewall rule.
+
+        :param devices: Network interfaces netem rules apply to.
+        :param qdisc: TcQdisc or NetlinkQdisc installing netem rules.
+        """
         if rule.startswith('netem'):
-            return cls('tc qdisc add dev eth0 root {}'.format(rule),
-                       'tc qdisc del dev eth0 root')
-        return cls("ufw {}".format(rule), "ufw delete {}".format(rule))
+            return NetemAction(rule, devices or [FALLBACK_INTERFACE], qdisc)
+        return cls("ufw {}".format(rule), "ufw delete {}".format(rule),
+                   iptables=cls.iptables_rules.get(rule))
 
     @classmethod
     def deny_port_rule(cls, port):
         """Gives an action for allowing and denying a particular port."""
-        return cls.rule("deny {:d}".format(port))
+        action = cls.rule("deny {:d}".format(port))
+        action.iptables = [
+            ('INPUT', '-p {} --dport {:d} -j DROP'.format(protocol, port))
+            for protocol in ('tcp', 'udp')]
+        return action
 
     def do(self):
         """Runs command changing the firewall behaviour."""
@@ -49,48 +308,422 @@ class FirewallAction:
         run_shell_command(self.undo_command)
 
 
+class NetemAction(FirewallAction):
+    """NetemAction adds a netem root qdisc to interfaces and removes it."""
+
+    def __init__(self, netem, devices, qdisc=None):
+        self.netem = netem
+        self.devices = list(devices)
+        self.qdisc = qdisc or TcQdisc()
+        self.iptables = None
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(
+            self.__class__.__name__, self.netem, self.devices)
+
+    def do(self):
+        self.qdisc.add(self.devices, self.netem)
+
+    def undo(self):
+        self.qdisc.delete(self.devices)
+
+
+class TcQdisc:
+    """Add and delete root qdiscs by running tc for each interface."""
+
+    supports_rate = True
+
+    def add(self, devices, netem):
+        done = []
+        try:
+            for device in devices:
+                run_shell_command(
+                    'tc qdisc add dev {} root {}'.format(device, netem))
+                done.append(device)
+        except CalledProcessError:
+            self.delete(done, quiet_mode=True)
+            raise
+
+    def delete(self, devices, quiet_mode=False):
+        for device in devices:
+            run_shell_command('tc qdisc del dev {} root'.format(device),
+                              quiet_mode=quiet_mode)
+
+
+class NetlinkQdisc:
+    """Add and delete netem root qdiscs in-process over netlink.
+
+    Uses pyroute2, or any object with the IPRoute tc() and link_lookup()
+    methods, so every interface is changed from one netlink socket.
+    """
+
+    root_handle = 0x10000
+    # pyroute2 does not encode the netem rate option.
+    supports_rate = False
+
+    def __init__(self, ipr=None):
+        if ipr is None:
+            if IPRoute is None:
+                raise BadRequest('The netlink netem backend needs pyroute2.')
+            ipr = IPRoute()
+        self.ipr = ipr
+        self._indexes = {}
+
+    def index(self, device):
+        """Return the interface index of device."""
+        if device not in self._indexes:
+            indexes = self.ipr.link_lookup(ifname=device)
+            if not indexes:
+                raise NotFound('Network interface not found: {}'.format(
+                    device))
+            self._indexes[device] = indexes[0]
+        return self._indexes[device]
+
+    def add(self, devices, netem):
+        params = parse_netem(netem)
+        indexes = [self.index(device) for device in devices]
+        done = []
+        try:
+            for index in indexes:
+                self.ipr.tc('add', 'netem', index, self.root_handle, **params)
+                done.append(index)
+        except Exception:
+            for index in done:
+                self.ipr.tc('del', 'netem', index, self.root_handle)
+            raise
+
+    def delete(self, devices):
+        for device in devices:
+            self.ipr.tc('del', 'netem', self.index(device), self.root_handle)
+
+
+netem_backends = {
+    'tc': TcQdisc,
+    'netlink': NetlinkQdisc,
+}
+
+
+class UfwBackend:
+    """Apply the actions of a FirewallChaos one command at a time."""
+
+    def enable(self, name, actions):
+        for action in actions:
+            action.do()
+
+    def disable(self, name, actions):
+        for action in reversed(actions):
+            action.undo()
+
+
+class IptablesBackend:
+    """Apply the actions of a FirewallChaos as one iptables transaction.
+
+    The iptables rules of all actions are loaded into chains owned by the
+    chaos with a single iptables-restore call, so they take effect
+    together, and are removed together. Loopback traffic stays allowed, as
+    it is with ufw. Actions that have no iptables rules, such as tc
+    commands, are run one at a time.
+    """
+
+    restore_commands = (['iptables-restore', '--noflush'],
+                        ['ip6tables-restore', '--noflush'])
+    ipset_command = ['ipset', 'restore']
+
+    # Rules ufw applies before the user rules: loopback traffic and the
+    # replies to established connections are always accepted.
+    before_rules = [
+        ('INPUT', '-i lo -j ACCEPT'),
+        ('OUTPUT', '-o lo -j ACCEPT'),
+        ('INPUT', '-m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT'),
+        ('OUTPUT', '-m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT'),
+    ]
+
+    @staticmethod
+    def chain_names(name):
+        # iptables chain names are at most 28 characters long.
+        return dict((chain, 'cm-{}-{}'.format(short_name(name),
+                                              chain[0].lower()))
+                    for chain in ('INPUT', 'OUTPUT'))
+
+    @staticmethod
+    def compile_create_sets(actions):
+        """Return an ipset script creating the sets of actions."""
+        lines = []
+        for action in actions:
+            for set_name, set_type, entries in action.ipsets:
+                lines.append('create {} {} -exist'.format(set_name, set_type))
+                lines.append('flush {}'.format(set_name))
+                lines.extend('add {} {}'.format(set_name, entry)
+                             for entry in entries)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    @staticmethod
+    def compile_destroy_sets(actions):
+        """Return an ipset script destroying the sets of actions."""
+        lines = []
+        for action in reversed(actions):
+            lines.extend('destroy {}'.format(set_name)
+                         for set_name, _, _ in reversed(action.ipsets))
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    @classmethod
+    def compile_enable(cls, name, actions):
+        """Return an iptables-restore script adding the rules of actions."""
+        chains = cls.chain_names(name)
+        lines = ['*filter']
+        lines.extend(':{} - [0:0]'.format(c) for c in sorted(chains.values()))
+        for chain, rule in cls.before_rules:
+            lines.append('-A {} {}'.format(chains[chain], rule))
+        for action in actions:
+            for chain, rule in action.iptables or []:
+                lines.append('-A {} {}'.format(chains[chain], rule))
+        for chain, own_chain in sorted(chains.items()):
+            lines.append('-I {} 1 -j {}'.format(chain, own_chain))
+        lines.append('COMMIT')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def compile_disable(cls, name):
+        """Return an iptables-restore script removing the rules of name."""
+        chains = cls.chain_names(name)
+        lines = ['*filter']
+        for chain, own_chain in sorted(chains.items()):
+            lines.append('-D {} -j {}'.format(chain, own_chain))
+        # Declaring the chains flushes them, so they can be deleted.
+        lines.extend(':{} - [0:0]'.format(c) for c in sorted(chains.values()))
+        lines.extend('-X {}'.format(c) for c in sorted(chains.values()))
+        lines.append('COMMIT')
+        return '\n'.join(lines) + '\n'
+
+    def enable(self, name, actions):
+        for action in actions:
+            if action.iptables is None:
+                action.do()
+        sets = self.compile_create_sets(actions)
+        if sets:
+            run_shell_command(self.ipset_command, input_data=sets)
+        script = self.compile_enable(name, actions)
+        applied = []
+        try:
+            for command in self.restore_commands:
+                run_shell_command(command, input_data=script)
+                applied.append(command)
+        except CalledProcessError:
+            # Roll back the address families already changed.
+            for command in applied:
+                run_shell_command(command, quiet_mode=True,
+                                  input_data=self.compile_disable(name))
+            if sets:
+                run_shell_command(
+                    self.ipset_command, quiet_mode=True,
+                    input_data=self.compile_destroy_sets(actions))
+            raise
+
+    def disable(self, name, actions):
+        for command in self.restore_commands:
+            run_shell_command(command, input_data=self.compile_disable(name))
+        # Sets can only be destroyed once no rule refers to them.
+        sets = self.compile_destroy_sets(actions)
+        if sets:
+            run_shell_command(self.ipset_command, input_data=sets)
+        for action in reversed(actions):
+            if action.iptables is None:
+                action.undo()
+
+
+class PartitionAction(FirewallAction):
+    """PartitionAction drops the traffic exchanged with a set of peers.
+
+    The peers and the ports are held in ipsets, so a partition adds the
+    same few iptables rules however many peers and ports it lists. ufw has
+    no address sets, so the action applies its rules with iptables, even
+    when the chaos uses the ufw backend.
+    """
+
+    def __init__(self, name, networks=None, ports=None):
+        """
+        :param name: The command of the chaos, naming its chains and sets.
+        :param networks: Peer addresses and networks, or None for every
+            peer.
+        :param ports: Ports and port ranges, such as '37017-37019', or None
+            for every port.
+        """
+        self.name = name
+        self.networks = networks
+        self.ports = ports
+        prefix = 'cm-{}-'.format(short_name(name))
+        ipsets = []
+        # Allow ssh, like the other firewall chaos.
+        rules = list(self.iptables_rules['allow ssh'])
+        peer_matches = {'INPUT': [], 'OUTPUT': []}
+        if networks is not None:
+            # A list:set matches for both address families, so the same
+            # rules serve iptables and ip6tables.
+            v4 = [n for n in networks if ':' not in n]
+            v6 = [n for n in networks if ':' in n]
+            ipsets.append((prefix + '4', 'hash:net family inet', v4))
+            ipsets.append((prefix + '6', 'hash:net family inet6', v6))
+            ipsets.append((prefix + 'peers', 'list:set',
+                           [prefix + '4', prefix + '6']))
+            peer_matches = {
+                'INPUT': ['-m set --match-set {}peers src'.format(prefix)],
+                'OUTPUT': ['-m set --match-set {}peers dst'.format(prefix)],
+            }
+        for chain in ('INPUT', 'OUTPUT'):
+            if ports is None:
+                rules.append(
+                    (chain, ' '.join(peer_matches[chain] + ['-j DROP'])))
+                continue
+            # Match the ports at both ends, which cuts the connections
+            # made by the peers and those made to them.
+            for end in ('dst', 'src'):
+                rules.append((chain, ' '.join(peer_matches[chain] + [
+                    '-m set --match-set {}ports {}'.format(prefix, end),
+                    '-j DROP'])))
+        if ports is not None:
+            ipsets.append(
+                (prefix + 'ports', 'bitmap:port range 1-65535', ports))
+        self.ipsets = ipsets
+        self.iptables = rules
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, {!r})".format(
+            self.__class__.__name__, self.name, self.networks, self.ports)
+
+    def do(self):
+        IptablesBackend().enable(self.name, [self])
+
+    def undo(self):
+        IptablesBackend().disable(self.name, [self])
+
+
+firewall_backends = {
+    'ufw': UfwBackend,
+    'iptables': IptablesBackend,
+}
+
+
 class FirewallChaos(Chaos):
     """FirewallChaos contains a particular firewall chaos operation to run."""
 
     group = "net"
 
-    def __init__(self, name, description, *actions):
+    def __init__(self, name, description, *actions, **kwargs):
+        """
+        :param backend: UfwBackend or IptablesBackend applying the actions,
+            UfwBackend by default.
+        """
         self.command_str = name
         self.description = description
         self._actions = list(actions)
+        self.backend = kwargs.pop('backend', None) or UfwBackend()
+
+    @property
+    def resources(self):
+        """Return the firewall and the root qdiscs changed by the chaos."""
+        resources = set()
+        for action in self._actions:
+            if isinstance(action, NetemAction):
+                resources.update(
+                    'qdisc-root:{}'.format(d) for d in action.devices)
+            else:
+                resources.add('firewall')
+        return frozenset(resources)
 
     def enable(self):
-        for actions in self._actions:
-            actions.do()
+        self.backend.enable(self.command_str, self._actions)
 
     def disable(self):
-        for actions in reversed(self._actions):
-            actions.undo()
+        self.backend.disable(self.command_str, self._actions)
 
 
 class Net(ChaosMonkeyBase):
     """Net generates chaos actions that affect networking on a machine."""
 
-    def __init__(self):
+    def __init__(self, backend=None, interfaces=None, qdisc=None):
+        """
+        :param backend: UfwBackend or IptablesBackend.
+        :param interfaces: Network interfaces netem chaos applies to, by
+            default the interfaces with a default route.
+        :param qdisc: TcQdisc or NetlinkQdisc installing netem rules.
+        """
         super(Net, self).__init__()
+        self.backend = backend or UfwBackend()
+        self.interfaces = interfaces
+        self.qdisc = qdisc or TcQdisc()
 
     @classmethod
     def factory(cls):
         return cls()
 
+    def configure(self, settings):
+        """Select the backends and the interfaces from settings.
+
+        firewall_backend is 'ufw' or 'iptables', netem_backend is 'tc' or
+        'netlink' and interfaces is a resolve_interfaces() spec.
+        """
+        backend = settings.get('firewall_backend', 'ufw')
+        self.backend = firewall_backends[backend]()
+        self.qdisc = netem_backends[settings.get('netem_backend', 'tc')]()
+        self.interfaces = resolve_interfaces(
+            settings.get('interfaces', 'default'))
+
+    def netem(self, rule):
+        """Gives an action adding a netem rule to the chaos interfaces."""
+        if self.interfaces is None:
+            self.interfaces = resolve_interfaces('default')
+        return NetemAction(rule, self.interfaces, self.qdisc)
+
+    def netem_chaos(self, name, params=None):
+        """Return the FirewallChaos of a netem command run with params.
+
+        See netem_specs for the commands and their parameters.
+
+        :raises BadRequest: When params has a rate and the netem backend
+            can not limit the bandwidth.
+        """
+        params = params or {}
+        if 'rate' in params and not self.qdisc.supports_rate:
+            raise BadRequest(
+                'The netem backend does not support rate: {}'.format(
+                    join_command(name, params)))
+        chaos = FirewallChaos(
+            join_command(name, params), netem_specs[name][0],
+            self.netem(compile_netem(name, params)))
+        chaos.backend = self.backend
+        return chaos
+
+    def partition_chaos(self, params=None):
+        """Return the FirewallChaos of a partition run with params.
+
+        See parse_partition() for the parameters.
+        """
+        params = params or {}
+        name = join_command('partition', params)
+        networks, ports = parse_partition(params)
+        chaos = FirewallChaos(
+            name, 'Partition the machine from its peers, except ssh.',
+            PartitionAction(name, networks, ports))
+        chaos.backend = self.backend
+        return chaos
+
+    def parameterize(self, name, params):
+        """Return a netem chaos or a partition run with params, such as
+        delay(latency=100ms,jitter=10ms,correlation=25%,rate=1mbit) or
+        partition(peers=10.0.0.2+10.0.0.3,ports=37017).
+        """
+        if name == 'partition':
+            return self.partition_chaos(params)
+        if name not in netem_specs:
+            return None
+        return self.netem_chaos(name, params)
+
     def get_chaos(self):
         allow_ssh = FirewallAction.rule("allow ssh")
         allow_in_to_any = FirewallAction.rule("allow in to any")
         deny_in_to_any = FirewallAction.rule("deny in to any")
         deny_out_to_any = FirewallAction.rule("deny out to any")
-        delay = FirewallAction.rule(
-            "netem delay 300ms 20ms distribution normal")
-        delay_long = FirewallAction.rule(
-            'netem delay 5s 1s distribution normal')
-        drop = FirewallAction.rule('netem loss 50% 30%')
-        corrupt = FirewallAction.rule('netem corrupt 50% 30%')
-        duplicate = FirewallAction.rule('netem duplicate 50% 30%')
-        return [
+        chaos = [
             FirewallChaos(
                 'deny-all',
                 'Deny all incoming and outgoing network traffic except ssh.',
@@ -135,31 +768,10 @@ class Net(ChaosMonkeyBase):
                 allow_in_to_any,
                 FirewallAction.enable()
                 ),
-            FirewallChaos(
-                'delay',
-                'Delay network traffic.',
-                delay,
-                ),
-            FirewallChaos(
-                'delay-long',
-                'Delay network traffic.',
-                delay_long,
-                ),
-            FirewallChaos(
-                'drop',
-                'Drop network packets.',
-                drop,
-                ),
-            FirewallChaos(
-                'corrupt',
-                'Corrupt network packets.',
-                corrupt,
-            ),
-            FirewallChaos(
-                'duplicate',
-                'Duplicate network packets.',
-                duplicate,
-            ),
-
-
         ]
+        chaos.extend(self.netem_chaos(name) for name in (
+            'delay', 'delay-long', 'drop', 'corrupt', 'duplicate'))
+        chaos.append(self.partition_chaos())
+        for firewall_chaos in chaos:
+            firewall_chaos.backend = self.backend
+        return chaos
@@ -1,92 +1,263 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
-from chaos import (
-    kill,
-    net
+from collections import deque
+import glob
+import os
+
+from chaos import plugins as builtin_plugins
+from chaos_monkey_base import (
+    ChaosPlugin,
+    join_command,
+    LazyChaos,
+    split_command,
+)
+from selection import (
+    UniformSelector,
+    WeightedSelector,
+)
+from utility import (
+    BadRequest,
+    NotFound,
 )
 
 __metaclass__ = type
 
 
+# Environment variable holding extra directories of plugin metadata files.
+PLUGIN_PATH_ENV = 'CHAOS_MONKEY_PLUGIN_PATH'
+
+_registry = None
+
+
+def discover_plugins(plugin_path=None):
+    """Return the built-in ChaosPlugins and those found in plugin_path.
+
+    :param plugin_path: os.pathsep separated list of directories searched
+        for *.yaml plugin metadata files. Defaults to the
+        CHAOS_MONKEY_PLUGIN_PATH environment variable.
+    """
+    if plugin_path is None:
+        plugin_path = os.environ.get(PLUGIN_PATH_ENV, '')
+    plugins = list(builtin_plugins)
+    for plugin_dir in filter(None, plugin_path.split(os.pathsep)):
+        for file_path in sorted(glob.glob(os.path.join(plugin_dir, '*.yaml'))):
+            plugins.append(ChaosPlugin.from_file(file_path))
+    return plugins
+
+
+class ChaosRegistry:
+    """Index every available Chaos by command name and by group."""
+
+    def __init__(self, plugins):
+        self.plugins = plugins
+        self.chaos = []
+        self.commands = {}
+        self.groups = {}
+        # Parameterized commands found so far, by their spellings.
+        self.parameterized = {}
+        for plugin in plugins:
+            for chaos in plugin.get_chaos():
+                self.add(chaos)
+
+    @property
+    def factory_obj(self):
+        """Return the factory objects of the plugins imported so far."""
+        return [p.factory_obj for p in self.plugins if p.loaded]
+
+    def add(self, chaos):
+        """Add a Chaos to the catalogue and its indexes."""
+        self.chaos.append(chaos)
+        self.commands[chaos.command_str] = chaos
+        self.groups.setdefault(chaos.group, []).append(chaos)
+
+    def find(self, command_str):
+        """Return the Chaos of command_str, or None if there is none.
+
+        A parameterized command, such as 'delay(latency=100ms)', is built by
+        the plugin of its base command the first time it is found, and is
+        not added to the catalogue.
+
+        :raises BadRequest: When the parameters are not valid.
+        """
+        chaos = (self.commands.get(command_str) or
+                 self.parameterized.get(command_str))
+        if chaos is not None or not command_str.endswith(')'):
+            return chaos
+        name, params = split_command(command_str)
+        base = self.commands.get(name)
+        if base is None or not params:
+            return base
+        canonical = join_command(name, params)
+        chaos = self.parameterized.get(canonical)
+        if chaos is None:
+            if not isinstance(base, LazyChaos):
+                raise BadRequest(
+                    'Command takes no parameters: {}'.format(name))
+            chaos = LazyChaos(base.plugin, canonical, base.description)
+            # Check the parameters now, rather than when the chaos runs.
+            try:
+                chaos.resolve()
+            except NotFound:
+                raise BadRequest(
+                    'Command takes no parameters: {}'.format(name))
+            self.parameterized[canonical] = chaos
+        self.parameterized[command_str] = chaos
+        return chaos
+
+
 class ChaosMonkey:
     """Run chaos monkey commands."""
 
     def __init__(self, chaos, factory_obj):
         self.chaos = chaos
         self.factory_obj = factory_obj
+        self._policy = None
+        self._selector = None
+        self._selection_history = {}
+
+    @property
+    def policy(self):
+        """SelectionPolicy weighting and rate limiting selection, or None."""
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy):
+        self._policy = policy
+        self._selector = None
 
     @classmethod
     def factory(cls):
-        all_chaos, factory_obj = ChaosMonkey.get_all_chaos()
-        return cls([], factory_obj)
+        return cls([], ChaosMonkey.registry().factory_obj)
+
+    @staticmethod
+    def registry():
+        """Return the process-wide ChaosRegistry, building it on first use."""
+        global _registry
+        if _registry is None:
+            _registry = ChaosRegistry(discover_plugins())
+        return _registry
+
+    @staticmethod
+    def configure(**settings):
+        """Pass settings to every chaos plugin, see ChaosMonkeyBase."""
+        for plugin in ChaosMonkey.registry().plugins:
+            plugin.configure(settings)
+
+    @staticmethod
+    def reset_registry():
+        """Drop the process-wide ChaosRegistry so it is rebuilt on next use."""
+        global _registry
+        if _registry is not None:
+            for plugin in _registry.plugins:
+                plugin.configure({})
+        _registry = None
 
     @staticmethod
     def get_all_chaos():
         """Return all available Chaos Monkey commands."""
-        all_chaos = []
-        all_factory_obj = []
-        factories = [net.Net.factory, kill.Kill.factory]
-        for factory in factories:
-            factory_obj = factory()
-            all_factory_obj.append(factory_obj)
-            all_chaos.extend(factory_obj.get_chaos())
-        return all_chaos, all_factory_obj
+        registry = ChaosMonkey.registry()
+        return list(registry.chaos), registry.factory_obj
 
     def include_group(self, groups):
         """Make chaos commands in the given groups available to run."""
         if not groups:
             return
-        all_chaos, _ = ChaosMonkey.get_all_chaos()
+        self._selector = None
+        registry = ChaosMonkey.registry()
         if groups == 'all':
-            self.chaos = all_chaos
+            self.chaos = list(registry.chaos)
             return
-        self.chaos = self.get_groups(groups, all_chaos)
+        self.chaos = []
+        for group in groups:
+            self.chaos.extend(registry.groups.get(group, []))
 
     def exclude_group(self, groups):
         """Do not select chaos commands from the given groups."""
-        excluded_groups = self.get_groups(groups, self.chaos)
-        for group in excluded_groups:
-            self.chaos.remove(group)
+        excluded_groups = set(groups)
+        self._selector = None
+        self.chaos = [c for c in self.chaos if c.group not in excluded_groups]
 
     @staticmethod
     def get_all_groups():
         """Return all available groups."""
-        return list(set(c.group for c in ChaosMonkey.get_all_chaos()[0]))
+        return list(ChaosMonkey.registry().groups)
 
     @staticmethod
     def get_all_commands():
         """Return all available commands."""
-        return [c.command_str for c in ChaosMonkey.get_all_chaos()[0]]
+        return [c.command_str for c in ChaosMonkey.registry().chaos]
 
     @staticmethod
     def get_groups(groups, chaos):
         """Return the requested chaos operation groups."""
-        ret_groups = []
-        for group in groups:
-            ret_groups.extend([c for c in chaos if c.group == group])
-        return ret_groups
+        groups = set(groups)
+        return [c for c in chaos if c.group in groups]
 
     def include_command(self, commands):
-        """Explicitly make the given chaos commands available to run."""
-        all_chaos, _ = ChaosMonkey.get_all_chaos()
-        included_commands = [x for x in all_chaos if x.command_str in commands]
-        for cmd in included_commands:
-            if not self._find_command(self.chaos, cmd.command_str):
-                self.chaos.extend(included_commands)
+        """Explicitly make the given chaos commands available to run.
+
+        Spellings of the same command, such as 'delay()' and 'delay', or
+        parameters in another order, are included once.
+        """
+        self._selector = None
+        selected = set(c.command_str for c in self.chaos)
+        for command_str in commands:
+            chaos = ChaosMonkey.find_command(command_str)
+            if chaos is not None and chaos.command_str not in selected:
+                self.chaos.append(chaos)
+                selected.add(chaos.command_str)
 
     def exclude_command(self, commands):
-        """Do not select the given chaos commands."""
-        excluded_commands = (
-            [x for x in self.chaos if x.command_str in commands])
-        for cmd in excluded_commands:
-            self.chaos.remove(cmd)
+        """Do not select the given chaos commands.
+
+        Any spelling of an included command excludes it, as in
+        include_command().
+        """
+        excluded_commands = set()
+        for command_str in commands:
+            chaos = ChaosMonkey.find_command(command_str)
+            excluded_commands.add(
+                command_str if chaos is None else chaos.command_str)
+        self._selector = None
+        self.chaos = [
+            c for c in self.chaos if c.command_str not in excluded_commands]
 
     @staticmethod
-    def _find_command(chaos, command_str):
-        for item in chaos:
-            if item.command_str == command_str:
-                return item
-        return None
+    def find_command(command_str):
+        """Return the Chaos for command_str or None if it does not exist.
+
+        See ChaosRegistry.find() for parameterized commands.
+        """
+        return ChaosMonkey.registry().find(command_str)
 
     def reset_command_selection(self):
+        self._selector = None
         self.chaos = []
+
+    def selector(self):
+        """Return the selector picking from self.chaos under self.policy.
+
+        The selector is rebuilt after the selected commands or the policy
+        change; rate limit history is kept for the whole run.
+        """
+        if self._selector is None:
+            if self.policy is None:
+                self._selector = UniformSelector(self.chaos)
+            else:
+                self._selector = WeightedSelector(
+                    self.chaos, self.policy, self._selection_history)
+        return self._selector
+
+    def selection_history(self):
+        """Return the selection times of the rate limited commands, as a
+        dict of command_str to a list of times.
+        """
+        return dict((command_str, list(times))
+                    for command_str, times in self._selection_history.items())
+
+    def restore_selection_history(self, history):
+        """Restore selection times returned by selection_history(), so rate
+        limits hold across a restart of the unit.
+        """
+        for command_str, times in history.items():
+            self._selection_history[command_str] = deque(times)
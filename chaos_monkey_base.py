@@ -1,6 +1,17 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
 import abc
+import importlib
+import os
+import re
+import sys
+
+import yaml
+
+from utility import (
+    BadRequest,
+    NotFound,
+)
 
 __metaclass__ = type
 
@@ -11,6 +22,13 @@ class ChaosMonkeyBase:
     def __init__(self):
         pass
 
+    def configure(self, settings):
+        """Apply runner settings before get_chaos() is called.
+
+        :param settings: Dict of setting names to values. Settings that do
+            not apply to the derived class are ignored.
+        """
+
     @abc.abstractmethod
     def get_chaos(self):
         """Overridden by derived class and return Chaos objects.
@@ -19,15 +37,195 @@ class ChaosMonkeyBase:
         """
         raise NotImplemented
 
+    def parameterize(self, name, params):
+        """Return the Chaos of command name run with params.
+
+        :param params: Dict of parameter names to string values.
+        :return: None if the command takes no parameters.
+        :raises BadRequest: When a parameter is not valid.
+        """
+        return None
+
+
+_command_param = re.compile(r'([a-z][a-z0-9_-]*)=([^,()=\s]+)$')
+
+
+def split_command(command_str):
+    """Split a command into its name and its parameters.
+
+    'delay(latency=100ms,jitter=10ms)' gives
+    ('delay', {'latency': '100ms', 'jitter': '10ms'}), and 'delay' gives
+    ('delay', {}).
+
+    :raises BadRequest: When the parameters are not valid.
+    """
+    if not command_str.endswith(')'):
+        return command_str, {}
+    name, _, args = command_str[:-1].partition('(')
+    params = {}
+    for arg in filter(None, args.split(',')):
+        match = _command_param.match(arg.strip())
+        if match is None or match.group(1) in params:
+            raise BadRequest('Invalid command parameter: {}'.format(arg))
+        params[match.group(1)] = match.group(2)
+    return name, params
+
+
+def join_command(name, params):
+    """Return the command of name with params, the inverse of
+    split_command(). Parameters are sorted, so a command has one spelling.
+    """
+    if not params:
+        return name
+    return '{}({})'.format(name, ','.join(
+        '{}={}'.format(key, params[key]) for key in sorted(params)))
+
+
+# Resource held by a Chaos that can not run alongside any other Chaos.
+EXCLUSIVE = 'exclusive'
+
 
 class Chaos:
 
-    def __init__(self, enable, disable, group, command_str, description):
+    # Names of the resources the chaos changes while it is enabled. Two
+    # Chaos holding the same resource can not be enabled at the same time.
+    resources = frozenset()
+
+    def __init__(self, enable, disable, group, command_str, description,
+                 resources=None):
         self.enable = enable
         self.disable = disable
         self.group = group
         self.command_str = command_str
         self.description = description
+        if resources is not None:
+            self.resources = frozenset(resources)
 
     def __eq__(self, other):
         return self.command_str == other.command_str
+
+
+class ChaosPlugin:
+    """Describe the chaos a module provides without importing the module.
+
+    The commands are known up front from metadata, so listing or filtering
+    them is cheap; the module is imported the first time one of its
+    commands is enabled or disabled.
+    """
+
+    def __init__(self, module, factory, group, commands, path=None):
+        """
+        :param module: Dotted name of the module implementing the chaos.
+        :param factory: Name of the ChaosMonkeyBase class in the module.
+        :param group: Group of every command provided by the plugin.
+        :param commands: List of [command_str, description] pairs.
+        :param path: Directory added to sys.path before importing the
+            module, or None if the module is already importable.
+        """
+        self.module = module
+        self.factory = factory
+        self.group = group
+        self.commands = commands
+        self.path = path
+        self.settings = {}
+        self.factory_obj = None
+        self._chaos = None
+        # Parameterized Chaos built so far, by command.
+        self._parameterized = {}
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Create a ChaosPlugin from a YAML metadata file.
+
+        Example of a metadata file:
+            module: foo
+            factory: Foo
+            group: foo
+            commands:
+              - [foo-bar, Break foo.]
+
+        The module is looked up next to the metadata file.
+        """
+        with open(file_path) as f:
+            data = yaml.safe_load(f)
+        return cls(data['module'], data['factory'], data['group'],
+                   data['commands'], path=os.path.dirname(file_path))
+
+    @property
+    def loaded(self):
+        return self._chaos is not None
+
+    def load(self):
+        """Import the plugin module and return its Chaos by command name."""
+        if self._chaos is None:
+            if self.path and self.path not in sys.path:
+                sys.path.append(self.path)
+            module = importlib.import_module(self.module)
+            factory_obj = getattr(module, self.factory).factory()
+            factory_obj.configure(self.settings)
+            chaos = dict((c.command_str, c) for c in factory_obj.get_chaos())
+            self.factory_obj = factory_obj
+            self._chaos = chaos
+        return self._chaos
+
+    def configure(self, settings):
+        """Use settings for the Chaos built from now on."""
+        self.settings = settings
+        self.unload()
+
+    def unload(self):
+        """Forget the imported Chaos so the next load() rebuilds them."""
+        self.factory_obj = None
+        self._chaos = None
+        self._parameterized = {}
+
+    def resolve(self, command_str):
+        """Return the Chaos of command_str, building it if parameterized.
+
+        :raises KeyError: When the plugin does not provide the command.
+        """
+        chaos = self.load()
+        if command_str in chaos or not command_str.endswith(')'):
+            return chaos[command_str]
+        if command_str not in self._parameterized:
+            name, params = split_command(command_str)
+            built = self.factory_obj.parameterize(name, params)
+            if built is None:
+                raise KeyError(command_str)
+            self._parameterized[command_str] = built
+        return self._parameterized[command_str]
+
+    def get_chaos(self):
+        """Return a LazyChaos for each command declared by the plugin."""
+        return [LazyChaos(self, command_str, description)
+                for command_str, description in self.commands]
+
+
+class LazyChaos(Chaos):
+    """LazyChaos stands in for a Chaos that has not been imported yet."""
+
+    def __init__(self, plugin, command_str, description):
+        self.plugin = plugin
+        self.group = plugin.group
+        self.command_str = command_str
+        self.description = description
+
+    def resolve(self):
+        """Return the Chaos implementing this command."""
+        try:
+            return self.plugin.resolve(self.command_str)
+        except KeyError:
+            raise NotFound('{} does not provide command: {}'.format(
+                self.plugin.module, self.command_str))
+
+    @property
+    def enable(self):
+        return self.resolve().enable
+
+    @property
+    def disable(self):
+        return self.resolve().disable
+
+    @property
+    def resources(self):
+        return self.resolve().resources
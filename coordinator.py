@@ -0,0 +1,407 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Coordinate the chaos of the units of a deployment.
+
+A coordinator selects the chaos of every unit and hands it out as leases,
+so rules such as "at most one state server disrupted at once" hold across
+the fleet. The runner of each unit is an agent: it asks for a lease, runs
+the leased command for the lease duration and releases the lease.
+
+Agents talk to the coordinator in JSON lines, over TCP or a Unix socket:
+    {"op": "acquire", "unit": "juju-0", "role": "state-server",
+     "commands": ["deny-all", "kill-mongod"], "duration": 60}
+    {"lease": {"id": 3, "unit": "juju-0", "role": "state-server",
+               "command": "kill-mongod", "duration": 60}}
+When no command may run, the lease is null and "retry" holds the seconds
+to wait before asking again:
+    {"lease": null, "retry": 5}
+    {"op": "release", "id": 3}
+    {"released": true}
+Invalid requests are answered with {"error": "..."}.
+
+Run the coordinator on one machine:
+    python coordinator.py --policy fleet.yaml 0.0.0.0:9108
+and point the runners at it:
+    python runner.py --coordinator 10.0.0.1:9108 --role state-server ...
+"""
+from argparse import ArgumentParser
+import json
+import logging
+import random
+import signal
+import socket
+from SocketServer import (
+    StreamRequestHandler,
+    TCPServer,
+    ThreadingMixIn,
+    UnixStreamServer,
+)
+import threading
+from time import time
+
+import yaml
+
+from utility import (
+    BadRequest,
+    remove_socket,
+    split_address,
+)
+
+__metaclass__ = type
+
+
+class FleetPolicy:
+    """The rules every lease of the fleet obeys."""
+
+    def __init__(self, max_faults=1, budget=None, roles=None, commands=None,
+                 lease_grace=60, retry=5):
+        """
+        :param max_faults: Maximum number of leases held at once.
+        :param budget: Seconds of faults the fleet may run in total, or
+            None for no limit.
+        :param roles: Dict of unit role to the maximum number of units of
+            the role holding a lease at once.
+        :param commands: Dict of command to the maximum number of leases of
+            the command held at once.
+        :param lease_grace: Seconds a lease outlives its duration before it
+            is expired, when its agent does not release it.
+        :param retry: Seconds an agent denied a lease waits before asking
+            again.
+        """
+        self.max_faults = max_faults
+        self.budget = budget
+        self.roles = roles or {}
+        self.commands = commands or {}
+        self.lease_grace = lease_grace
+        self.retry = retry
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a FleetPolicy from a dict, see from_file()."""
+        data = data or {}
+        try:
+            budget = data.get('budget')
+            policy = cls(
+                max_faults=int(data.get('max-faults', 1)),
+                budget=None if budget is None else float(budget),
+                roles=dict((role, int(limit)) for role, limit in
+                           (data.get('roles') or {}).items()),
+                commands=dict((command_str, int(limit))
+                              for command_str, limit in
+                              (data.get('commands') or {}).items()),
+                lease_grace=float(data.get('lease-grace', 60)),
+                retry=float(data.get('retry', 5)))
+            limits = ([policy.max_faults] + policy.roles.values() +
+                      policy.commands.values())
+            if min(limits) < 0 or policy.lease_grace < 0 or (
+                    policy.retry <= 0 or (policy.budget or 0) < 0):
+                raise ValueError('Negative limit.')
+        except (AttributeError, TypeError, ValueError) as e:
+            raise BadRequest('Invalid fleet policy: {}'.format(e))
+        return policy
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Create a FleetPolicy from a YAML file.
+
+        Example of a policy file:
+            max-faults: 3
+            budget: 7200
+            roles:
+              state-server: 1
+            commands:
+              kill-mongod: 1
+              restart-unit: 1
+        """
+        with open(file_path) as f:
+            return cls.from_dict(yaml.safe_load(f))
+
+
+class Lease:
+    """The right of a unit to run a chaos command for a duration."""
+
+    def __init__(self, lease_id, unit, role, command_str, duration, start):
+        self.id = lease_id
+        self.unit = unit
+        self.role = role
+        self.command_str = command_str
+        self.duration = duration
+        self.start = start
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'unit': self.unit,
+            'role': self.role,
+            'command': self.command_str,
+            'duration': self.duration,
+        }
+
+
+class Coordinator:
+    """Hand out the leases of the fleet, following a FleetPolicy."""
+
+    def __init__(self, policy, clock=time, rng=random):
+        self.policy = policy
+        self.clock = clock
+        self.rng = rng
+        # Leases held, by id.
+        self.leases = {}
+        # Seconds of the budget used by the leases, held and released.
+        self.spent = 0
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, unit, role, commands, duration):
+        """Return a Lease of one of commands for unit, or None.
+
+        :param role: The role of the unit, or None.
+        :param duration: Maximum seconds the lease lasts.
+        """
+        now = self.clock()
+        self.expire(now)
+        policy = self.policy
+        if any(lease.unit == unit for lease in self.leases.values()):
+            return None
+        if len(self.leases) >= policy.max_faults:
+            return None
+        if policy.budget is not None:
+            duration = min(duration, policy.budget - self.spent)
+            if duration <= 0:
+                return None
+        if role in policy.roles and policy.roles[role] <= sum(
+                1 for lease in self.leases.values() if lease.role == role):
+            return None
+        held = {}
+        for lease in self.leases.values():
+            held[lease.command_str] = held.get(lease.command_str, 0) + 1
+        candidates = [c for c in sorted(set(commands))
+                      if c not in policy.commands or
+                      held.get(c, 0) < policy.commands[c]]
+        if not candidates:
+            return None
+        self._last_id += 1
+        lease = Lease(self._last_id, unit, role, self.rng.choice(candidates),
+                      duration, now)
+        self.leases[lease.id] = lease
+        self.spent += duration
+        logging.info('Leased {} to {} for {}s (lease {}).'.format(
+            lease.command_str, unit, duration, lease.id))
+        return lease
+
+    def release(self, lease_id):
+        """Release a lease, returning its unused time to the budget.
+
+        :return: False if the lease was not held.
+        """
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return False
+        self.spent -= max(0, lease.start + lease.duration - self.clock())
+        logging.info('Released lease {} of {} by {}.'.format(
+            lease.id, lease.command_str, lease.unit))
+        return True
+
+    def expire(self, now):
+        """Drop the leases their agents did not release in time."""
+        grace = self.policy.lease_grace
+        for lease in self.leases.values():
+            if now > lease.start + lease.duration + grace:
+                del self.leases[lease.id]
+                logging.warning('Expired lease {} of {} by {}.'.format(
+                    lease.id, lease.command_str, lease.unit))
+
+    def handle(self, request):
+        """Answer a request of the protocol, see the module docstring."""
+        try:
+            op = request.get('op')
+            with self._lock:
+                if op == 'acquire':
+                    lease = self.acquire(
+                        request['unit'], request.get('role'),
+                        request['commands'], float(request['duration']))
+                    if lease is None:
+                        return {'lease': None, 'retry': self.policy.retry}
+                    return {'lease': lease.to_dict()}
+                if op == 'release':
+                    return {'released': self.release(request['id'])}
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return {'error': 'Invalid request: {!r}'.format(e)}
+        return {'error': 'Invalid op: {!r}'.format(op)}
+
+
+class LoopbackTransport:
+    """Talk to a Coordinator in this process, as if over a socket."""
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    def call(self, request):
+        response = self.coordinator.handle(json.loads(json.dumps(request)))
+        return json.loads(json.dumps(response))
+
+
+class SocketTransport:
+    """Talk to a coordinator over TCP or a Unix socket."""
+
+    def __init__(self, address, timeout=10):
+        """
+        :param address: The address of the coordinator, see split_address().
+        """
+        self.address = split_address(address)
+        self.timeout = timeout
+
+    def call(self, request):
+        """Send request and return the response.
+
+        :raises socket.error: When the coordinator can not be reached.
+        """
+        family = (socket.AF_INET if isinstance(self.address, tuple)
+                  else socket.AF_UNIX)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            stream = sock.makefile('r+')
+            stream.write(json.dumps(request) + '\n')
+            stream.flush()
+            line = stream.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise socket.error('Connection closed by the coordinator.')
+        return json.loads(line)
+
+
+class LeaseAgent:
+    """Ask a coordinator for the leases of a unit."""
+
+    def __init__(self, transport, unit, role=None, retry=5):
+        """
+        :param retry: Seconds to wait before asking again when the
+            coordinator can not be reached.
+        """
+        self.transport = transport
+        self.unit = unit
+        self.role = role
+        self.retry = retry
+
+    def acquire(self, commands, duration):
+        """Return the lease dict granted, or None, and the seconds to wait
+        before asking again when no lease is granted.
+        """
+        response = self._call({
+            'op': 'acquire', 'unit': self.unit, 'role': self.role,
+            'commands': commands, 'duration': duration})
+        if response is None:
+            return None, self.retry
+        return response.get('lease'), response.get('retry')
+
+    def release(self, lease):
+        self._call({'op': 'release', 'id': lease['id']})
+
+    def _call(self, request):
+        try:
+            response = self.transport.call(request)
+        except (socket.error, ValueError) as e:
+            logging.warning('Coordinator unavailable: {}'.format(e))
+            return None
+        if 'error' in response:
+            raise BadRequest(response['error'])
+        return response
+
+
+class CoordinatorHandler(StreamRequestHandler):
+    """Answer the requests of an agent, one per line."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'error': 'Invalid JSON.'}
+            else:
+                response = self.server.coordinator.handle(request)
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+class ThreadingTCPServer(ThreadingMixIn, TCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+
+    daemon_threads = True
+
+
+def serve_coordinator(coordinator, address):
+    """Serve the coordinator from a daemon thread.
+
+    :param address: The address to listen on, see split_address().
+    :return: The server, to pass to stop_coordinator().
+    """
+    address = split_address(address)
+    if isinstance(address, tuple):
+        server = ThreadingTCPServer(address, CoordinatorHandler)
+    else:
+        remove_socket(address)
+        server = ThreadingUnixServer(address, CoordinatorHandler)
+    server.coordinator = coordinator
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def stop_coordinator(server):
+    """Stop serving the coordinator and remove the Unix socket, if any."""
+    server.shutdown()
+    server.server_close()
+    if isinstance(server, ThreadingUnixServer):
+        remove_socket(server.server_address)
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(
+        description='Coordinate the chaos of the units of a deployment.')
+    parser.add_argument(
+        'address', help='The address to listen on: a port or host:port, '
+                        'where the host defaults to 127.0.0.1, or the '
+                        'absolute path of a Unix socket.')
+    parser.add_argument(
+        '-p', '--policy', metavar='FILE', default=None,
+        help='YAML file of the rules of the fleet. By default a single '
+             'fault runs at once.')
+    args = parser.parse_args(argv)
+    try:
+        split_address(args.address)
+    except BadRequest as e:
+        parser.error(str(e))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    policy = (FleetPolicy.from_file(args.policy) if args.policy
+              else FleetPolicy())
+    server = serve_coordinator(Coordinator(policy), args.address)
+    logging.info('Coordinating chaos on {}'.format(args.address))
+    stopped = threading.Event()
+
+    def stop(sig_num, frame):
+        stopped.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopped.is_set():
+        signal.pause()
+    stop_coordinator(server)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Read and export the chaos event log, chaos_run_list.log.
+
+Every event is a JSON object on its own line:
+    {"mono":812.031211,"time":1445000000.5,"offset":95.012,"event":"enable",
+     "command":"deny-all","duration":30,"latency":0.042,"outcome":"ok"}
+
+"mono" is a monotonic clock reading, "offset" the seconds from the start of
+the run to the start of the event, "duration" the enablement timeout and
+"latency" the seconds spent enabling or disabling the chaos.
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import json
+from time import time
+
+from utility import (
+    monotonic,
+    StructuredMessage,
+)
+
+__metaclass__ = type
+
+
+ENABLE = 'enable'
+DISABLE = 'disable'
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+_line = ('{{"mono":{:.6f},"time":{:.6f},"offset":{},"event":{},'
+         '"command":{},"duration":{},"latency":{},"outcome":{}}}')
+
+
+class EventMessage:
+    """A chaos event, logged as one JSON line."""
+
+    def __init__(self, event, command, duration=None, latency=None,
+                 outcome='ok', offset=None):
+        self.mono = monotonic()
+        self.time = time()
+        self.offset = offset
+        self.event = event
+        self.command = command
+        self.duration = duration
+        self.latency = latency
+        self.outcome = outcome
+
+    def __str__(self):
+        return _line.format(
+            self.mono, self.time,
+            'null' if self.offset is None else '{:.6f}'.format(self.offset),
+            _encode(self.event), _encode(self.command),
+            _encode(self.duration), _encode(self.latency),
+            _encode(self.outcome))
+
+
+def read_events(lines):
+    """Return the events of an event log, as dicts, from its lines."""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def commands_from_events(events):
+    """Return the [command, enablement timeout] of each enable event.
+
+    The offset of the event is appended when it was recorded.
+    """
+    commands = []
+    for e in events:
+        if e['event'] == ENABLE:
+            command = [str(e['command']), e['duration']]
+            if e.get('offset') is not None:
+                command.append(e['offset'])
+            commands.append(command)
+    return commands
+
+
+def export_yaml(lines):
+    """Return the events as the YAML command list logged by earlier
+    versions, which --replay accepts.
+    """
+    return ''.join(str(StructuredMessage(*command)) + '\n'
+                   for command in commands_from_events(read_events(lines)))
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(
+        description='Export a chaos event log as a YAML command list.')
+    parser.add_argument('log', help='Path to chaos_run_list.log.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.log) as f:
+        print(export_yaml(f), end='')
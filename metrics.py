@@ -0,0 +1,265 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Count what the runner does, in the Prometheus text format.
+
+The counters of a command are allocated when the command is added, so
+recording an event only increments numbers. The metrics are served over
+HTTP, on a TCP port or a Unix socket, by serve_metrics():
+    curl http://127.0.0.1:9107/metrics
+    curl --unix-socket /path/metrics.sock http://localhost/metrics
+"""
+from BaseHTTPServer import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from bisect import bisect_left
+import os
+from SocketServer import UnixStreamServer
+import threading
+
+from utility import (
+    remove_socket,
+    split_address,
+)
+
+__metaclass__ = type
+
+
+# Indexes of the outcome counters.
+OK = 0
+ERROR = 1
+# A shell command that failed in quiet mode.
+IGNORED = 2
+OUTCOMES = ('ok', 'error', 'ignored')
+
+LATENCY_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram:
+    """Count observations in fixed buckets, by their upper bound."""
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        # The last bucket counts the values above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Yield the sample lines of the histogram."""
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, total)
+        total += self.counts[-1]
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, total)
+        yield '{}_sum{{{}}} {!r}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, total)
+
+
+class CommandMetrics:
+    """The metrics of a chaos command."""
+
+    def __init__(self):
+        # Enable and disable counts, indexed by outcome.
+        self.enabled = [0, 0]
+        self.disabled = [0, 0]
+        self.enable_latency = Histogram()
+        self.disable_latency = Histogram()
+        self.enabled_seconds = 0.0
+        # Monotonic time the chaos was last enabled, while it is enabled.
+        self.enabled_since = None
+
+
+class ShellMetrics:
+    """The metrics of a shell program."""
+
+    def __init__(self):
+        self.calls = [0, 0, 0]
+        self.latency = Histogram()
+
+
+class Metrics:
+    """The metrics of a Chaos Monkey run."""
+
+    def __init__(self, commands=()):
+        self.commands = {}
+        self.add_commands(commands)
+        self.programs = {}
+        self.active_faults = 0
+        self.loop_iterations = 0
+        self.rate_limited = 0
+
+    def add_commands(self, commands):
+        """Allocate the metrics of commands not counted yet."""
+        for command_str in commands:
+            self._command(command_str)
+
+    def _command(self, command_str):
+        command = self.commands.get(command_str)
+        if command is None:
+            command = self.commands[command_str] = CommandMetrics()
+        return command
+
+    def chaos_enabled(self, command_str, latency, outcome, now):
+        """Count an enable of a chaos command.
+
+        :param now: The monotonic time the enable ended.
+        """
+        command = self._command(command_str)
+        command.enabled[outcome] += 1
+        command.enable_latency.observe(latency)
+        if outcome == OK:
+            command.enabled_since = now
+
+    def chaos_disabled(self, command_str, latency, outcome, now):
+        """Count a disable of a chaos command.
+
+        :param now: The monotonic time the disable ended.
+        """
+        command = self._command(command_str)
+        command.disabled[outcome] += 1
+        command.disable_latency.observe(latency)
+        if command.enabled_since is not None:
+            command.enabled_seconds += now - command.enabled_since
+            command.enabled_since = None
+
+    def shell_command(self, program, latency, outcome):
+        """Count a run of a shell program.
+
+        :param outcome: One of OUTCOMES.
+        """
+        shell = self.programs.get(program)
+        if shell is None:
+            shell = self.programs[program] = ShellMetrics()
+        shell.calls[OUTCOMES.index(outcome)] += 1
+        shell.latency.observe(latency)
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        lines = []
+
+        def add(name, metric_type, help_text, samples):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            lines.extend(samples)
+
+        commands = sorted(
+            (_label('command', c), m) for c, m in self.commands.items())
+        programs = sorted(
+            (_label('program', p), m) for p, m in self.programs.items())
+        add('chaos_enable_total', 'counter',
+            'Chaos commands enabled, by outcome.',
+            _outcomes('chaos_enable_total', commands, 'enabled'))
+        add('chaos_disable_total', 'counter',
+            'Chaos commands disabled, by outcome.',
+            _outcomes('chaos_disable_total', commands, 'disabled'))
+        add('chaos_enable_seconds', 'histogram',
+            'Time taken to enable chaos commands.',
+            _histograms('chaos_enable_seconds', commands, 'enable_latency'))
+        add('chaos_disable_seconds', 'histogram',
+            'Time taken to disable chaos commands.',
+            _histograms('chaos_disable_seconds', commands, 'disable_latency'))
+        add('chaos_enabled_seconds_total', 'counter',
+            'Time chaos commands were enabled, until their last disable.',
+            ('chaos_enabled_seconds_total{{{}}} {!r}'.format(
+                labels, m.enabled_seconds) for labels, m in commands))
+        add('chaos_active_faults', 'gauge',
+            'Chaos commands enabled now.',
+            ['chaos_active_faults {}'.format(self.active_faults)])
+        add('chaos_loop_iterations_total', 'counter',
+            'Iterations of the sequential run loop.',
+            ['chaos_loop_iterations_total {}'.format(self.loop_iterations)])
+        add('chaos_rate_limited_total', 'counter',
+            'Iterations in which every command was rate limited.',
+            ['chaos_rate_limited_total {}'.format(self.rate_limited)])
+        add('chaos_shell_commands_total', 'counter',
+            'Shell commands run, by program and outcome.',
+            _outcomes('chaos_shell_commands_total', programs, 'calls'))
+        add('chaos_shell_seconds', 'histogram',
+            'Time taken by shell commands.',
+            _histograms('chaos_shell_seconds', programs, 'latency'))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics to path, replacing the previous file."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp_path, path)
+
+
+def _label(name, value):
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+    return '{}="{}"'.format(name, value)
+
+
+def _outcomes(name, metrics, attribute):
+    for labels, m in metrics:
+        for outcome, count in zip(OUTCOMES, getattr(m, attribute)):
+            yield '{}{{{},outcome="{}"}} {}'.format(
+                name, labels, outcome, count)
+
+
+def _histograms(name, metrics, attribute):
+    for labels, m in metrics:
+        for line in getattr(m, attribute).samples(name, labels):
+            yield line
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answer every GET with the metrics of the server."""
+
+    def do_GET(self):
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(UnixStreamServer):
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # BaseHTTPRequestHandler expects a (host, port) client address.
+        return request, ('local', 0)
+
+
+def serve_metrics(metrics, address):
+    """Serve metrics over HTTP from a daemon thread.
+
+    :param address: A Unix socket path, a port or a host:port. The host
+        defaults to 127.0.0.1.
+    :return: The server, to pass to stop_metrics().
+    """
+    address = split_address(address)
+    if isinstance(address, tuple):
+        server = HTTPServer(address, MetricsHandler)
+    else:
+        remove_socket(address)
+        server = UnixHTTPServer(address, MetricsHandler)
+    server.metrics = metrics
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def stop_metrics(server):
+    """Stop serving metrics and remove the Unix socket, if any."""
+    server.shutdown()
+    server.server_close()
+    if isinstance(server, UnixHTTPServer):
+        remove_socket(server.server_address)
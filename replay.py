@@ -0,0 +1,118 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from bisect import bisect_left
+import json
+
+import yaml
+
+from event_log import ENABLE
+from utility import BadRequest
+
+__metaclass__ = type
+
+
+def read_replay(f, offset=0):
+    """Yield the commands of a replay file, reading it lazily from offset.
+
+    The file holds one command per line, either as an event from
+    chaos_run_list.log, where only enable events are commands, or as a
+    YAML list item:
+        {"event":"enable","command":"deny-all","duration":2,...}
+        - [deny-incoming, 2]
+
+    A YAML list item may span several lines, as long as its following
+    lines are indented. A list item may hold a third value, the seconds from
+    the start of the run to the start of the command:
+        - [deny-incoming, 2, 30.5]
+
+    :return: Iterator of (command_str, enablement_timeout, start,
+        end_offset), where start is None when it was not recorded and
+        end_offset is the offset of the next command in the file.
+    """
+    f.seek(offset)
+    item = []
+    item_end = offset
+    while True:
+        line = f.readline()
+        if item and not line[:1].isspace():
+            yield _parse_yaml_item(''.join(item)) + (item_end,)
+            item = []
+        if not line:
+            return
+        item_end = f.tell()
+        stripped = line.strip()
+        if item or stripped.startswith('-'):
+            item.append(line)
+        elif stripped.startswith('{'):
+            event = _parse_json(stripped)
+            if event.get('event') == ENABLE:
+                yield _command(event.get('command'), event.get('duration'),
+                               event.get('offset'), stripped) + (item_end,)
+        elif stripped.startswith('['):
+            command = _parse_array(_parse_json(stripped), stripped)
+            yield _command(*command) + (item_end,)
+        elif stripped and not stripped.startswith('#'):
+            raise BadRequest('Invalid replay line: {}'.format(stripped))
+
+
+def _parse_json(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        raise BadRequest('Invalid replay line: {}'.format(line))
+
+
+def _parse_yaml_item(text):
+    try:
+        data = yaml.safe_load(text)
+    except yaml.YAMLError:
+        data = None
+    if not isinstance(data, list) or len(data) != 1:
+        raise BadRequest('Invalid replay item: {}'.format(text.strip()))
+    return _command(*_parse_array(data[0], text.strip()))
+
+
+def _parse_array(data, source):
+    """Return [command, enablement timeout, start] and source."""
+    if not isinstance(data, list) or len(data) not in (2, 3):
+        raise BadRequest('Invalid replay item: {}'.format(source))
+    return data + [None] * (3 - len(data)) + [source]
+
+
+def _command(command_str, enablement_timeout, start, source):
+    if not isinstance(command_str, basestring) or not isinstance(
+            enablement_timeout, (int, long, float)) or not isinstance(
+            start, (int, long, float, type(None))):
+        raise BadRequest('Invalid replay command: {}'.format(source))
+    return str(command_str), enablement_timeout, start
+
+
+class DriftHistogram:
+    """Count how late replayed commands start, by powers of ten seconds."""
+
+    bounds = (0.001, 0.01, 0.1, 1, 10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.max = 0
+        self.skipped = 0
+
+    def add(self, drift):
+        """Count a command that started drift seconds after its schedule."""
+        self.counts[bisect_left(self.bounds, drift)] += 1
+        self.max = max(self.max, drift)
+
+    def skip(self, drift):
+        """Count a command that was drift seconds late when it was skipped,
+        because its window had passed.
+        """
+        self.add(drift)
+        self.skipped += 1
+
+    def __str__(self):
+        labels = ['<={}s'.format(b) for b in self.bounds]
+        labels.append('>{}s'.format(self.bounds[-1]))
+        return '{}, max {:.3f}s, {} skipped'.format(
+            ', '.join('{}: {}'.format(label, count)
+                      for label, count in zip(labels, self.counts)),
+            self.max, self.skipped)
@@ -1,30 +1,77 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from contextlib import closing
 import errno
+import fcntl
+from itertools import islice
 import logging
 import os
 import random
 import signal
+import socket
+from StringIO import StringIO
 import sys
-from time import (
-    time,
-    sleep
-)
-
-import yaml
+from time import time
 
-from chaos.kill import Kill
+from chaos.kill import (
+    Kill,
+    parse_match,
+)
 from chaos_monkey import ChaosMonkey
+from coordinator import (
+    LeaseAgent,
+    SocketTransport,
+)
+from event_log import (
+    DISABLE,
+    ENABLE,
+    EventMessage,
+)
+from metrics import (
+    ERROR,
+    Metrics,
+    OK,
+    serve_metrics,
+    stop_metrics,
+)
+from replay import (
+    DriftHistogram,
+    read_replay,
+)
+from selection import SelectionPolicy
+from scheduler import (
+    derive_seed,
+    FaultScheduler,
+    read_plan,
+    read_plan_header,
+    write_plan,
+)
+from simulation import (
+    Simulation,
+    write_report,
+)
 from utility import (
     BadRequest,
     ensure_dir,
+    monotonic,
     NotFound,
+    set_metrics,
+    set_shell_helper,
     setup_logging,
+    split_address,
     split_arg_string,
-    StructuredMessage,
+    stop_log_queues,
 )
 from utils.init import Init
+from utils.process import ProcessFinder
+from utils.run_state import (
+    read_run_state,
+    remove_run_state,
+    write_run_state,
+)
+from utils.shell_helper import ShellHelper
+from utils.waiter import Waiter
 
 
 class Runner:
@@ -38,60 +85,145 @@ class Runner:
         self.stop_chaos = False
         self.workspace_lock = False
         self.lock_file = '{}/{}'.format(self.workspace, 'chaos_runner.lock')
+        # Open descriptor holding the flock on lock_file.
+        self.lock_fd = None
         self.chaos_monkey = chaos_monkey
         self.expire_time = None
         self.cmd_log_name = cmd_log_name
         self.replay_filename_ext = '.part'
+        self.plan_file = '{}/{}'.format(self.workspace, 'chaos_plan.jsonl')
+        self.simulation_file = '{}/{}'.format(
+            self.workspace, 'chaos_simulation.json')
+        self.metrics_file = '{}/{}'.format(
+            self.workspace, 'chaos_metrics.prom')
+        self.metrics = Metrics()
+        self.waiter = Waiter()
+        # Events are logged with their offset from this monotonic time.
+        self.run_start = monotonic()
+        # Commands of the enabled chaos that have a disable method.
+        self.active_chaos = set()
+        # Offset in the replay file of the next command to replay.
+        self.replay_offset = None
+        # Number of entries of the seeded plan already run or skipped.
+        self.plan_position = 0
+        # LeaseAgent of the coordinator selecting the commands, if any.
+        self.agent = None
 
     @classmethod
-    def factory(cls, workspace, log_count=1, dry_run=False):
+    def factory(cls, workspace, log_count=1, dry_run=False, log_queue=0):
+        """Create a Runner logging to the workspace.
+
+        :param log_queue: Size of the queues the logs are written through
+            from a background thread, or 0 to write them directly.
+        """
         log_dir_path = os.path.join(workspace, 'log')
         ensure_dir(log_dir_path)
         log_file = os.path.join(log_dir_path, 'results.log')
         cmd_log_file = os.path.join(log_dir_path, 'chaos_run_list.log')
         cmd_log_name = 'cmd_log'
-        setup_logging(log_path=log_file, log_count=log_count)
+        setup_logging(log_path=log_file, log_count=log_count,
+                      queue_size=log_queue)
         setup_logging(
             log_path=cmd_log_file, log_count=log_count,  name=cmd_log_name,
-            add_stream=False, disable_formatter=True)
+            add_stream=False, disable_formatter=True, queue_size=log_queue)
         chaos_monkey = ChaosMonkey.factory()
         return cls(workspace, chaos_monkey, log_count, dry_run, cmd_log_name)
 
     def acquire_lock(self, restart=False):
-        """Acquire a lock before running Chaos Monkey."""
+        """Acquire a lock before running Chaos Monkey.
+
+        The lock is an flock on the lock file, which the kernel releases
+        however the runner exits. The file records the PID and start time of
+        the runner. Earlier versions locked the workspace by creating the
+        file, so an existing file is honoured while the runner it records is
+        alive, unless restart is set.
+        """
         if not os.path.isdir(self.workspace):
             sys.stderr.write('Not a directory: {}\n'.format(self.workspace))
             sys.exit(-1)
-        init = Init.upstart()
-        init.uninstall()
-        try:
-            file_flag = ((os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-                         if not restart else (os.O_CREAT | os.O_WRONLY))
-            lock_fd = os.open(self.lock_file, file_flag)
-        except OSError as e:
-            if e.errno == errno.EEXIST:
+        if not restart:
+            # A state left by a restart that did not happen is stale.
+            remove_run_state(Init.detect().state_path)
+        while True:
+            lock_fd = os.open(self.lock_file, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                os.close(lock_fd)
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
                 sys.stderr.write('Lock file already exists: {}\n'.format(
                     self.lock_file))
+                sys.exit(-1)
+            # Retry if the runner that held the lock removed the file.
+            if self._is_lock_file(lock_fd):
+                break
+            os.close(lock_fd)
+        owner = os.read(lock_fd, 64)
+        if not restart and self._lock_owner_alive(
+                owner, os.fstat(lock_fd).st_mtime):
+            os.close(lock_fd)
+            sys.stderr.write('Lock file already exists: {}\n'.format(
+                self.lock_file))
             sys.exit(-1)
-        os.write(lock_fd, str(os.getpid()))
+        pid = os.getpid()
+        os.ftruncate(lock_fd, 0)
+        os.lseek(lock_fd, 0, os.SEEK_SET)
+        os.write(lock_fd, '{} {:.2f}'.format(
+            pid, ProcessFinder().started_at(pid) or 0))
         os.fsync(lock_fd)
-        os.close(lock_fd)
+        self.lock_fd = lock_fd
         self.workspace_lock = True
         self.verify_lock()
 
+    @staticmethod
+    def _lock_owner_alive(owner, mtime):
+        """Return True if the runner recorded in a lock file is alive.
+
+        :param owner: Content of the lock file, the PID of the runner
+            followed by its start time, or only the PID for earlier versions.
+        :param mtime: Modification time of the lock file. A process started
+            after it only reuses the PID of the runner that wrote the file.
+        """
+        fields = owner.split()
+        try:
+            pid = int(fields[0])
+            start_time = float(fields[1]) if len(fields) > 1 else None
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False
+        started_at = ProcessFinder().started_at(pid)
+        if started_at is None:
+            return False
+        if start_time is not None:
+            return abs(started_at - start_time) < 1
+        return started_at <= mtime + 1
+
+    def _is_lock_file(self, lock_fd):
+        """Return True if lock_fd is open on the current lock file."""
+        try:
+            stat = os.stat(self.lock_file)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        lock_stat = os.fstat(lock_fd)
+        return (stat.st_dev, stat.st_ino) == (
+            lock_stat.st_dev, lock_stat.st_ino)
+
     def verify_lock(self):
         if not self.workspace_lock:
             raise NotFound("Workspace is not locked.")
-        with open(self.lock_file, 'r') as lock_file:
-            pid = lock_file.read()
-        expected_pid = str(os.getpid())
-        if pid != expected_pid:
-            raise NotFound('Unexpected pid: {} in {}, expected: {}'.format(
-                pid, self.lock_file, expected_pid))
+        if not self._is_lock_file(self.lock_fd):
+            raise NotFound('Lock file removed or replaced: {}'.format(
+                self.lock_file))
 
     def random_chaos(self, run_timeout, enablement_timeout, include_group=None,
                      exclude_group=None, include_command=None,
-                     exclude_command=None, run_once=False, expire_time=None):
+                     exclude_command=None, run_once=False, expire_time=None,
+                     max_faults=1, min_enablement_timeout=None, stagger=0,
+                     seed=None, seed_key=None):
         """
         Run random chaos commands.
 
@@ -114,38 +246,289 @@ class Runner:
         :param expire_time: Future UNIX timestamp at which time Chaos
             should stop. If expire_time is set, "run_timeout" will be
             ignored.
+        :param max_faults: Maximum number of chaos commands enabled at the
+            same time. When greater than one, commands are run by a
+            FaultScheduler and enablement_timeout is the longest time a
+            command stays enabled.
+        :param min_enablement_timeout: Shortest time a command scheduled
+            with max_faults stays enabled. Defaults to enablement_timeout.
+        :param stagger: Minimum number of seconds between the start of two
+            commands scheduled with max_faults.
+        :param seed: Seed of a reproducible run. The whole schedule is
+            planned up front, written to the plan file in the workspace and
+            then run from that file.
+        :param seed_key: Key deriving a distinct seed from seed, such as the
+            unit name, so units sharing a seed run different schedules.
         :return: None
+
+        When the runner has an agent, each command is leased from a
+        coordinator, which selects it and may shorten its enablement, see
+        coordinator.py. max_faults, seed and the selection policy are
+        ignored.
         """
         self.filter_commands(
             include_group=include_group, exclude_group=exclude_group,
             include_command=include_command, exclude_command=exclude_command)
         self.expire_time = expire_time or (time() + run_timeout)
+        if self.agent is not None:
+            while time() < self.expire_time and not self.stop_chaos:
+                if self._run_leased_command(enablement_timeout) and run_once:
+                    break
+            return
+        if seed is not None:
+            rng = random.Random(derive_seed(seed, seed_key))
+            scheduler = FaultScheduler(
+                self.chaos_monkey.chaos, self._enable_chaos,
+                self._disable_chaos, max_faults, enablement_timeout,
+                min_duration=min_enablement_timeout, stagger=stagger,
+                wait=self.waiter.wait, rng=rng,
+                selector=self.chaos_monkey.selector())
+            self._run_plan(scheduler, seed, seed_key, run_once)
+            if self.dry_run:
+                header, entries = read_plan(self.plan_file)
+                self._simulate(
+                    scheduler, header['expire_time'] - header['start_time'],
+                    islice(entries, 1) if run_once else entries)
+            return
+        if self.dry_run:
+            # The sequential run is a FaultScheduler with a single slot.
+            scheduler = FaultScheduler(
+                self.chaos_monkey.chaos, None, None,
+                1 if run_once else max_faults, enablement_timeout,
+                min_duration=min_enablement_timeout, stagger=stagger,
+                rng=random.Random(), selector=self.chaos_monkey.selector())
+            run_timeout = self.expire_time - time()
+            if run_once:
+                run_timeout = min(run_timeout, enablement_timeout)
+            self._simulate(scheduler, run_timeout)
+            return
+        if max_faults > 1 and not run_once:
+            scheduler = FaultScheduler(
+                self.chaos_monkey.chaos, self._enable_chaos,
+                self._disable_chaos, max_faults, enablement_timeout,
+                min_duration=min_enablement_timeout, stagger=stagger,
+                wait=self.waiter.wait, selector=self.chaos_monkey.selector())
+            scheduler.run(self.expire_time, lambda: self.stop_chaos)
+            return
         while time() < self.expire_time:
-            if self.stop_chaos or self.dry_run:
+            if self.stop_chaos:
                 break
             self._run_command(enablement_timeout)
             if run_once:
                 break
 
+    def _run_plan(self, scheduler, seed, seed_key, run_once=False):
+        """Plan a seeded run, or resume its plan after a reboot, and run it.
+        """
+        header = read_plan_header(self.plan_file)
+        # The expire time passed back after a reboot may be rounded.
+        if (header is None or header.get('seed') != seed or
+                header.get('seed_key') != seed_key or
+                abs(header.get('expire_time', 0) - self.expire_time) >= 1):
+            start_time = time()
+            entries = scheduler.plan(self.expire_time - start_time)
+            write_plan(self.plan_file, entries, seed=seed, seed_key=seed_key,
+                       start_time=start_time, expire_time=self.expire_time)
+            logging.info('Planned {} commands with seed {} in {}'.format(
+                len(entries), seed, self.plan_file))
+            self.plan_position = 0
+        if self.stop_chaos or self.dry_run:
+            return
+        header, entries = read_plan(self.plan_file)
+        # Resume after the entries run before a restart, including the
+        # restart itself, whose window may not have ended yet.
+        entries = self._track_plan(islice(entries, self.plan_position, None))
+        if run_once:
+            entries = islice(entries, 1)
+        scheduler.run_plan(
+            entries, header['start_time'], lambda: self.stop_chaos)
+
+    def _track_plan(self, entries):
+        """Yield entries, counting them in plan_position as they are run."""
+        for entry in entries:
+            self.plan_position += 1
+            yield entry
+
+    def _simulate(self, scheduler, run_timeout, entries=None):
+        """Simulate a run on a virtual clock and write its report.
+
+        :param scheduler: FaultScheduler whose run is simulated.
+        :param entries: Entries of a plan to simulate instead of a random
+            schedule.
+        """
+        simulation = Simulation()
+        if entries is None:
+            simulation.run(scheduler, run_timeout)
+        else:
+            simulation.run_plan(scheduler, entries)
+        report = simulation.report(
+            run_timeout, [c.command_str for c in self.chaos_monkey.chaos])
+        write_report(self.simulation_file, report)
+        logging.info(
+            'Simulated {} commands in {}s: {:.0%} of the commands, faults '
+            'enabled {:.0%} of the time. Report: {}'.format(
+                len(report['events']) // 2, report['run_ms'] // 1000,
+                report['coverage']['commands'], report['coverage']['time'],
+                self.simulation_file))
+        return report
+
     def _run_command(self, enablement_timeout):
         """Run a randomly selected chaos command."""
-        chaos = random.choice(self.chaos_monkey.chaos)
+        self.metrics.loop_iterations += 1
+        selector = self.chaos_monkey.selector()
+        now = time()
+        chaos = selector.choose(now, random)
+        if self.expire_time is not None:
+            # Disable the chaos early when the run expires.
+            enablement_timeout = min(
+                enablement_timeout, max(0, self.expire_time - now))
+        if chaos is None:
+            self.metrics.rate_limited += 1
+            allowed_time = selector.next_allowed_time(now)
+            logging.info('Every command is rate limited.')
+            if allowed_time is not None:
+                enablement_timeout = min(enablement_timeout,
+                                         allowed_time - now)
+            self.waiter.wait(enablement_timeout)
+            return
+        if not self._enable_chaos(chaos, enablement_timeout):
+            return
+        try:
+            # The wait returns early when a signal stops Chaos Monkey.
+            self.waiter.wait(enablement_timeout)
+        finally:
+            self._disable_chaos(chaos)
+
+    def _run_leased_command(self, enablement_timeout):
+        """Run the chaos command leased from the coordinator, if any.
+
+        :return: True if a command was leased.
+        """
+        self.metrics.loop_iterations += 1
+        wait_time = enablement_timeout
+        if self.expire_time is not None:
+            wait_time = min(wait_time, max(0, self.expire_time - time()))
+        commands = [c.command_str for c in self.chaos_monkey.chaos]
+        lease, retry = self.agent.acquire(commands, wait_time)
+        if lease is None:
+            self.metrics.rate_limited += 1
+            logging.info('No fault leased by the coordinator.')
+            self.waiter.wait(min(retry, max(0, self.expire_time - time())))
+            return False
+        chaos = ChaosMonkey.find_command(lease['command'])
+        restarting = False
+        try:
+            # The lease of a restart expires while the unit restarts.
+            restarting = not self._enable_chaos(chaos, lease['duration'])
+            if not restarting:
+                try:
+                    self.waiter.wait(lease['duration'])
+                finally:
+                    self._disable_chaos(chaos)
+        finally:
+            if not restarting:
+                self.agent.release(lease)
+        return True
+
+    def _enable_chaos(self, chaos, enablement_timeout):
+        """Log and enable a chaos command.
+
+        :return: False if Chaos Monkey must stop, because the unit is
+            restarting.
+        """
         logging.info("{}".format(chaos.description))
-        cmd_logger = logging.getLogger(self.cmd_log_name)
-        cmd_logger.info(StructuredMessage(
-            chaos.command_str, enablement_timeout))
         if chaos.command_str == Kill.restart_cmd:
+            # Log before the unit restarts.
+            self._log_event(ENABLE, chaos, enablement_timeout,
+                            offset=monotonic() - self.run_start)
             self.stop_chaos = True
-            init = Init.upstart()
-            init.install(
-                cmd_arg=' '.join(sys.argv[1:]), expire_time=self.expire_time)
-        chaos.enable()
-        if chaos.command_str == Kill.restart_cmd:
-            return
+            init = Init.detect()
+            self._save_run_state(init)
+            init.install()
+            chaos.enable()
+            return False
+        self._timed(ENABLE, chaos, chaos.enable, enablement_timeout)
+        if chaos.disable:
+            self.active_chaos.add(chaos.command_str)
+            self.metrics.active_faults = len(self.active_chaos)
+        return True
 
-        sleep(enablement_timeout)
+    def _disable_chaos(self, chaos):
         if chaos.disable:
-            chaos.disable()
+            self._timed(DISABLE, chaos, chaos.disable)
+            self.active_chaos.discard(chaos.command_str)
+            self.metrics.active_faults = len(self.active_chaos)
+
+    def _save_run_state(self, init):
+        """Save the state resume() restores after the unit restarts."""
+        write_run_state(init.state_path, {
+            'runner_path': init.runner_path,
+            'argv': sys.argv[1:],
+            'expire_time': self.expire_time,
+            'replay_offset': self.replay_offset,
+            'plan_position': self.plan_position,
+            'selection_history': self.chaos_monkey.selection_history(),
+            'rng_state': random.getstate(),
+            'active_faults': sorted(self.active_chaos),
+        })
+
+    def resume(self):
+        """Restore the run state saved before the unit restarted.
+
+        The faults that were active are disabled, since some, such as ufw
+        rules, persist across a reboot.
+
+        :return: The expire time of the run, or None if no state was saved.
+        """
+        state_path = Init.detect().state_path
+        state = read_run_state(state_path)
+        remove_run_state(state_path)
+        if state is None:
+            return None
+        rng_state = state.get('rng_state')
+        if rng_state:
+            random.setstate(
+                (rng_state[0], tuple(rng_state[1]), rng_state[2]))
+        self.replay_offset = state.get('replay_offset')
+        self.plan_position = state.get('plan_position') or 0
+        self.chaos_monkey.restore_selection_history(
+            state.get('selection_history') or {})
+        for command_str in state.get('active_faults') or []:
+            chaos = ChaosMonkey.find_command(command_str)
+            if chaos is None:
+                continue
+            try:
+                self._disable_chaos(chaos)
+            except Exception as e:
+                logging.warning('Could not disable {}: {}'.format(
+                    command_str, e))
+        return state.get('expire_time')
+
+    def _timed(self, event, chaos, method, duration=None):
+        """Call method, log the event with its latency and outcome and count
+        it in the metrics.
+        """
+        count = (self.metrics.chaos_enabled if event == ENABLE
+                 else self.metrics.chaos_disabled)
+        start = monotonic()
+        offset = start - self.run_start
+        try:
+            method()
+        except Exception as e:
+            end = monotonic()
+            count(chaos.command_str, end - start, ERROR, end)
+            self._log_event(event, chaos, duration, end - start,
+                            type(e).__name__, offset)
+            raise
+        end = monotonic()
+        count(chaos.command_str, end - start, OK, end)
+        self._log_event(event, chaos, duration, end - start, offset=offset)
+
+    def _log_event(self, event, chaos, duration=None, latency=None,
+                   outcome='ok', offset=None):
+        cmd_logger = logging.getLogger(self.cmd_log_name)
+        cmd_logger.info(EventMessage(
+            event, chaos.command_str, duration, latency, outcome, offset))
 
     def cleanup(self, restart=False):
         """Delete the lock file at the end of the Chaos Monkey run."""
@@ -158,6 +541,9 @@ class Runner:
                 if not restart:
                     logging.warning('Lock file not found: {}'.format(
                         self.lock_file))
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
         logging.info('Chaos Monkey stopped.\n')
 
     def filter_commands(self, include_group=None, exclude_group=None,
@@ -166,8 +552,10 @@ class Runner:
 
         See random_chaos() for the description of the parameters.
         """
-        all_groups = ChaosMonkey.get_all_groups()
-        all_commands = ChaosMonkey.get_all_commands()
+        registry = ChaosMonkey.registry()
+        all_groups = registry.groups
+        all_commands = registry.commands
+        find = registry.find
         self.chaos_monkey.reset_command_selection()
 
         # If any groups and any commands are not included, assume the intent
@@ -182,15 +570,18 @@ class Runner:
             self.chaos_monkey.exclude_group(exclude_group)
         if include_command:
             include_command = self._validate(
-                include_command, all_commands)
+                include_command, all_commands, find)
             self.chaos_monkey.include_command(include_command)
         if exclude_command:
             exclude_command = self._validate(
-                exclude_command, all_commands)
-            self.chaos_monkey.exclude_command(exclude_command)
+                exclude_command, all_commands, find)
+            self.chaos_monkey.exclude_command(
+                [find(c).command_str for c in exclude_command])
+        self.metrics.add_commands(
+            chaos.command_str for chaos in self.chaos_monkey.chaos)
 
     def replay_commands(self, args):
-        """Replay Chaos Monkey commands from a YAML file.
+        """Replay Chaos Monkey commands from a file.
 
         Example of input file:
         - [deny-incoming, 2]
@@ -201,46 +592,122 @@ class Runner:
         + Wait 2 seconds.
         + Run "deny-all" command.
         + Wait 2 seconds.
+
+        The event log of a previous run, chaos_run_list.log, can also be
+        replayed, see read_replay().
+
+        The file is read one command at a time. Commands start at their
+        recorded offset from the first command, see read_replay(), or when
+        the previous command ends. Starts are scheduled on the monotonic
+        clock, so a late command shortens the following waits instead of
+        delaying the rest of the replay. A command whose window has passed
+        is skipped and logged. How late each command started, or was
+        skipped, is logged at the end.
+
+        The offset of the next command in the file is saved in the run
+        state before a restart-unit command, so the replay resumes from there
+        after the reboot.
         """
-        commands = self._get_command_list(args)
-        while commands:
-            command = commands.pop()
-            command_str = command[0]
-            enablement_timeout = command[1]
-            if command_str == Kill.restart_cmd and commands:
-                # Save the commands to a temporary file before a reboot.
-                self._save_command_list(commands, args)
-            self.random_chaos(
-                run_timeout=enablement_timeout,
-                enablement_timeout=enablement_timeout,
-                include_command=command_str)
-            if command_str == Kill.restart_cmd:
-                break
+        replay_file, offset = self._get_replay_position(args)
+        if replay_file is None:
+            return
+        registry = ChaosMonkey.registry()
+        with replay_file as f:
+            # Check every command before any chaos starts.
+            replay_chaos = {}
+            for command_str, _, _, _ in read_replay(f, offset):
+                if command_str in replay_chaos:
+                    continue
+                chaos = registry.find(command_str)
+                if chaos is None:
+                    raise BadRequest(
+                        'Invalid command in replay file: {}'.format(
+                            command_str))
+                replay_chaos[command_str] = chaos
+            if self.dry_run:
+                return
+            current = {}
 
-    def _get_command_list(self, args):
-        """Get command list from a file."""
-        file_path = (args.replay + self.replay_filename_ext
-                     if args.restart else args.replay)
-        with open(file_path) as f:
-            commands = yaml.load(f.read())
-        commands.reverse()
-        # If it is a restart, remove the temporary file.
-        if args.restart:
-            os.remove(file_path)
-        return commands
+            def entries():
+                # Commands without a recorded start follow the previous one.
+                next_start = 0
+                last_start = base = None
+                for command_str, enablement_timeout, start, end_offset in (
+                        read_replay(f, offset)):
+                    if start is None:
+                        start = next_start
+                    else:
+                        # The offsets start again from 0 after a reboot.
+                        if last_start is None or start < last_start:
+                            base = start - next_start
+                        last_start = start
+                        start -= base
+                    next_start = start + enablement_timeout
+                    current.update(start=start, end_offset=end_offset)
+                    yield (start, replay_chaos[command_str].command_str,
+                           enablement_timeout)
 
-    def _save_command_list(self, commands, args):
-        """Save the command list to a temporary file."""
+            drift = DriftHistogram()
+            start_time = monotonic()
+
+            def enable(chaos, duration):
+                drift.add(monotonic() - start_time - current['start'])
+                self.replay_offset = current['end_offset']
+                self.expire_time = time() + duration
+                return self._enable_chaos(chaos, duration)
+
+            def skip(command_str, late):
+                drift.skip(late)
+                self.replay_offset = current['end_offset']
+                logging.warning(
+                    'Skipped {}: the replay is {:.3f}s late, past the end of '
+                    'the command.'.format(command_str, late))
+
+            scheduler = FaultScheduler(
+                replay_chaos.values(), enable, self._disable_chaos,
+                max_faults=1, max_duration=0, clock=monotonic,
+                wait=self.waiter.wait)
+            scheduler.run_plan(entries(), start_time, lambda: self.stop_chaos,
+                               skipped=skip)
+        logging.info('Replay drift: {}'.format(drift))
+
+    def _get_replay_position(self, args):
+        """Return the open replay file and the offset to start from.
+
+        After a reboot the offset is the one restored by resume(). Earlier
+        versions saved the offset, or the remaining commands, to a temporary
+        file, which is read and removed instead. The file is None when
+        nothing is left to replay.
+        """
+        if not args.restart:
+            return open(args.replay), 0
+        if self.replay_offset is not None:
+            return open(args.replay), self.replay_offset
         file_path = args.replay + self.replay_filename_ext
-        with open(file_path, 'w') as f:
-            f.write(yaml.dump(commands))
+        try:
+            with open(file_path) as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            logging.info('Nothing left to replay from {}'.format(args.replay))
+            return None, 0
+        os.remove(file_path)
+        if data.strip().isdigit():
+            return open(args.replay), int(data)
+        return closing(StringIO(data)), 0
 
     @staticmethod
-    def _validate(sub_string, all_list):
-        """Validate input commands."""
+    def _validate(sub_string, all_list, find=None):
+        """Validate input commands.
+
+        :param find: Function returning None for the items not in all_list
+            that are not valid, such as ChaosRegistry.find() for
+            parameterized commands.
+        """
         sub_list = split_arg_string(sub_string)
         for item in sub_list:
-            if item not in all_list:
+            if item not in all_list and (find is None or find(item) is None):
                 raise BadRequest(
                     'Invalid value given on command line: {}'.format(item))
         return sub_list
@@ -252,17 +719,16 @@ class Runner:
         logging.debug('Flagging stop for runner in workspace: {}'.format(
                       self.workspace))
         self.stop_chaos = True
+        self.waiter.wake()
         logging.debug('self.stop_chaos: {}'.format(self.stop_chaos))
 
     @staticmethod
     def list_all_commands():
         """List all available commands."""
-        all_chaos, _ = ChaosMonkey.get_all_chaos()
-        all_groups = ChaosMonkey.get_all_groups()
+        registry = ChaosMonkey.registry()
         commands = {}
-        for group in all_groups:
-            commands[group] = [[c.command_str, c.description]
-                               for c in all_chaos if c.group == group]
+        for group, chaos in registry.groups.items():
+            commands[group] = [[c.command_str, c.description] for c in chaos]
         return commands
 
 
@@ -287,6 +753,14 @@ def display_all_commands():
     return cmd_str
 
 
+def log_shell_latency(shell_helper):
+    """Log the latency of the commands run by the shell helper."""
+    for name, stats in sorted(shell_helper.latency_report().items()):
+        logging.info('Shell command latency: {} count={} mean={:.3f}s '
+                     'max={:.3f}s'.format(name, stats['count'],
+                                          stats['mean'], stats['max']))
+
+
 def parse_args(argv=None):
     """Parse command line arguments."""
     commands = display_all_commands()
@@ -316,15 +790,45 @@ def parse_args(argv=None):
     parser.add_argument(
         '-ic', '--include-command', metavar='COMMAND',
         help="Select chaos from only a specified command or set of commands. "
-             "All commands are included by default.",
+             "All commands are included by default. Netem and partition "
+             "commands take parameters, such as 'delay(latency=100ms,"
+             "jitter=10ms,rate=1mbit)', so one run can include several "
+             "severities, or 'partition(peers=10.0.0.2+10.0.0.3,"
+             "ports=37017)', which cuts the traffic with the listed peers.",
         default=None)
     parser.add_argument(
         '-ec', '--exclude-command', metavar='COMMAND',
         help='Exclude a command or set of commands from selected chaos.',
         default=None)
+    parser.add_argument(
+        '-mf', '--max-faults', default=1, type=int, metavar='NUMBER',
+        help='The maximum number of chaos commands enabled at once.')
+    parser.add_argument(
+        '-met', '--min-enablement-timeout', type=int, metavar='SECONDS',
+        default=None,
+        help='With --max-faults, each command is enabled for a random time '
+             'between this and the enablement timeout.')
+    parser.add_argument(
+        '-st', '--stagger', default=0, type=int, metavar='SECONDS',
+        help='With --max-faults, the minimum time between the start of two '
+             'commands.')
+    parser.add_argument(
+        '-w', '--weights', metavar='FILE', default=None,
+        help='YAML file of group and command weights and command rate '
+             'limits used to select commands.')
+    parser.add_argument(
+        '-sd', '--seed', type=int, default=None,
+        help='Plan a reproducible schedule of commands from this seed. '
+             'The plan is written to chaos_plan.jsonl in the workspace.')
+    parser.add_argument(
+        '-sk', '--seed-key', default=None,
+        help='With --seed, derive a distinct seed from this key, such as '
+             'the unit name, so units sharing a seed differ.')
     parser.add_argument(
         '-dr', '--dry-run', dest='dry_run', action='store_true',
-        help='Do not actually run chaos operations.', default=False)
+        help='Do not actually run chaos operations. The run is simulated on '
+             'a virtual clock and its events and coverage are written to '
+             'chaos_simulation.json in the workspace.', default=False)
     parser.add_argument(
         '-ro', '--run-once', action='store_true',
         help='Run a single command only.', default=False)
@@ -337,6 +841,56 @@ def parse_args(argv=None):
     parser.add_argument(
         '-rp', '--replay', metavar='FULL-FILE-PATH',
         help='Replay Chaos Monkey commands from a file.', default=None)
+    parser.add_argument(
+        '-lq', '--log-queue', type=int, default=0, metavar='SIZE',
+        help='Write logs from a background thread through a queue of SIZE '
+             'records. Records are dropped when the queue is full.')
+    parser.add_argument(
+        '-sh', '--shell-helper', action='store_true',
+        help='Run shell commands through a persistent helper process.',
+        default=False)
+    parser.add_argument(
+        '-fb', '--firewall-backend', choices=['ufw', 'iptables'],
+        default='ufw',
+        help='Apply firewall chaos with one ufw command per rule, or with '
+             'one iptables-restore transaction per chaos.')
+    parser.add_argument(
+        '-if', '--interfaces', metavar='INTERFACES', default='default',
+        help="Network interfaces netem chaos applies to: 'default' for the "
+             "interfaces with a default route, 'all' for every interface "
+             "but loopback, or a comma-separated list of interfaces.")
+    parser.add_argument(
+        '-ma', '--metrics', metavar='ADDRESS', default=None,
+        help='Serve metrics over HTTP on ADDRESS: a port or host:port, '
+             'where the host defaults to 127.0.0.1, or the absolute path of '
+             'a Unix socket. The metrics are also written to '
+             'chaos_metrics.prom in the workspace at exit.')
+    parser.add_argument(
+        '-co', '--coordinator', metavar='ADDRESS', default=None,
+        help='Run the commands leased by a coordinator, see coordinator.py. '
+             'ADDRESS is a port, host:port or the absolute path of a Unix '
+             'socket.')
+    parser.add_argument(
+        '-un', '--unit', default=None,
+        help='With --coordinator, the name of this unit. Defaults to '
+             '$JUJU_UNIT_NAME, or the host name.')
+    parser.add_argument(
+        '-rl', '--role', default=None,
+        help='With --coordinator, the role of this unit, such as '
+             'state-server, limited by the rules of the coordinator.')
+    parser.add_argument(
+        '-nb', '--netem-backend', choices=['tc', 'netlink'], default='tc',
+        help='Install netem rules by running tc, or over netlink with '
+             'pyroute2.')
+    parser.add_argument(
+        '-jm', '--jujud-match', metavar='MATCH', default=None,
+        help="The jujud process kill-jujud kills, as comma-separated "
+             "key=value pairs of name, exe, cmdline, cgroup or unit, such "
+             "as 'unit=jujud-machine-0.service'. Defaults to 'name=jujud'.")
+    parser.add_argument(
+        '-mm', '--mongod-match', metavar='MATCH', default=None,
+        help="The mongod process kill-mongod kills, like --jujud-match. "
+             "Defaults to 'name=mongod'.")
     args = parser.parse_args(argv)
 
     if args.run_once and args.total_timeout:
@@ -354,6 +908,40 @@ def parse_args(argv=None):
     if args.enablement_timeout < 0:
         parser.error("Invalid enablement-timeout value: timeout must be "
                      "zero or greater.")
+    if args.max_faults < 1:
+        parser.error("Invalid max-faults value: must be one or greater.")
+    if args.min_enablement_timeout is not None and not (
+            0 <= args.min_enablement_timeout <= args.enablement_timeout):
+        parser.error("Invalid min-enablement-timeout value: must be between "
+                     "zero and enablement-timeout.")
+    if args.log_queue < 0:
+        parser.error("Invalid log-queue value: must be zero or greater.")
+    if args.stagger < 0:
+        parser.error("Invalid stagger value: must be zero or greater.")
+    if args.seed_key is not None and args.seed is None:
+        parser.error("Conflicting request: seed-key requires seed.")
+    for option in ('metrics', 'coordinator'):
+        address = getattr(args, option)
+        if address is None:
+            continue
+        try:
+            split_address(address)
+        except BadRequest:
+            parser.error("Invalid {} value: must be a port, host:port or "
+                         "the absolute path of a Unix socket.".format(option))
+    for option in ('jujud_match', 'mongod_match'):
+        try:
+            parse_match(getattr(args, option))
+        except BadRequest as e:
+            parser.error("Invalid {} value: {}".format(
+                option.replace('_', '-'), e))
+    if args.coordinator and (args.seed is not None or args.dry_run or
+                             args.replay):
+        parser.error("Conflicting request: coordinator can not be used with "
+                     "seed, dry-run or replay.")
+    if (args.unit or args.role) and not args.coordinator:
+        parser.error("Conflicting request: unit and role require "
+                     "coordinator.")
     if args.replay and not os.path.isabs(args.replay):
             parser.error("Please provide an absolute file path to the replay "
                          "argument: {}".format(args.replay))
@@ -363,7 +951,11 @@ def parse_args(argv=None):
 if __name__ == '__main__':
     args = parse_args()
     runner = Runner.factory(workspace=args.path, log_count=args.log_count,
-                            dry_run=args.dry_run)
+                            dry_run=args.dry_run, log_queue=args.log_queue)
+    ChaosMonkey.configure(
+        firewall_backend=args.firewall_backend, interfaces=args.interfaces,
+        netem_backend=args.netem_backend, jujud_match=args.jujud_match,
+        mongod_match=args.mongod_match)
     setup_sig_handlers(runner.sig_handler)
     msg = 'started' if not args.restart else 'restarted after a reboot'
     logging.info('Chaos Monkey {} in {}'.format(msg, args.path))
@@ -373,11 +965,31 @@ if __name__ == '__main__':
         sys.exit(0)
 
     runner.acquire_lock(restart=args.restart)
+    shell_helper = None
+    if args.shell_helper:
+        shell_helper = ShellHelper.start()
+        set_shell_helper(shell_helper)
+    set_metrics(runner.metrics)
+    metrics_server = None
+    if args.coordinator:
+        runner.agent = LeaseAgent(
+            SocketTransport(args.coordinator),
+            args.unit or os.environ.get('JUJU_UNIT_NAME') or
+            socket.gethostname(), args.role)
     try:
+        if args.metrics:
+            metrics_server = serve_metrics(runner.metrics, args.metrics)
+        if args.restart:
+            args.expire_time = runner.resume() or args.expire_time
         if args.replay:
             logging.info('Replaying commands from {}'.format(args.replay))
             runner.replay_commands(args=args)
         else:
+            if args.weights:
+                policy = SelectionPolicy.from_file(args.weights)
+                policy.validate(ChaosMonkey.get_all_commands(),
+                                ChaosMonkey.get_all_groups())
+                runner.chaos_monkey.policy = policy
             runner.random_chaos(
                 run_timeout=args.total_timeout,
                 enablement_timeout=args.enablement_timeout,
@@ -386,9 +998,29 @@ if __name__ == '__main__':
                 include_command=args.include_command,
                 exclude_command=args.exclude_command,
                 run_once=args.run_once,
-                expire_time=args.expire_time)
+                expire_time=args.expire_time,
+                max_faults=args.max_faults,
+                min_enablement_timeout=args.min_enablement_timeout,
+                stagger=args.stagger,
+                seed=args.seed,
+                seed_key=args.seed_key)
     except Exception as e:
         logging.error('{} ({})'.format(e, type(e).__name__))
         sys.exit(1)
     finally:
+        if shell_helper:
+            set_shell_helper(None)
+            shell_helper.stop()
+            log_shell_latency(shell_helper)
+        set_metrics(None)
+        if metrics_server:
+            stop_metrics(metrics_server)
+        try:
+            runner.metrics.write(runner.metrics_file)
+        except (IOError, OSError) as e:
+            logging.warning('Metrics not written to {}: {}'.format(
+                runner.metrics_file, e))
         runner.cleanup()
+        dropped = stop_log_queues()
+        if dropped:
+            sys.stderr.write('Dropped {} log records.\n'.format(dropped))
@@ -0,0 +1,290 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import hashlib
+import heapq
+import json
+import logging
+import os
+import random
+from time import (
+    sleep,
+    time,
+)
+
+from chaos_monkey_base import EXCLUSIVE
+from selection import UniformSelector
+
+__metaclass__ = type
+
+
+def conflicts(chaos, other):
+    """Return True if chaos and other can not be enabled together."""
+    if chaos == other:
+        return True
+    if EXCLUSIVE in chaos.resources or EXCLUSIVE in other.resources:
+        return True
+    return bool(chaos.resources & other.resources)
+
+
+class ActiveFault:
+    """A Chaos enabled by the FaultScheduler and when to disable it."""
+
+    def __init__(self, chaos, start_time, end_time):
+        self.chaos = chaos
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def __lt__(self, other):
+        return self.end_time < other.end_time
+
+
+class FaultScheduler:
+    """Keep up to max_faults non-conflicting chaos enabled at once.
+
+    A new fault starts whenever a slot is free, at least stagger seconds
+    after the previous one, and holds its slot for a random duration between
+    min_duration and max_duration seconds. Chaos without a disable method,
+    such as killing a process, hold their slot while the system recovers.
+    """
+
+    def __init__(self, chaos, enable, disable, max_faults, max_duration,
+                 min_duration=None, stagger=0, clock=time, wait=sleep,
+                 rng=random, selector=None):
+        """
+        :param chaos: List of Chaos to select from.
+        :param enable: Function enabling a Chaos for a duration in seconds.
+            It returns False if the run must stop, e.g. before a reboot.
+        :param disable: Function disabling a Chaos.
+        :param clock: Function returning the current time.
+        :param wait: Function waiting a number of seconds.
+        :param rng: random.Random used to select chaos and durations.
+        :param selector: UniformSelector or WeightedSelector picking from
+            chaos. Defaults to a UniformSelector.
+        """
+        self.chaos = chaos
+        self.enable = enable
+        self.disable = disable
+        self.max_faults = max_faults
+        self.max_duration = max_duration
+        self.min_duration = (
+            max_duration if min_duration is None else min_duration)
+        self.stagger = stagger
+        self.clock = clock
+        self.wait = wait
+        self.rng = rng
+        self.selector = selector or UniformSelector(chaos)
+        self.active = []
+
+    def select(self, now):
+        """Return a random Chaos not conflicting with the active faults."""
+        return self.selector.choose(
+            now, self.rng,
+            lambda c: not any(conflicts(c, f.chaos) for f in self.active))
+
+    def duration(self):
+        return self.rng.uniform(self.min_duration, self.max_duration)
+
+    def run(self, expire_time, should_stop=lambda: False):
+        """Schedule chaos until expire_time or until should_stop()."""
+        next_start = self.clock()
+        try:
+            while not should_stop():
+                now = self.clock()
+                self.disable_expired(now)
+                if now >= expire_time:
+                    break
+                wake_times = [expire_time]
+                if self.active:
+                    wake_times.append(self.active[0].end_time)
+                if len(self.active) < self.max_faults:
+                    if now < next_start:
+                        wake_times.append(next_start)
+                    else:
+                        chaos = self.select(now)
+                        if chaos is not None:
+                            next_start = now + self.stagger
+                            if not self.start(chaos, now, expire_time):
+                                return
+                            continue
+                        allowed_time = self.selector.next_allowed_time(now)
+                        if allowed_time is not None:
+                            wake_times.append(allowed_time)
+                        elif not self.active:
+                            logging.warning('No chaos can be selected.')
+                            break
+                self.wait(max(0, min(wake_times) - self.clock()))
+        finally:
+            self.disable_all()
+
+    def start(self, chaos, now, expire_time):
+        """Enable chaos, returning False if the run must stop."""
+        end_time = min(now + self.duration(), expire_time)
+        if self.enable(chaos, end_time - now) is False:
+            return False
+        heapq.heappush(self.active, ActiveFault(chaos, now, end_time))
+        return True
+
+    def plan(self, run_timeout):
+        """Return the schedule run() would follow for run_timeout seconds.
+
+        The schedule is a list of (offset, command_str, duration) tuples
+        sorted by offset. It is computed on a VirtualClock with self.rng, so
+        a seeded rng always gives the same plan.
+        """
+        clock = VirtualClock()
+        entries = []
+
+        def enable(chaos, duration):
+            entries.append((clock.time(), chaos.command_str, duration))
+
+        planner = FaultScheduler(
+            self.chaos, enable, lambda chaos: None, self.max_faults,
+            self.max_duration, self.min_duration, self.stagger,
+            clock=clock.time, wait=clock.wait, rng=self.rng,
+            selector=self.selector.with_empty_history())
+        planner.run(run_timeout)
+        return entries
+
+    def run_plan(self, entries, start_time, should_stop=lambda: False,
+                 skipped=None):
+        """Enable the chaos of a plan at start_time plus their offsets.
+
+        Entries whose window has already passed, e.g. before a reboot, are
+        skipped.
+
+        :param skipped: Function called with the command_str of a skipped
+            entry and the seconds since its scheduled start.
+        """
+        chaos = dict((c.command_str, c) for c in self.chaos)
+        try:
+            for offset, command_str, duration in entries:
+                start = start_time + offset
+                end_time = start + duration
+                now = self.clock()
+                if end_time <= now:
+                    if skipped is not None:
+                        skipped(command_str, now - start)
+                    continue
+                if not self._wait_until(start, should_stop):
+                    return
+                # A fault ending when this one starts may still be active,
+                # by a rounding error.
+                self.disable_conflicting(chaos[command_str])
+                now = self.clock()
+                if self.enable(chaos[command_str], end_time - now) is False:
+                    return
+                heapq.heappush(self.active, ActiveFault(
+                    chaos[command_str], now, end_time))
+            if self.active:
+                self._wait_until(
+                    max(f.end_time for f in self.active), should_stop)
+        finally:
+            self.disable_all()
+
+    def _wait_until(self, wake_time, should_stop):
+        """Disable expired faults until wake_time, or return False on stop.
+        """
+        while not should_stop():
+            now = self.clock()
+            self.disable_expired(now)
+            if now >= wake_time:
+                return True
+            next_time = wake_time
+            if self.active:
+                next_time = min(next_time, self.active[0].end_time)
+            self.wait(next_time - now)
+        return False
+
+    def disable_expired(self, now):
+        while self.active and self.active[0].end_time <= now:
+            self.disable(heapq.heappop(self.active).chaos)
+
+    def disable_conflicting(self, chaos):
+        """Disable the active faults conflicting with chaos."""
+        conflicting = [f for f in self.active if conflicts(chaos, f.chaos)]
+        if conflicting:
+            self.active = [f for f in self.active if f not in conflicting]
+            heapq.heapify(self.active)
+            for fault in conflicting:
+                self.disable(fault.chaos)
+
+    def disable_all(self):
+        while self.active:
+            self.disable(heapq.heappop(self.active).chaos)
+
+
+class VirtualClock:
+    """A clock that only moves forward when waited on."""
+
+    def __init__(self, now=0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def wait(self, seconds):
+        self.now += seconds
+
+
+def derive_seed(seed, key=None):
+    """Return the seed of one unit in a run sharing seed between units.
+
+    :param key: Name distinguishing the unit, such as the unit name.
+    """
+    if key is None:
+        return seed
+    digest = hashlib.sha256('{}:{}'.format(seed, key)).hexdigest()
+    return int(digest[:16], 16)
+
+
+def write_plan(path, entries, **header):
+    """Write a plan from FaultScheduler.plan() to path.
+
+    The file holds JSON lines: a header object with the commands in the
+    plan, then one [offset, command index, duration] array per entry.
+    """
+    def compact(seconds):
+        seconds = round(seconds, 3)
+        return int(seconds) if seconds.is_integer() else seconds
+
+    commands = sorted(set(e[1] for e in entries))
+    index = dict((c, i) for i, c in enumerate(commands))
+    header['commands'] = commands
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(header, sort_keys=True) + '\n')
+        for offset, command_str, duration in entries:
+            f.write(json.dumps(
+                [compact(offset), index[command_str], compact(duration)],
+                separators=(',', ':')) + '\n')
+    os.rename(tmp_path, path)
+
+
+def read_plan(path):
+    """Return the header of a plan file and an iterator over its entries.
+
+    The entries are read from the file as they are iterated over.
+    """
+    f = open(path)
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        f.close()
+        raise
+    commands = header['commands']
+
+    def entries():
+        with f:
+            for line in f:
+                offset, index, duration = json.loads(line)
+                yield offset, commands[index], duration
+    return header, entries()
+
+
+def read_plan_header(path):
+    """Return the header of a plan file or None if there is no valid plan."""
+    try:
+        with open(path) as f:
+            return json.loads(f.readline())
+    except (IOError, ValueError):
+        return None
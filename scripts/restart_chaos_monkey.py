@@ -1,34 +1,44 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
 from argparse import ArgumentParser
+import json
+import os
 import subprocess
 
 
 def parse_args(argv=None):
     parser = ArgumentParser()
     parser.add_argument(
-        '--runner-path',  help='Chaos Monkey runner path.',  default=None)
+        '--state-file', help='Chaos Monkey run state path.', required=True)
     parser.add_argument(
-        '--expire-time',  help='Chaos Monkey expire time.',  default=None,
-        type=float)
-    parser.add_argument(
-        '--cmd-arg',  help='Chaos Monkey command arguments.',  default=None)
-    args = parser.parse_args(argv)
-    if not args.runner_path or not args.expire_time or not args.cmd_arg:
-        parser.error("Invalid command arguments.")
-    return args
+        '--exec', action='store_true', dest='exec_runner', default=False,
+        help='Replace this process with Chaos Monkey instead of starting it '
+             'in the background.')
+    return parser.parse_args(argv)
 
 
 def restart_chaos_monkey(args):
-    cmd = (['python'] + [args.runner_path] + args.cmd_arg.split(' ') +
-           ['--expire-time'] + [str(args.expire_time)] + ['--restart'])
-    subprocess.Popen(cmd)
+    """Restart the run saved in the state file, if there is one."""
+    try:
+        with open(args.state_file) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return
+    cmd = (['python', state['runner_path']] +
+           [str(arg) for arg in state['argv']])
+    if '--restart' not in cmd and '-r' not in cmd:
+        cmd.append('--restart')
+    if args.exec_runner:
+        os.execvp(cmd[0], cmd)
+    else:
+        subprocess.Popen(cmd)
 
 
 if __name__ == '__main__':
     """Restart Chaos Monkey after a machine reboot.
 
-    Executed by the Upstart init script to restart the Chaos Monkey.
+    Executed by the Upstart or systemd boot hook to restart the Chaos
+    Monkey.
     """
     args = parse_args()
     restart_chaos_monkey(args)
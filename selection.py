@@ -0,0 +1,254 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from bisect import bisect_right
+from collections import deque
+import random
+
+import yaml
+
+from utility import BadRequest
+
+__metaclass__ = type
+
+
+class AliasTable:
+    """Sample indexes in O(1) with probabilities proportional to weights.
+
+    The table is built with Vose's alias method: every slot holds the
+    probability of keeping its own index and the index it aliases to.
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        if not count or total <= 0:
+            raise ValueError('Weights must contain a positive value.')
+        scaled = [w * count / total for w in weights]
+        self.prob = [1.0] * count
+        self.alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l_ = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l_
+            scaled[l_] += scaled[s] - 1
+            (small if scaled[l_] < 1 else large).append(l_)
+
+    def sample(self, rng=random):
+        index = int(rng.random() * len(self.prob))
+        return index if rng.random() < self.prob[index] else self.alias[index]
+
+
+class RateLimit:
+    """How often a command may be selected."""
+
+    def __init__(self, min_interval=0, max_per_hour=None):
+        """
+        :param min_interval: Minimum number of seconds between two
+            selections of the command.
+        :param max_per_hour: Maximum number of selections of the command in
+            any hour, or None for no limit.
+        """
+        self.min_interval = min_interval
+        self.max_per_hour = max_per_hour
+
+
+class SelectionPolicy:
+    """Weights and rate limits applied when selecting chaos commands.
+
+    The weight of a command is its group weight times its command weight,
+    both defaulting to 1. A weight of 0 disables the command.
+    """
+
+    def __init__(self, group_weights=None, command_weights=None,
+                 limits=None):
+        self.group_weights = group_weights or {}
+        self.command_weights = command_weights or {}
+        self.limits = limits or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a SelectionPolicy from a dict, see from_file()."""
+        data = data or {}
+        group_weights = {}
+        command_weights = {}
+        limits = {}
+        try:
+            for group, weight in (data.get('groups') or {}).items():
+                group_weights[group] = _weight(weight)
+            for command_str, spec in (data.get('commands') or {}).items():
+                if not isinstance(spec, dict):
+                    spec = {'weight': spec}
+                if 'weight' in spec:
+                    command_weights[command_str] = _weight(spec['weight'])
+                min_interval = float(spec.get('min-interval', 0))
+                max_per_hour = spec.get('max-per-hour')
+                if min_interval < 0 or (
+                        max_per_hour is not None and int(max_per_hour) < 0):
+                    raise ValueError('Negative rate limit.')
+                if min_interval or max_per_hour is not None:
+                    limits[command_str] = RateLimit(
+                        min_interval,
+                        None if max_per_hour is None else int(max_per_hour))
+        except (AttributeError, TypeError, ValueError) as e:
+            raise BadRequest('Invalid selection policy: {}'.format(e))
+        return cls(group_weights, command_weights, limits)
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Create a SelectionPolicy from a YAML file.
+
+        Example of a policy file:
+            groups:
+              kill: 3
+            commands:
+              deny-all: 0.5
+              restart-unit:
+                weight: 0.1
+                min-interval: 1800
+                max-per-hour: 1
+        """
+        with open(file_path) as f:
+            return cls.from_dict(yaml.safe_load(f))
+
+    def validate(self, commands, groups):
+        """Raise BadRequest if the policy names an unknown command or group.
+        """
+        for command_str in set(self.command_weights) | set(self.limits):
+            if command_str not in commands:
+                raise BadRequest(
+                    'Invalid command in selection policy: {}'.format(
+                        command_str))
+        for group in self.group_weights:
+            if group not in groups:
+                raise BadRequest(
+                    'Invalid group in selection policy: {}'.format(group))
+
+    def weight(self, chaos):
+        return (self.group_weights.get(chaos.group, 1) *
+                self.command_weights.get(chaos.command_str, 1))
+
+
+def _weight(value):
+    weight = float(value)
+    if weight < 0:
+        raise ValueError('Negative weight: {}'.format(value))
+    return weight
+
+
+class UniformSelector:
+    """Select chaos uniformly at random."""
+
+    def __init__(self, chaos):
+        self.chaos = chaos
+
+    def choose(self, now, rng=random, accept=None):
+        """Return a random Chaos, or None if none is accepted.
+
+        :param now: Current time, used by rate limits.
+        :param accept: Function returning False for the Chaos that can not
+            be selected now.
+        """
+        if accept is None:
+            return rng.choice(self.chaos)
+        candidates = [c for c in self.chaos if accept(c)]
+        if not candidates:
+            return None
+        return rng.choice(candidates)
+
+    def next_allowed_time(self, now):
+        """Return when a rate limited command is allowed again, or None."""
+        return None
+
+    def with_empty_history(self):
+        """Return a selector like this one that has selected nothing yet."""
+        return self
+
+
+class WeightedSelector:
+    """Select chaos by weight, skipping the rate limited commands.
+
+    A selection draws from an AliasTable, which is O(1), and redraws when
+    the command is not allowed. After max_draws draws it falls back to a
+    prefix-sum table of the allowed commands, which is O(n).
+    """
+
+    max_draws = 8
+
+    def __init__(self, chaos, policy, history=None):
+        """
+        :param history: Dict of command_str to the deque of its recent
+            selection times, shared between selectors of the same run.
+        """
+        self.policy = policy
+        self.chaos = [c for c in chaos if policy.weight(c) > 0]
+        self.weights = [policy.weight(c) for c in self.chaos]
+        self.table = AliasTable(self.weights) if self.chaos else None
+        self.history = {} if history is None else history
+
+    def allowed(self, chaos, now):
+        limit = self.policy.limits.get(chaos.command_str)
+        if limit is None:
+            return True
+        return self._next_time(chaos.command_str, limit, now) <= now
+
+    def _next_time(self, command_str, limit, now):
+        """Return when command_str may be selected again under limit."""
+        if limit.max_per_hour == 0:
+            return float('inf')
+        times = self.history.get(command_str)
+        if not times:
+            return now
+        horizon = max(3600, limit.min_interval)
+        while times[0] <= now - horizon and len(times) > 1:
+            times.popleft()
+        next_time = times[-1] + limit.min_interval
+        if limit.max_per_hour is not None:
+            in_hour = [t for t in times if t > now - 3600]
+            if len(in_hour) >= limit.max_per_hour:
+                next_time = max(
+                    next_time, in_hour[-limit.max_per_hour] + 3600)
+        return next_time
+
+    def choose(self, now, rng=random, accept=None):
+        """See UniformSelector.choose(), the choice is recorded at now."""
+        if self.table is None:
+            return None
+
+        def ok(chaos):
+            return self.allowed(chaos, now) and (
+                accept is None or accept(chaos))
+
+        for _ in range(self.max_draws):
+            chaos = self.chaos[self.table.sample(rng)]
+            if ok(chaos):
+                break
+        else:
+            candidates = [(c, w) for c, w in zip(self.chaos, self.weights)
+                          if ok(c)]
+            if not candidates:
+                return None
+            sums = []
+            total = 0
+            for _, weight in candidates:
+                total += weight
+                sums.append(total)
+            index = bisect_right(sums, rng.random() * total)
+            chaos = candidates[min(index, len(candidates) - 1)][0]
+        if chaos.command_str in self.policy.limits:
+            self.history.setdefault(chaos.command_str, deque()).append(now)
+        return chaos
+
+    def next_allowed_time(self, now):
+        times = []
+        for command_str in set(c.command_str for c in self.chaos):
+            limit = self.policy.limits.get(command_str)
+            if limit is not None:
+                times.append(self._next_time(command_str, limit, now))
+        times = [t for t in times if t > now and t != float('inf')]
+        return min(times) if times else None
+
+    def with_empty_history(self):
+        return WeightedSelector(self.chaos, self.policy)
@@ -0,0 +1,110 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Simulate a chaos run on a virtual clock.
+
+The report of a simulation is a JSON object, with times in milliseconds
+from the start of the run:
+    {"run_ms": 600000,
+     "events": [[0, "enable", "deny-all", 30000], [30000, "disable",
+                 "deny-all", null], ...],
+     "fault_ms": {"deny-all": 90000, ...},
+     "coverage": {"commands": 0.75, "time": 0.98}}
+
+"coverage" holds the fraction of the available commands run at least once,
+and the fraction of the run during which a fault is enabled.
+"""
+import json
+
+from event_log import (
+    DISABLE,
+    ENABLE,
+)
+from scheduler import (
+    FaultScheduler,
+    VirtualClock,
+)
+
+__metaclass__ = type
+
+
+def _ms(seconds):
+    return int(round(seconds * 1000))
+
+
+class Simulation:
+    """Record what a FaultScheduler does, without enabling any chaos."""
+
+    def __init__(self):
+        self.clock = VirtualClock()
+        # (seconds, event, command_str, duration) tuples, in order.
+        self.events = []
+
+    def enable(self, chaos, duration):
+        self.events.append(
+            (self.clock.time(), ENABLE, chaos.command_str, duration))
+
+    def disable(self, chaos):
+        self.events.append(
+            (self.clock.time(), DISABLE, chaos.command_str, None))
+
+    def scheduler(self, scheduler):
+        """Return a copy of scheduler that runs on this simulation."""
+        return FaultScheduler(
+            scheduler.chaos, self.enable, self.disable, scheduler.max_faults,
+            scheduler.max_duration, scheduler.min_duration,
+            scheduler.stagger, clock=self.clock.time, wait=self.clock.wait,
+            rng=scheduler.rng,
+            selector=scheduler.selector.with_empty_history())
+
+    def run(self, scheduler, run_timeout):
+        """Simulate scheduler.run() for run_timeout seconds."""
+        self.scheduler(scheduler).run(run_timeout)
+
+    def run_plan(self, scheduler, entries):
+        """Simulate scheduler.run_plan() of a plan's entries."""
+        self.scheduler(scheduler).run_plan(entries, 0)
+
+    def report(self, run_timeout, commands):
+        """Return the report of the simulation, see the module docstring.
+
+        :param commands: The commands available to the run.
+        """
+        fault_ms = dict((command_str, 0) for command_str in commands)
+        # Command to the time it was enabled, for the enabled commands.
+        enabled = {}
+        faulted_ms = 0
+        for seconds, event, command_str, _ in self.events:
+            now = _ms(seconds)
+            if event == ENABLE:
+                if not enabled:
+                    faulted_since = now
+                enabled[command_str] = now
+            else:
+                start = enabled.pop(command_str)
+                fault_ms[command_str] = (
+                    fault_ms.get(command_str, 0) + now - start)
+                if not enabled:
+                    faulted_ms += now - faulted_since
+        run_ms = _ms(run_timeout)
+        used = set(commands) & set(
+            e[2] for e in self.events if e[1] == ENABLE)
+        return {
+            'run_ms': run_ms,
+            'events': [[_ms(seconds), event, command_str,
+                        None if duration is None else _ms(duration)]
+                       for seconds, event, command_str, duration
+                       in self.events],
+            'fault_ms': fault_ms,
+            'coverage': {
+                'commands': (float(len(used)) / len(set(commands))
+                             if commands else 0.0),
+                'time': float(faulted_ms) / run_ms if run_ms else 0.0,
+            },
+        }
+
+
+def write_report(path, report):
+    """Write a simulation report to path."""
+    with open(path, 'w') as f:
+        json.dump(report, f, sort_keys=True)
+        f.write('\n')
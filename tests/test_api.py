@@ -0,0 +1,144 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import logging
+from subprocess import CalledProcessError
+from unittest import TestCase
+
+from mock import (
+    MagicMock,
+    patch,
+)
+
+import api
+from api import (
+    active,
+    chaos,
+    commands,
+    disable_all,
+    enable,
+    shell_helper,
+)
+import chaos_monkey
+from chaos_monkey import (
+    ChaosMonkey,
+    ChaosRegistry,
+)
+from chaos_monkey_base import Chaos
+from utility import (
+    BadRequest,
+    NotFound,
+    run_shell_command,
+)
+
+__metaclass__ = type
+
+
+class TestApi(TestCase):
+
+    def setUp(self):
+        registry = ChaosRegistry([])
+        self.deny = Chaos(MagicMock(), MagicMock(), 'net', 'deny-all', 'deny',
+                          resources=['firewall'])
+        self.deny_in = Chaos(MagicMock(), MagicMock(), 'net',
+                             'deny-incoming', 'deny', resources=['firewall'])
+        self.delay = Chaos(MagicMock(), MagicMock(), 'net', 'delay', 'delay',
+                           resources=['netem'])
+        self.kill = Chaos(MagicMock(), None, 'kill', 'kill-mongod', 'kill')
+        for c in (self.deny, self.deny_in, self.delay, self.kill):
+            registry.add(c)
+        chaos_monkey._registry = registry
+        self.addCleanup(ChaosMonkey.reset_registry)
+        self.addCleanup(disable_all)
+
+    def test_chaos_context_manager(self):
+        with chaos('deny-all') as fault:
+            self.deny.enable.assert_called_once_with()
+            self.assertEqual(self.deny.disable.call_count, 0)
+            self.assertTrue(fault.enabled)
+            self.assertEqual(active(), [fault])
+        self.deny.disable.assert_called_once_with()
+        self.assertFalse(fault.enabled)
+        self.assertEqual(active(), [])
+
+    def test_chaos_disables_on_error(self):
+        with self.assertRaises(ValueError):
+            with chaos('delay'):
+                raise ValueError()
+        self.delay.disable.assert_called_once_with()
+
+    def test_chaos_unknown_command(self):
+        with self.assertRaisesRegexp(NotFound,
+                                     'Unknown chaos command: foo'):
+            chaos('foo')
+
+    def test_enable_and_disable(self):
+        fault = enable('delay')
+        self.assertEqual(fault.command_str, 'delay')
+        fault.disable()
+        fault.disable()
+        self.delay.disable.assert_called_once_with()
+
+    def test_enable_conflicting(self):
+        with chaos('deny-all'):
+            with self.assertRaisesRegexp(
+                    BadRequest, 'deny-incoming conflicts with enabled '
+                                'deny-all'):
+                enable('deny-incoming')
+            with chaos('delay'):
+                self.assertEqual(len(active()), 2)
+        self.assertEqual(self.deny_in.enable.call_count, 0)
+        enable('deny-incoming').disable()
+
+    def test_enable_failure_releases_resources(self):
+        self.deny.enable.side_effect = CalledProcessError(1, 'ufw')
+        with self.assertRaises(CalledProcessError):
+            enable('deny-all')
+        self.assertEqual(active(), [])
+        enable('deny-incoming').disable()
+
+    def test_disable_failure_keeps_fault(self):
+        fault = enable('deny-all')
+        self.deny.disable.side_effect = CalledProcessError(1, 'ufw')
+        with self.assertRaises(CalledProcessError):
+            fault.disable()
+        self.assertEqual(active(), [fault])
+        self.deny.disable.side_effect = None
+        fault.disable()
+        self.assertEqual(active(), [])
+
+    def test_enable_without_disable(self):
+        fault = enable('kill-mongod')
+        self.kill.enable.assert_called_once_with()
+        self.assertFalse(fault.enabled)
+        self.assertEqual(active(), [])
+
+    def test_disable_all(self):
+        enable('deny-all')
+        enable('delay')
+        disable_all()
+        self.assertEqual(active(), [])
+        self.deny.disable.assert_called_once_with()
+        self.delay.disable.assert_called_once_with()
+
+    def test_commands(self):
+        self.assertEqual(
+            commands(), ['deny-all', 'deny-incoming', 'delay', 'kill-mongod'])
+        self.assertEqual(commands('kill'), ['kill-mongod'])
+        self.assertEqual(commands('foo'), [])
+
+    def test_configure(self):
+        with patch('api.ChaosMonkey.configure', autospec=True) as mock:
+            api.configure(interfaces='all')
+        mock.assert_called_once_with(interfaces='all')
+
+    def test_shell_helper(self):
+        with shell_helper() as helper:
+            self.assertEqual(run_shell_command('echo hi'), 'hi\n')
+        self.assertEqual(helper.latency_report()['echo']['count'], 1)
+        self.assertIsNotNone(helper.process.poll())
+
+    def test_no_logging_side_effects(self):
+        root = logging.getLogger()
+        with patch.object(root, 'handlers', []):
+            run_shell_command('false', quiet_mode=True)
+            self.assertEqual(root.handlers, [])
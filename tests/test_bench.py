@@ -0,0 +1,79 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import json
+import os
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+
+from bench.control_path import (
+    catalogue,
+    main,
+    measure,
+    run,
+    write_replay,
+)
+from chaos_monkey import ChaosMonkey
+from replay import read_replay
+from utility import temp_dir
+
+__metaclass__ = type
+
+
+def call_once(func, **kwargs):
+    func()
+    return 0.001, 1
+
+
+class TestControlPath(TestCase):
+
+    def test_measure(self):
+        calls = []
+        seconds, number = measure(lambda: calls.append(1), min_time=0.001,
+                                  repeat=2)
+        # The calibration calls are followed by the timed repeat.
+        self.assertGreaterEqual(len(calls), number * 2)
+        self.assertGreater(seconds, 0)
+
+    def test_catalogue(self):
+        with catalogue(20) as registry:
+            self.assertIs(ChaosMonkey.registry(), registry)
+            self.assertEqual(len(ChaosMonkey.get_all_commands()), 20)
+            self.assertEqual(len(ChaosMonkey.get_all_groups()), 10)
+        self.assertIsNot(ChaosMonkey.registry(), registry)
+
+    def test_write_replay(self):
+        with temp_dir() as directory:
+            for replay_format in ('yaml', 'events'):
+                path = os.path.join(directory, replay_format)
+                write_replay(path, 3, replay_format)
+                with open(path) as f:
+                    commands = [c[:2] for c in read_replay(f)]
+                self.assertEqual(commands, [
+                    ('command-0', 1), ('command-1', 1), ('command-2', 1)])
+
+    def test_run(self):
+        with patch('bench.control_path.measure', side_effect=call_once):
+            report = run(catalogue_sizes=[10, 100], replay_sizes=[10])
+        self.assertEqual(
+            [(r['benchmark'], r['size']) for r in report['results']],
+            [('startup', 10), ('filter_commands', 10), ('select', 10),
+             ('run_command', 10), ('startup', 100),
+             ('filter_commands', 100), ('select', 100),
+             ('run_command', 100), ('log_event', 1),
+             ('log_event_queued', 1), ('replay_load_yaml', 10),
+             ('replay_load_events', 10)])
+        self.assertEqual(report['results'][-1]['item_us'], 100)
+
+    def test_main_output(self):
+        with temp_dir() as directory:
+            output = os.path.join(directory, 'bench.json')
+            with patch('bench.control_path.measure', side_effect=call_once):
+                with patch('sys.stderr', StringIO()) as stderr:
+                    main(['--output', output, '--catalogue-sizes', '10',
+                          '--replay-sizes', '10'])
+            with open(output) as f:
+                report = json.load(f)
+        self.assertEqual(len(report['results']), 8)
+        self.assertIn('replay_load_events', stderr.getvalue())
@@ -1,12 +1,38 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
+import os
+import subprocess
+import sys
+
+from mock import patch
+
+from chaos import plugins
 from chaos_monkey import (
     ChaosMonkey,
+    ChaosRegistry,
+    discover_plugins,
+)
+from chaos_monkey_base import (
+    Chaos,
+    ChaosPlugin,
+    join_command,
+    LazyChaos,
+    split_command,
 )
 from chaos.kill import Kill
+from selection import (
+    SelectionPolicy,
+    UniformSelector,
+    WeightedSelector,
+)
 from tests.common_test_base import CommonTestBase
 from tests.test_kill import get_all_kill_commands
 from tests.test_net import get_all_net_commands
+from utility import (
+    BadRequest,
+    NotFound,
+    temp_dir,
+)
 
 __metaclass__ = type
 
@@ -199,15 +225,150 @@ class TestChaosMonkey(CommonTestBase):
         self.assertTrue(any(c.group == 'net' for c in cm.chaos))
 
     def test_find_command(self):
-        all_chaos, _ = ChaosMonkey.get_all_chaos()
-        command = ChaosMonkey._find_command(all_chaos, 'deny-all')
+        command = ChaosMonkey.find_command('deny-all')
         self.assertEqual(command.command_str, 'deny-all')
 
     def test_find_command_wrong_command(self):
-        all_chaos, _ = ChaosMonkey.get_all_chaos()
-        command = ChaosMonkey._find_command(all_chaos, 'foo')
+        command = ChaosMonkey.find_command('foo')
         self.assertEqual(command, None)
 
+    def test_find_command_parameterized(self):
+        chaos = ChaosMonkey.find_command('delay(jitter=0ms,latency=100ms)')
+        self.assertEqual(chaos.command_str, 'delay(jitter=0ms,latency=100ms)')
+        self.assertEqual(chaos.group, 'net')
+        self.assertEqual(chaos.resolve()._actions[0].netem,
+                         'netem delay 100ms')
+        # Every spelling of the command finds the same Chaos.
+        self.assertIs(
+            ChaosMonkey.find_command('delay(latency=100ms, jitter=0ms)'),
+            chaos)
+        self.assertIs(ChaosMonkey.find_command('delay()'),
+                      ChaosMonkey.find_command('delay'))
+        self.assertNotIn(chaos, ChaosMonkey.registry().chaos)
+
+    def test_find_command_parameterized_errors(self):
+        self.assertIsNone(ChaosMonkey.find_command('foo(latency=1ms)'))
+        with self.assertRaisesRegexp(BadRequest, 'Invalid delay parameter'):
+            ChaosMonkey.find_command('delay(loss=1%)')
+        with self.assertRaisesRegexp(BadRequest,
+                                     'Command takes no parameters: deny-all'):
+            ChaosMonkey.find_command('deny-all(port=1)')
+        registry = ChaosRegistry([])
+        registry.add(Chaos(None, None, 'foo', 'foo', 'Foo.'))
+        with self.assertRaisesRegexp(BadRequest,
+                                     'Command takes no parameters: foo'):
+            registry.find('foo(x=1)')
+
+    def test_split_command(self):
+        self.assertEqual(split_command('delay'), ('delay', {}))
+        self.assertEqual(split_command('delay()'), ('delay', {}))
+        self.assertEqual(
+            split_command('delay(latency=1s, rate=1mbit)'),
+            ('delay', {'latency': '1s', 'rate': '1mbit'}))
+        for command_str in ('delay(latency)', 'delay(a=1,a=2)',
+                            'delay(a=1 2)', 'delay(A=1)'):
+            with self.assertRaisesRegexp(BadRequest,
+                                         'Invalid command parameter'):
+                split_command(command_str)
+
+    def test_join_command(self):
+        self.assertEqual(join_command('delay', {}), 'delay')
+        self.assertEqual(
+            join_command('delay', {'rate': '1mbit', 'latency': '1s'}),
+            'delay(latency=1s,rate=1mbit)')
+
+    def test_include_command_parameterized(self):
+        cm = ChaosMonkey.factory()
+        cm.include_command(['delay(latency=1s)', 'delay(latency=2s)'])
+        self.assertEqual(self._get_command_str(cm.chaos),
+                         ['delay(latency=1s)', 'delay(latency=2s)'])
+
+    def test_include_command_spellings_once(self):
+        cm = ChaosMonkey.factory()
+        cm.include_command(['delay(jitter=1ms,latency=5ms)',
+                            'delay(latency=5ms,jitter=1ms)', 'delay',
+                            'delay()'])
+        self.assertEqual(self._get_command_str(cm.chaos),
+                         ['delay(jitter=1ms,latency=5ms)', 'delay'])
+
+    def test_exclude_command_spellings(self):
+        cm = ChaosMonkey.factory()
+        cm.include_command(['delay(latency=5ms,jitter=1ms)', 'delay'])
+        cm.exclude_command(['delay(latency=5ms,jitter=1ms)', 'delay()'])
+        self.assertEqual(cm.chaos, [])
+
+    def test_include_command_twice(self):
+        cm = ChaosMonkey.factory()
+        cm.include_command(['deny-all', 'deny-incoming'])
+        cm.include_command(['deny-all'])
+        self.assertEqual(
+            self._get_command_str(cm.chaos), ['deny-all', 'deny-incoming'])
+
+    def test_selector(self):
+        cm = ChaosMonkey.factory()
+        cm.include_group(['net'])
+        selector = cm.selector()
+        self.assertIsInstance(selector, UniformSelector)
+        self.assertIs(cm.selector(), selector)
+        cm.policy = SelectionPolicy.from_dict(
+            {'commands': {'deny-all': {'min-interval': 60}}})
+        selector = cm.selector()
+        self.assertIsInstance(selector, WeightedSelector)
+        self.assertEqual(selector.chaos, cm.chaos)
+        selector.choose(0, accept=lambda c: c.command_str == 'deny-all')
+        cm.exclude_command(['deny-incoming'])
+        self.assertIsNot(cm.selector(), selector)
+        self.assertIsNone(cm.selector().choose(
+            1, accept=lambda c: c.command_str == 'deny-all'))
+        selector = cm.selector()
+        cm.include_command(['deny-incoming'])
+        self.assertIsNot(cm.selector(), selector)
+        self.assertIn('deny-incoming',
+                      self._get_command_str(cm.selector().chaos))
+        cm.policy = None
+        self.assertIsInstance(cm.selector(), UniformSelector)
+        cm.reset_command_selection()
+        self.assertEqual(cm.selector().chaos, [])
+
+    def test_selection_history(self):
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'deny-all': {'min-interval': 60}}})
+        cm = ChaosMonkey.factory()
+        cm.include_command(['deny-all'])
+        cm.policy = policy
+        self.assertEqual(cm.selector().choose(10).command_str, 'deny-all')
+        history = cm.selection_history()
+        self.assertEqual(history, {'deny-all': [10]})
+        restored = ChaosMonkey.factory()
+        restored.include_command(['deny-all'])
+        restored.policy = policy
+        restored.restore_selection_history(history)
+        self.assertIsNone(restored.selector().choose(30))
+        self.assertEqual(restored.selector().next_allowed_time(30), 70)
+
+    def test_registry_is_built_once(self):
+        ChaosMonkey.reset_registry()
+        self.addCleanup(ChaosMonkey.reset_registry)
+        registry = ChaosMonkey.registry()
+        ChaosMonkey.get_all_chaos()
+        ChaosMonkey.get_all_groups()
+        ChaosMonkey.get_all_commands()
+        self.assertIs(ChaosMonkey.registry(), registry)
+
+    def test_registry_indexes(self):
+        registry = ChaosMonkey.registry()
+        self.assertItemsEqual(
+            registry.commands.keys(), self._get_all_command_strings())
+        self.assertItemsEqual(registry.groups.keys(), self._get_all_groups())
+        for group, chaos in registry.groups.items():
+            self.assertTrue(all(c.group == group for c in chaos))
+
+    def test_get_all_chaos_returns_copy(self):
+        all_chaos, _ = ChaosMonkey.get_all_chaos()
+        all_chaos.pop()
+        self.assertEqual(
+            len(ChaosMonkey.get_all_chaos()[0]), len(all_chaos) + 1)
+
     def test_get_groups(self):
         cm = ChaosMonkey.factory()
         all_chaos, _ = cm.get_all_chaos()
@@ -233,6 +394,72 @@ class TestChaosMonkey(CommonTestBase):
         all_groups = ChaosMonkey.get_all_groups()
         self.assertItemsEqual(all_groups, self._get_all_groups())
 
+    def test_plugin_metadata_matches_chaos(self):
+        for plugin in plugins:
+            loaded = plugin.load()
+            self.assertItemsEqual(
+                [c[0] for c in plugin.commands], loaded.keys())
+            for command_str, description in plugin.commands:
+                self.assertEqual(loaded[command_str].description, description)
+                self.assertEqual(loaded[command_str].group, plugin.group)
+
+    def test_registry_is_lazy(self):
+        plugin = ChaosPlugin('chaos.net', 'Net', 'net', [['delay', 'Delay.']])
+        registry = ChaosRegistry([plugin])
+        self.assertIsInstance(registry.commands['delay'], LazyChaos)
+        self.assertEqual(registry.factory_obj, [])
+        self.assertIs(plugin.loaded, False)
+        registry.commands['delay'].enable
+        self.assertIs(plugin.loaded, True)
+        self.assertEqual(registry.factory_obj, [plugin.factory_obj])
+
+    def test_lazy_chaos_unknown_command(self):
+        plugin = ChaosPlugin('chaos.net', 'Net', 'net', [['foo', 'Foo.']])
+        chaos = plugin.get_chaos()[0]
+        with self.assertRaisesRegexp(
+                NotFound, 'chaos.net does not provide command: foo'):
+            chaos.enable
+
+    def test_runner_help_does_not_import_chaos(self):
+        cm_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        code = ("import sys, runner; runner.display_all_commands(); "
+                "sys.stdout.write(str('chaos.net' in sys.modules))")
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], cwd=cm_dir)
+        self.assertEqual(output, 'False')
+
+    def test_discover_plugins(self):
+        with temp_dir() as directory:
+            with open(os.path.join(directory, 'foo.yaml'), 'w') as f:
+                f.write('module: foo_chaos\nfactory: Foo\ngroup: foo\n'
+                        'commands:\n  - [foo-bar, Break foo.]\n')
+            discovered = discover_plugins(directory)
+        self.assertEqual(discovered[:len(plugins)], plugins)
+        foo = discovered[-1]
+        self.assertEqual(foo.module, 'foo_chaos')
+        self.assertEqual(foo.factory, 'Foo')
+        self.assertEqual(foo.group, 'foo')
+        self.assertEqual(foo.commands, [['foo-bar', 'Break foo.']])
+        self.assertEqual(foo.path, directory)
+
+    def test_discover_plugins_env(self):
+        with patch.dict(os.environ, {'CHAOS_MONKEY_PLUGIN_PATH': ''}):
+            self.assertEqual(discover_plugins(), plugins)
+
+    def test_plugin_load_from_path(self):
+        with temp_dir() as directory:
+            with open(os.path.join(directory, 'foo.yaml'), 'w') as f:
+                f.write('module: chaos_plugin_foo\nfactory: Foo\n'
+                        'group: foo\ncommands:\n  - [foo-bar, Foo.]\n')
+            with open(os.path.join(directory, 'chaos_plugin_foo.py'),
+                      'w') as f:
+                f.write(FOO_PLUGIN)
+            self.addCleanup(sys.path.remove, directory)
+            plugin = discover_plugins(directory)[-1]
+            chaos = plugin.get_chaos()[0]
+            self.assertEqual(chaos.enable(), 'foo')
+        self.assertIsNone(chaos.disable)
+
     def _get_command_str(self, chaos):
         return [c.command_str for c in chaos]
 
@@ -241,3 +468,18 @@ class TestChaosMonkey(CommonTestBase):
 
     def _get_all_groups(self):
         return ['net', Kill.group]
+
+
+FOO_PLUGIN = """
+from chaos_monkey_base import Chaos, ChaosMonkeyBase
+
+
+class Foo(ChaosMonkeyBase):
+
+    @classmethod
+    def factory(cls):
+        return cls()
+
+    def get_chaos(self):
+        return [Chaos(lambda: 'foo', None, 'foo', 'foo-bar', 'Foo.')]
+"""
@@ -0,0 +1,241 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+import random
+import socket
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+
+from coordinator import (
+    Coordinator,
+    FleetPolicy,
+    LeaseAgent,
+    LoopbackTransport,
+    parse_args,
+    serve_coordinator,
+    SocketTransport,
+    stop_coordinator,
+)
+from scheduler import VirtualClock
+from utility import (
+    BadRequest,
+    temp_dir,
+)
+
+__metaclass__ = type
+
+
+COMMANDS = ['deny-all', 'kill-mongod']
+
+
+class LastChoice:
+
+    def choice(self, seq):
+        return seq[-1]
+
+
+class TestFleetPolicy(TestCase):
+
+    def test_from_dict(self):
+        policy = FleetPolicy.from_dict({
+            'max-faults': 3, 'budget': 600, 'roles': {'state-server': 1},
+            'commands': {'kill-mongod': 1}, 'lease-grace': 10, 'retry': 2})
+        self.assertEqual(policy.max_faults, 3)
+        self.assertEqual(policy.budget, 600)
+        self.assertEqual(policy.roles, {'state-server': 1})
+        self.assertEqual(policy.commands, {'kill-mongod': 1})
+        self.assertEqual((policy.lease_grace, policy.retry), (10, 2))
+
+    def test_from_dict_defaults(self):
+        policy = FleetPolicy.from_dict(None)
+        self.assertEqual(policy.max_faults, 1)
+        self.assertIsNone(policy.budget)
+        self.assertEqual((policy.roles, policy.commands), ({}, {}))
+
+    def test_from_dict_invalid(self):
+        for data in ({'max-faults': -1}, {'budget': -1}, {'roles': [1]},
+                     {'commands': {'deny-all': 'x'}}, {'retry': 0}):
+            with self.assertRaisesRegexp(BadRequest, 'Invalid fleet policy'):
+                FleetPolicy.from_dict(data)
+
+    def test_from_file(self):
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'fleet.yaml')
+            with open(path, 'w') as f:
+                f.write('max-faults: 2\nroles:\n  state-server: 1\n')
+            policy = FleetPolicy.from_file(path)
+        self.assertEqual(policy.max_faults, 2)
+        self.assertEqual(policy.roles, {'state-server': 1})
+
+
+class TestCoordinator(TestCase):
+
+    def make_coordinator(self, rng=None, **kwargs):
+        self.clock = VirtualClock()
+        return Coordinator(FleetPolicy(**kwargs), clock=self.clock.time,
+                           rng=rng or random)
+
+    def test_acquire(self):
+        coordinator = self.make_coordinator()
+        lease = coordinator.acquire('unit-0', None, COMMANDS, 60)
+        self.assertIn(lease.command_str, COMMANDS)
+        self.assertEqual((lease.unit, lease.duration), ('unit-0', 60))
+        self.assertEqual(coordinator.leases, {lease.id: lease})
+
+    def test_acquire_max_faults(self):
+        coordinator = self.make_coordinator(max_faults=2)
+        self.assertIsNotNone(coordinator.acquire('unit-0', None, COMMANDS, 1))
+        self.assertIsNotNone(coordinator.acquire('unit-1', None, COMMANDS, 1))
+        self.assertIsNone(coordinator.acquire('unit-2', None, COMMANDS, 1))
+
+    def test_acquire_one_lease_per_unit(self):
+        coordinator = self.make_coordinator(max_faults=2)
+        self.assertIsNotNone(coordinator.acquire('unit-0', None, COMMANDS, 1))
+        self.assertIsNone(coordinator.acquire('unit-0', None, COMMANDS, 1))
+
+    def test_acquire_role_limit(self):
+        coordinator = self.make_coordinator(
+            max_faults=3, roles={'state-server': 1})
+        self.assertIsNotNone(
+            coordinator.acquire('unit-0', 'state-server', COMMANDS, 1))
+        self.assertIsNone(
+            coordinator.acquire('unit-1', 'state-server', COMMANDS, 1))
+        self.assertIsNotNone(
+            coordinator.acquire('unit-2', 'worker', COMMANDS, 1))
+
+    def test_acquire_command_limit(self):
+        # Pick kill-mongod whenever the policy allows it.
+        coordinator = self.make_coordinator(
+            rng=LastChoice(), max_faults=3, commands={'kill-mongod': 1})
+        leases = [coordinator.acquire('unit-{}'.format(i), None, COMMANDS, 1)
+                  for i in range(3)]
+        self.assertEqual(
+            sorted(lease.command_str for lease in leases),
+            ['deny-all', 'deny-all', 'kill-mongod'])
+
+    def test_acquire_budget(self):
+        coordinator = self.make_coordinator(max_faults=3, budget=90)
+        first = coordinator.acquire('unit-0', None, COMMANDS, 60)
+        second = coordinator.acquire('unit-1', None, COMMANDS, 60)
+        self.assertEqual((first.duration, second.duration), (60, 30))
+        self.assertIsNone(coordinator.acquire('unit-2', None, COMMANDS, 60))
+        self.assertEqual(coordinator.spent, 90)
+
+    def test_release_refunds_budget(self):
+        coordinator = self.make_coordinator(budget=90)
+        lease = coordinator.acquire('unit-0', None, COMMANDS, 60)
+        self.clock.wait(20)
+        self.assertTrue(coordinator.release(lease.id))
+        self.assertFalse(coordinator.release(lease.id))
+        self.assertEqual(coordinator.spent, 20)
+        self.assertEqual(coordinator.leases, {})
+
+    def test_expire(self):
+        coordinator = self.make_coordinator(lease_grace=10)
+        coordinator.acquire('unit-0', None, COMMANDS, 60)
+        self.clock.wait(70)
+        self.assertIsNone(coordinator.acquire('unit-1', None, COMMANDS, 60))
+        self.clock.wait(1)
+        self.assertIsNotNone(
+            coordinator.acquire('unit-1', None, COMMANDS, 60))
+        self.assertEqual(
+            [lease.unit for lease in coordinator.leases.values()],
+            ['unit-1'])
+
+    def test_handle(self):
+        coordinator = self.make_coordinator(retry=2)
+        request = {'op': 'acquire', 'unit': 'unit-0', 'role': None,
+                   'commands': ['deny-all'], 'duration': 60}
+        response = coordinator.handle(request)
+        self.assertEqual(response, {'lease': {
+            'id': 1, 'unit': 'unit-0', 'role': None, 'command': 'deny-all',
+            'duration': 60}})
+        self.assertEqual(coordinator.handle(request),
+                         {'lease': None, 'retry': 2})
+        self.assertEqual(coordinator.handle({'op': 'release', 'id': 1}),
+                         {'released': True})
+
+    def test_handle_invalid(self):
+        coordinator = self.make_coordinator()
+        self.assertIn('Invalid op', coordinator.handle({'op': 'foo'})['error'])
+        self.assertIn('Invalid request',
+                      coordinator.handle({'op': 'acquire'})['error'])
+        self.assertIn('Invalid request', coordinator.handle([])['error'])
+
+
+class TestLeaseAgent(TestCase):
+
+    def test_acquire_and_release(self):
+        coordinator = Coordinator(FleetPolicy())
+        agent = LeaseAgent(LoopbackTransport(coordinator), 'unit-0',
+                           'state-server')
+        lease, retry = agent.acquire(['deny-all'], 60)
+        self.assertEqual(lease['command'], 'deny-all')
+        self.assertEqual(coordinator.leases[lease['id']].role,
+                         'state-server')
+        self.assertEqual(agent.acquire(['deny-all'], 60), (None, 5))
+        agent.release(lease)
+        self.assertEqual(coordinator.leases, {})
+
+    def test_acquire_coordinator_unavailable(self):
+        with temp_dir() as directory:
+            agent = LeaseAgent(
+                SocketTransport(os.path.join(directory, 'missing.sock')),
+                'unit-0', retry=7)
+            with patch('logging.warning', autospec=True) as log_mock:
+                self.assertEqual(agent.acquire(['deny-all'], 60), (None, 7))
+        self.assertIn('Coordinator unavailable',
+                      log_mock.call_args[0][0])
+
+    def test_error_response(self):
+        agent = LeaseAgent(LoopbackTransport(Coordinator(FleetPolicy())),
+                           'unit-0')
+        with self.assertRaisesRegexp(BadRequest, 'Invalid request'):
+            agent.acquire(None, 60)
+
+
+class TestServeCoordinator(TestCase):
+
+    def test_serve_tcp(self):
+        coordinator = Coordinator(FleetPolicy())
+        server = serve_coordinator(coordinator, '127.0.0.1:0')
+        self.addCleanup(stop_coordinator, server)
+        agent = LeaseAgent(SocketTransport(
+            '127.0.0.1:{}'.format(server.server_address[1])), 'unit-0')
+        lease, _ = agent.acquire(['deny-all'], 60)
+        self.assertEqual(lease['command'], 'deny-all')
+        agent.release(lease)
+        self.assertEqual(coordinator.leases, {})
+
+    def test_serve_unix_socket(self):
+        coordinator = Coordinator(FleetPolicy())
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'coordinator.sock')
+            server = serve_coordinator(coordinator, path)
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(path)
+            stream = client.makefile('r+')
+            stream.write('not json\n{"op": "release", "id": 1}\n')
+            stream.flush()
+            responses = [stream.readline(), stream.readline()]
+            client.close()
+            stop_coordinator(server)
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(responses, ['{"error": "Invalid JSON."}\n',
+                                     '{"released": false}\n'])
+
+
+class TestParseArgs(TestCase):
+
+    def test_parse_args(self):
+        args = parse_args(['0.0.0.0:9108', '--policy', 'fleet.yaml'])
+        self.assertEqual((args.address, args.policy),
+                         ('0.0.0.0:9108', 'fleet.yaml'))
+
+    def test_parse_args_invalid_address(self):
+        with patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(SystemExit):
+                parse_args(['coordinator.sock'])
+        self.assertIn('Invalid address', stderr.getvalue())
@@ -0,0 +1,80 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import json
+from unittest import TestCase
+
+from mock import patch
+import yaml
+
+from event_log import (
+    commands_from_events,
+    DISABLE,
+    ENABLE,
+    EventMessage,
+    export_yaml,
+    read_events,
+)
+from utility import StructuredMessage
+
+__metaclass__ = type
+
+
+class TestEventLog(TestCase):
+
+    def test_event_message(self):
+        with patch('event_log.monotonic', autospec=True, return_value=12.5):
+            with patch('event_log.time', autospec=True, return_value=100):
+                message = EventMessage(ENABLE, 'deny-all', 30, 0.25)
+        self.assertEqual(
+            str(message),
+            '{"mono":12.500000,"time":100.000000,"offset":null,'
+            '"event":"enable",'
+            '"command":"deny-all","duration":30,"latency":0.25,'
+            '"outcome":"ok"}')
+
+    def test_event_message_offset(self):
+        message = EventMessage(ENABLE, 'deny-all', 30, offset=95.25)
+        self.assertEqual(json.loads(str(message))['offset'], 95.25)
+
+    def test_event_message_is_json(self):
+        message = EventMessage(DISABLE, 'deny-"all"', latency=None,
+                               outcome='CalledProcessError')
+        event = json.loads(str(message))
+        self.assertEqual(event['command'], 'deny-"all"')
+        self.assertIsNone(event['duration'])
+        self.assertIsNone(event['latency'])
+        self.assertEqual(event['outcome'], 'CalledProcessError')
+        self.assertGreater(event['mono'], 0)
+
+    def test_read_events(self):
+        lines = [str(EventMessage(ENABLE, 'deny-all', 3)), '\n',
+                 str(EventMessage(DISABLE, 'deny-all', latency=0.1))]
+        events = list(read_events(lines))
+        self.assertEqual([e['event'] for e in events], [ENABLE, DISABLE])
+        self.assertLessEqual(events[0]['mono'], events[1]['mono'])
+
+    def test_commands_from_events(self):
+        events = [{'event': ENABLE, 'command': 'deny-all', 'duration': 3},
+                  {'event': DISABLE, 'command': 'deny-all', 'duration': None},
+                  {'event': ENABLE, 'command': 'kill-mongod', 'duration': 1}]
+        self.assertEqual(commands_from_events(events),
+                         [['deny-all', 3], ['kill-mongod', 1]])
+
+    def test_commands_from_events_with_offset(self):
+        events = [{'event': ENABLE, 'command': 'deny-all', 'duration': 3,
+                   'offset': 0.5},
+                  {'event': ENABLE, 'command': 'kill-mongod', 'duration': 1,
+                   'offset': None}]
+        self.assertEqual(commands_from_events(events),
+                         [['deny-all', 3, 0.5], ['kill-mongod', 1]])
+
+    def test_export_yaml(self):
+        lines = [str(EventMessage(ENABLE, 'deny-all', 3)),
+                 str(EventMessage(DISABLE, 'deny-all', latency=0.1)),
+                 str(EventMessage(ENABLE, 'restart-unit', 2))]
+        exported = export_yaml(lines)
+        self.assertEqual(exported, str(StructuredMessage('deny-all', 3)) +
+                         '\n' + str(StructuredMessage('restart-unit', 2)) +
+                         '\n')
+        self.assertEqual(yaml.safe_load(exported),
+                         [['deny-all', 3], ['restart-unit', 2]])
@@ -1,9 +1,17 @@
 import os
+import sys
 from tempfile import NamedTemporaryFile
 
 from unittest import TestCase
 
-from utils.init import Init
+from mock import patch
+
+from utility import temp_dir
+from utils.init import (
+    Init,
+    juju_units,
+    SystemdInit,
+)
 
 __metaclass__ = type
 
@@ -21,6 +29,8 @@ class TestInit(TestCase):
             cm_dir, 'scripts', 'restart_chaos_monkey.py'))
         self.assertEqual(init.runner_path, os.path.join(
             cm_dir, 'runner.py'))
+        self.assertEqual(init.state_path,
+                         '/var/lib/chaos-monkey-restart.json')
 
     def test_install(self):
         init_script_path = os.path.join(
@@ -29,24 +39,36 @@ class TestInit(TestCase):
             conf_content = f.read()
         with NamedTemporaryFile() as init_fd:
             restart_script_path = '/scripts/restart_chaos_monkey.py'
-            runner_path = '/path/runner.py'
+            state_path = '/var/lib/state.json'
             init = Init(init_path=init_fd.name,
                         init_script_path=init_script_path,
                         restart_script_path=restart_script_path,
-                        runner_path=runner_path)
-            cmd_arg = '--include-command=deny-all workspace'
-            expire_time = 65537.00
-            init.install(cmd_arg, expire_time)
-
+                        runner_path='/path/runner.py',
+                        state_path=state_path)
+            init.install()
             conf_content = conf_content.format(
                 restart_script_path=restart_script_path,
-                runner_path=runner_path,
-                expire_time=expire_time,
-                cmd_arg=cmd_arg)
-
+                state_path=state_path)
             with open(init_fd.name) as f:
                 init_content = f.read()
             self.assertEqual(init_content, conf_content)
+        self.assertNotIn('{', init_content)
+
+    def test_install_only_writes_changes(self):
+        with temp_dir() as directory:
+            init = Init(init_path=os.path.join(directory, 'restart.conf'),
+                        init_script_path=os.path.join(
+                            get_chaos_monkey_dir(), 'scripts',
+                            'chaos-monkey-restart.conf'),
+                        restart_script_path='/scripts/restart.py',
+                        runner_path='/path/runner.py',
+                        state_path='/var/lib/state.json')
+            init.install()
+            with patch('utils.init.open', create=True,
+                       side_effect=open) as open_mock:
+                init.install()
+            modes = [c[0][1:] for c in open_mock.call_args_list]
+        self.assertNotIn(('w',), modes)
 
     def test_uninstall(self):
         with NamedTemporaryFile(delete=False) as init_fd:
@@ -56,31 +78,71 @@ class TestInit(TestCase):
             init = Init(init_path=init_fd.name,
                         init_script_path='fake',
                         restart_script_path='fake',
-                        runner_path='fake')
+                        runner_path='fake',
+                        state_path='fake')
             init.uninstall()
             self.assertIs(os.path.isfile(init_fd.name), False)
 
-    def test_remove_args(self):
-        cmd_arg = ("--include-command restart-unit --enablement-timeout 1"
-                   " /home/myhome --expire-time 946598401 --restart")
-        expected = ("--include-command restart-unit --enablement-timeout 1"
-                    " /home/myhome")
-        result = Init._remove_args(cmd_arg)
-        self.assertEqual(result, expected)
-
-    def test_remove_args_restart_in_middle_of_string(self):
-        cmd_arg = ("--include-command restart-unit --enablement-timeout 1"
-                   " /home/myhome --restart --expire-time 946598401")
-        expected = ("--include-command restart-unit --enablement-timeout 1"
-                    " /home/myhome")
-        result = Init._remove_args(cmd_arg)
-        self.assertEqual(result, expected)
-
-    def test_remove_args_no_expire_time_and_no_restart(self):
-        cmd_arg = ("--include-command restart-unit --enablement-timeout 1 "
-                   "/home/myhome")
-        result = Init._remove_args(cmd_arg)
-        self.assertEqual(result, cmd_arg)
+
+class TestSystemdInit(TestCase):
+
+    def test_detect(self):
+        with temp_dir() as root:
+            self.assertIs(type(Init.detect(root)), Init)
+            os.makedirs(os.path.join(root, 'run', 'systemd', 'system'))
+            init = Init.detect(root)
+        self.assertIsInstance(init, SystemdInit)
+        self.assertEqual(init.init_path, os.path.join(
+            root, 'etc', 'systemd', 'system',
+            'chaos-monkey-restart.service'))
+        self.assertEqual(init.wants_path, os.path.join(
+            root, 'etc', 'systemd', 'system', 'multi-user.target.wants',
+            'chaos-monkey-restart.service'))
+        self.assertEqual(init.state_path, os.path.join(
+            root, 'var', 'lib', 'chaos-monkey-restart.json'))
+        self.assertEqual(init.init_script_path, os.path.join(
+            get_chaos_monkey_dir(), 'scripts',
+            'chaos-monkey-restart.service'))
+
+    def test_juju_units(self):
+        with temp_dir() as root:
+            self.assertEqual(juju_units(root), ())
+            for unit_dir, unit in (
+                    ('etc/systemd/system', 'jujud-machine-0.service'),
+                    ('lib/systemd/system', 'jujud-unit-mysql-0.service'),
+                    ('lib/systemd/system', 'ssh.service')):
+                make_file(os.path.join(root, unit_dir, unit))
+            units = juju_units(root)
+        self.assertEqual(units, ('jujud-machine-0.service',
+                                 'jujud-unit-mysql-0.service'))
+
+    def test_install_and_uninstall(self):
+        with temp_dir() as root:
+            os.makedirs(os.path.join(root, 'run', 'systemd', 'system'))
+            os.makedirs(os.path.join(root, 'etc', 'systemd', 'system'))
+            make_file(os.path.join(
+                root, 'lib', 'systemd', 'system', 'jujud-machine-0.service'))
+            init = Init.detect(root)
+            init.install()
+            init.install()
+            with open(init.init_path) as f:
+                unit = f.read()
+            self.assertEqual(os.readlink(init.wants_path), init.init_path)
+            init.uninstall()
+            self.assertFalse(os.path.exists(init.init_path))
+            self.assertFalse(os.path.lexists(init.wants_path))
+        self.assertIn(
+            'After=network-online.target jujud-machine-0.service\n', unit)
+        self.assertIn('ConditionPathExists={}\n'.format(init.state_path),
+                      unit)
+        self.assertIn('ExecStart={} {} --state-file {} --exec\n'.format(
+            sys.executable, init.restart_script_path, init.state_path), unit)
+
+
+def make_file(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
 
 
 def get_chaos_monkey_dir():
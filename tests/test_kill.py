@@ -1,73 +1,131 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
-from subprocess import CalledProcessError
-
-from mock import patch, call
-
-from chaos.kill import Kill
+import errno
+import shutil
+import signal
+from tempfile import mkdtemp
+
+from mock import (
+    call,
+    patch,
+)
+
+from chaos.kill import (
+    Kill,
+    parse_match,
+)
+from chaos_monkey import ChaosMonkey
 from tests.common_test_base import CommonTestBase
+from tests.test_process import make_proc
+from utility import (
+    BadRequest,
+    NotFound,
+)
+from utils.process import ProcessFinder
 
 
 class TestKill(CommonTestBase):
 
     def setUp(self):
         self.setup_test_logging()
+        root = mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        make_proc(root, 1234, 'jujud', ['jujud', '--machine-id', '1'])
+        make_proc(root, 2345, 'jujud', ['jujud', '--machine-id', '2'],
+                  start=200)
+        make_proc(root, 3456, 'mongod', ['/usr/bin/mongod'],
+                  exe='/usr/bin/mongod')
+        self.finder = ProcessFinder(root)
 
     def test_get_pids(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   return_value='1234 2345\n') as mock:
-            pids = kill.get_pids('jujud')
-        self.assertEqual(pids, ['1234', '2345'])
-        mock.assert_called_once_with(['pidof', 'jujud'])
+        kill = Kill(finder=self.finder)
+        pids = kill.get_pids('jujud')
+        self.assertEqual(pids, [2345, 1234])
 
     def test_get_pids_no_process(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   side_effect=CalledProcessError(1, 'pidof fake')) as mock:
-            pids = kill.get_pids('fake')
+        kill = Kill(finder=self.finder)
+        pids = kill.get_pids('fake')
         self.assertEqual(pids, None)
-        mock.assert_called_once_with(['pidof', 'fake'])
+
+    def test_get_pids_match(self):
+        kill = Kill(finder=self.finder)
+        pids = kill.get_pids(cmdline='--machine-id 1')
+        self.assertEqual(pids, [1234])
 
     def test_kill_jujud(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   return_value='1234 2345\n') as mock:
-            kill.kill_jujud()
-        self.assertEqual(mock.mock_calls, [
-            call(['pidof', 'jujud']),
-            call(['kill', '-s', 'SIGKILL', '1234'])
-        ])
+        kill = Kill(finder=self.finder)
+        with patch('utility.check_output', autospec=True) as co_mock:
+            with patch('os.kill', autospec=True) as mock:
+                kill.kill_jujud()
+        mock.assert_called_once_with(2345, signal.SIGKILL)
+        self.assertEqual(co_mock.called, False)
 
     def test_kill_jujud_single_process(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   return_value='2345\n') as mock:
+        kill = Kill(finder=self.finder,
+                    jujud_match={'name': 'jujud', 'cmdline': 'machine-id 1'})
+        with patch('os.kill', autospec=True) as mock:
             kill.kill_jujud()
+        mock.assert_called_once_with(1234, signal.SIGKILL)
+
+    def test_configure(self):
+        kill = Kill(finder=self.finder)
+        kill.configure({'jujud_match': 'name=jujud,cmdline=machine-id 1',
+                        'mongod_match': 'exe=/usr/bin/mongod'})
+        self.assertEqual(kill.jujud_match,
+                         {'name': 'jujud', 'cmdline': 'machine-id 1'})
+        with patch('os.kill', autospec=True) as mock:
+            kill.kill_jujud()
+            kill.kill_mongodb()
         self.assertEqual(mock.mock_calls, [
-            call(['pidof', 'jujud']),
-            call(['kill', '-s', 'SIGKILL', '2345'])
-        ])
+            call(1234, signal.SIGKILL), call(3456, signal.SIGKILL)])
+        kill.configure({})
+        self.assertEqual(kill.jujud_match, {'name': 'jujud'})
+        self.assertEqual(kill.mongod_match, {'name': 'mongod'})
+
+    def test_chaos_monkey_configure(self):
+        self.addCleanup(ChaosMonkey.reset_registry)
+        ChaosMonkey.configure(jujud_match='unit=jujud-machine-0.service')
+        kill = ChaosMonkey.find_command(Kill.jujud_cmd).enable.__self__
+        self.assertEqual(kill.jujud_match,
+                         {'unit': 'jujud-machine-0.service'})
+
+    def test_parse_match(self):
+        self.assertEqual(parse_match(None), {})
+        self.assertEqual(
+            parse_match('name=jujud,unit=jujud-machine-0.service'),
+            {'name': 'jujud', 'unit': 'jujud-machine-0.service'})
+        for spec in ('pid=1', 'name', 'name='):
+            with self.assertRaisesRegexp(BadRequest, 'Invalid process match'):
+                parse_match(spec)
+
+    def test_kill_jujud_not_found(self):
+        kill = Kill(finder=self.finder, jujud_match={'name': 'foo'})
+        with patch('os.kill', autospec=True) as mock:
+            kill.kill_jujud()
+            with self.assertRaisesRegexp(NotFound, 'Process id not found'):
+                kill.kill_jujud(quiet_mode=False)
+        self.assertEqual(mock.called, False)
+
+    def test_kill_jujud_exited(self):
+        kill = Kill(finder=self.finder)
+        error = OSError(errno.ESRCH, 'No such process')
+        with patch('os.kill', autospec=True, side_effect=error):
+            kill.kill_jujud()
+            with self.assertRaisesRegexp(NotFound, 'Process id not found'):
+                kill.kill_jujud(quiet_mode=False)
 
     def test_kill_mongodb(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   return_value='1234 2345\n') as mock:
+        kill = Kill(finder=self.finder)
+        with patch('os.kill', autospec=True) as mock:
             kill.kill_mongodb()
-        self.assertEqual(mock.mock_calls, [
-            call(['pidof', 'mongod']),
-            call(['kill', '-s', 'SIGKILL', '1234'])
-        ])
+        mock.assert_called_once_with(3456, signal.SIGKILL)
 
     def test_kill_mongodb_single_process(self):
-        kill = Kill()
-        with patch('utility.check_output', autospec=True,
-                   return_value='2345\n') as mock:
+        kill = Kill(finder=self.finder,
+                    mongod_match={'exe': '/usr/bin/mongod'})
+        with patch('os.kill', autospec=True) as mock:
             kill.kill_mongodb()
-        self.assertEqual(mock.mock_calls, [
-            call(['pidof', 'mongod']),
-            call(['kill', '-s', 'SIGKILL', '2345'])
-        ])
+        mock.assert_called_once_with(3456, signal.SIGKILL)
 
     def test_get_chaos(self):
         kill = Kill()
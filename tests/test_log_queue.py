@@ -0,0 +1,139 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import logging
+import os
+from Queue import Queue
+import threading
+from unittest import TestCase
+
+from utility import (
+    setup_logging,
+    stop_log_queues,
+    temp_dir,
+)
+from utils.log_queue import (
+    QueueHandler,
+    QueueListener,
+)
+
+__metaclass__ = type
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self, block=None):
+        logging.Handler.__init__(self)
+        self.block = block
+        self.messages = []
+        self.flushes = 0
+
+    def emit(self, record):
+        if self.block is not None:
+            self.block.wait()
+        self.messages.append(self.format(record))
+        self.flush()
+
+    def flush(self):
+        self.flushes += 1
+
+
+def make_record(msg, *args):
+    return logging.LogRecord(
+        'test', logging.INFO, __file__, 1, msg, args, None)
+
+
+class TestQueueHandler(TestCase):
+
+    def test_emit(self):
+        queue = Queue(10)
+        handler = QueueHandler(queue)
+        handler.handle(make_record('%s-%d', 'foo', 1))
+        record = queue.get_nowait()
+        self.assertEqual(record.msg, 'foo-1')
+        self.assertIsNone(record.args)
+
+    def test_emit_drops_when_full(self):
+        queue = Queue(2)
+        handler = QueueHandler(queue)
+        for i in range(5):
+            handler.handle(make_record('record %d', i))
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_emit_formats_exception(self):
+        queue = Queue(2)
+        handler = QueueHandler(queue)
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            logger = logging.getLogger('test_log_queue')
+            logger.propagate = 0
+            logger.addHandler(handler)
+            self.addCleanup(logger.removeHandler, handler)
+            logger.exception('failed')
+        record = queue.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: bad', record.exc_text)
+
+
+class TestQueueListener(TestCase):
+
+    def test_listener_writes_in_batches(self):
+        queue = Queue(100)
+        block = threading.Event()
+        handler = RecordingHandler(block)
+        listener = QueueListener(queue, [handler], batch_size=64)
+        listener.start()
+        q_handler = QueueHandler(queue)
+        for i in range(50):
+            q_handler.handle(make_record('record %d', i))
+        block.set()
+        listener.stop()
+        self.assertEqual(handler.messages,
+                         ['record {}'.format(i) for i in range(50)])
+        # The first record may be handled alone while the rest queue up.
+        self.assertLessEqual(handler.flushes, 2)
+        self.assertEqual(q_handler.dropped, 0)
+
+    def test_listener_respects_handler_level(self):
+        queue = Queue(10)
+        handler = RecordingHandler()
+        handler.setLevel(logging.WARNING)
+        listener = QueueListener(queue, [handler])
+        listener.start()
+        queue.put(make_record('info'))
+        listener.stop()
+        self.assertEqual(handler.messages, [])
+
+    def test_caller_does_not_wait_for_slow_handler(self):
+        queue = Queue(10)
+        block = threading.Event()
+        handler = RecordingHandler(block)
+        listener = QueueListener(queue, [handler])
+        listener.start()
+        q_handler = QueueHandler(queue)
+        for i in range(20):
+            q_handler.handle(make_record('record %d', i))
+        self.assertGreater(q_handler.dropped, 0)
+        block.set()
+        listener.stop()
+        self.assertEqual(len(handler.messages) + q_handler.dropped, 20)
+
+
+class TestSetupLoggingQueue(TestCase):
+
+    def test_setup_logging_queue(self):
+        logger = logging.getLogger('queued_log')
+        self.addCleanup(setattr, logger, 'handlers', [])
+        with temp_dir() as directory:
+            log_path = os.path.join(directory, 'log')
+            setup_logging(log_path, log_count=1, name='queued_log',
+                          add_stream=False, disable_formatter=True,
+                          queue_size=10)
+            self.assertEqual(
+                [type(h) for h in logger.handlers], [QueueHandler])
+            for i in range(3):
+                logger.info('record %d', i)
+            self.assertEqual(stop_log_queues(), 0)
+            with open(log_path) as f:
+                self.assertEqual(f.read(), 'record 0\nrecord 1\nrecord 2\n')
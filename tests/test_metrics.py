@@ -0,0 +1,135 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+import socket
+from unittest import TestCase
+import urllib2
+
+from metrics import (
+    ERROR,
+    Histogram,
+    Metrics,
+    OK,
+    serve_metrics,
+    stop_metrics,
+)
+from utility import temp_dir
+
+__metaclass__ = type
+
+
+class TestHistogram(TestCase):
+
+    def test_observe(self):
+        histogram = Histogram((0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.sum, 2.65)
+
+    def test_samples(self):
+        histogram = Histogram((0.1, 1))
+        histogram.observe(0.5)
+        histogram.observe(2)
+        self.assertEqual(list(histogram.samples('t', 'a="b"')), [
+            't_bucket{a="b",le="0.1"} 0',
+            't_bucket{a="b",le="1"} 1',
+            't_bucket{a="b",le="+Inf"} 2',
+            't_sum{a="b"} 2.5',
+            't_count{a="b"} 2',
+        ])
+
+
+class TestMetrics(TestCase):
+
+    def test_add_commands(self):
+        metrics = Metrics(['deny-all'])
+        command = metrics.commands['deny-all']
+        metrics.add_commands(['deny-all', 'deny-incoming'])
+        self.assertIs(metrics.commands['deny-all'], command)
+        self.assertItemsEqual(metrics.commands, ['deny-all', 'deny-incoming'])
+
+    def test_chaos_enabled_and_disabled(self):
+        metrics = Metrics(['deny-all'])
+        metrics.chaos_enabled('deny-all', 0.2, OK, 10)
+        metrics.chaos_disabled('deny-all', 0.3, OK, 15)
+        metrics.chaos_enabled('deny-all', 0.2, ERROR, 20)
+        metrics.chaos_disabled('deny-all', 0.3, ERROR, 25)
+        command = metrics.commands['deny-all']
+        self.assertEqual(command.enabled, [1, 1])
+        self.assertEqual(command.disabled, [1, 1])
+        self.assertEqual(command.enabled_seconds, 5)
+        self.assertEqual(sum(command.disable_latency.counts), 2)
+
+    def test_chaos_enabled_unknown_command(self):
+        metrics = Metrics()
+        metrics.chaos_enabled('deny-all', 0.2, OK, 10)
+        self.assertEqual(metrics.commands['deny-all'].enabled, [1, 0])
+
+    def test_render(self):
+        metrics = Metrics(['deny-all', 'deny-"x"'])
+        metrics.chaos_enabled('deny-all', 0.002, OK, 10)
+        metrics.chaos_disabled('deny-all', 0.02, OK, 12.5)
+        metrics.shell_command('ufw', 0.01, 'ok')
+        metrics.shell_command('ufw', 0.01, 'ignored')
+        metrics.active_faults = 2
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE chaos_enable_total counter', lines)
+        self.assertIn(
+            'chaos_enable_total{command="deny-all",outcome="ok"} 1', lines)
+        self.assertIn(
+            'chaos_enable_total{command="deny-\\"x\\"",outcome="error"} 0',
+            lines)
+        self.assertIn(
+            'chaos_enable_seconds_bucket{command="deny-all",le="0.005"} 1',
+            lines)
+        self.assertIn(
+            'chaos_disable_seconds_count{command="deny-all"} 1', lines)
+        self.assertIn(
+            'chaos_enabled_seconds_total{command="deny-all"} 2.5', lines)
+        self.assertIn('chaos_active_faults 2', lines)
+        self.assertIn(
+            'chaos_shell_commands_total{program="ufw",outcome="ignored"} 1',
+            lines)
+        self.assertIn('chaos_shell_seconds_count{program="ufw"} 2', lines)
+
+    def test_write(self):
+        metrics = Metrics(['deny-all'])
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'metrics.prom')
+            metrics.write(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), metrics.render())
+            self.assertEqual(os.listdir(directory), ['metrics.prom'])
+
+
+class TestServeMetrics(TestCase):
+
+    def test_serve_tcp(self):
+        metrics = Metrics(['deny-all'])
+        server = serve_metrics(metrics, '127.0.0.1:0')
+        self.addCleanup(stop_metrics, server)
+        response = urllib2.urlopen('http://127.0.0.1:{}/metrics'.format(
+            server.server_address[1]))
+        self.assertEqual(response.read(), metrics.render())
+        self.assertIn('text/plain', response.info()['Content-Type'])
+
+    def test_serve_unix_socket(self):
+        metrics = Metrics(['deny-all'])
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'metrics.sock')
+            server = serve_metrics(metrics, path)
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(path)
+            client.sendall('GET /metrics HTTP/1.0\r\n\r\n')
+            response = ''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+            stop_metrics(server)
+            self.assertFalse(os.path.exists(path))
+        self.assertTrue(response.startswith('HTTP/1.0 200'))
+        self.assertTrue(response.endswith(metrics.render()))
@@ -1,12 +1,36 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
+from subprocess import CalledProcessError
+from unittest import skipIf
+
 from mock import patch, call
 
 from chaos.net import (
+    compile_netem,
     FirewallAction,
+    FirewallChaos,
+    IptablesBackend,
     Net,
+    NetemAction,
+    NetlinkQdisc,
+    parse_netem,
+    parse_partition,
+    PartitionAction,
+    short_name,
+    TcQdisc,
+    UfwBackend,
 )
+from chaos_monkey import ChaosMonkey
 from tests.common_test_base import CommonTestBase
+from utility import (
+    BadRequest,
+    NotFound,
+)
+
+try:
+    from pyroute2.netlink.rtnl.tcmsg import sched_netem
+except ImportError:
+    sched_netem = None
 
 __metaclass__ = type
 
@@ -51,6 +75,168 @@ class TestFirewallAction(CommonTestBase):
             action.undo()
         mock.assert_called_once_with(["off"])
 
+    def test_iptables(self):
+        self.assertEqual(FirewallAction.enable().iptables, [])
+        self.assertEqual(FirewallAction.rule("deny in to any").iptables,
+                         [('INPUT', '-j DROP')])
+        self.assertEqual(FirewallAction.deny_port_rule(80).iptables, [
+            ('INPUT', '-p tcp --dport 80 -j DROP'),
+            ('INPUT', '-p udp --dport 80 -j DROP')])
+        self.assertIsNone(FirewallAction.rule("netem loss 1%").iptables)
+        self.assertIsNone(FirewallAction.rule("allow from 10.0.0.1").iptables)
+
+
+DENY_ALL_ENABLE = """*filter
+:cm-deny-all-i - [0:0]
+:cm-deny-all-o - [0:0]
+-A cm-deny-all-i -i lo -j ACCEPT
+-A cm-deny-all-o -o lo -j ACCEPT
+-A cm-deny-all-i -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT
+-A cm-deny-all-o -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT
+-A cm-deny-all-i -p tcp --dport 22 -j ACCEPT
+-A cm-deny-all-o -p tcp --sport 22 -j ACCEPT
+-A cm-deny-all-i -j DROP
+-A cm-deny-all-o -j DROP
+-I INPUT 1 -j cm-deny-all-i
+-I OUTPUT 1 -j cm-deny-all-o
+COMMIT
+"""
+
+DENY_ALL_DISABLE = """*filter
+-D INPUT -j cm-deny-all-i
+-D OUTPUT -j cm-deny-all-o
+:cm-deny-all-i - [0:0]
+:cm-deny-all-o - [0:0]
+-X cm-deny-all-i
+-X cm-deny-all-o
+COMMIT
+"""
+
+
+class TestIptablesBackend(CommonTestBase):
+
+    def setUp(self):
+        self.setup_test_logging()
+
+    def get_deny_all(self):
+        for chaos in Net(backend=IptablesBackend()).get_chaos():
+            if chaos.command_str == 'deny-all':
+                return chaos
+
+    def test_compile_enable(self):
+        chaos = self.get_deny_all()
+        self.assertEqual(
+            IptablesBackend.compile_enable('deny-all', chaos._actions),
+            DENY_ALL_ENABLE)
+
+    def test_compile_disable(self):
+        self.assertEqual(
+            IptablesBackend.compile_disable('deny-all'), DENY_ALL_DISABLE)
+
+    def test_compile_enable_matches_ufw(self):
+        # ufw accepts loopback traffic and the replies to established
+        # connections, then applies the rules of the chaos in order.
+        established = '-m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT'
+        compared = []
+        for chaos in Net(backend=IptablesBackend()).get_chaos():
+            if any(type(action) is not FirewallAction
+                   for action in chaos._actions):
+                continue
+            ufw_rules = [
+                action.do_command.split(' ', 1)[1] for action in
+                chaos._actions if action.do_command != 'ufw --force enable']
+            chains = IptablesBackend.chain_names(chaos.command_str)
+            expected = [
+                '-A {} -i lo -j ACCEPT'.format(chains['INPUT']),
+                '-A {} -o lo -j ACCEPT'.format(chains['OUTPUT']),
+                '-A {} {}'.format(chains['INPUT'], established),
+                '-A {} {}'.format(chains['OUTPUT'], established),
+            ]
+            for rule in ufw_rules:
+                if rule.startswith('deny ') and rule[5:].isdigit():
+                    # ufw denies both protocols for a bare port.
+                    iptables_rules = [
+                        ('INPUT', '-p {} --dport {} -j DROP'.format(
+                            protocol, rule[5:]))
+                        for protocol in ('tcp', 'udp')]
+                else:
+                    iptables_rules = FirewallAction.iptables_rules[rule]
+                expected.extend(
+                    '-A {} {}'.format(chains[chain], iptables_rule)
+                    for chain, iptables_rule in iptables_rules)
+            script = IptablesBackend.compile_enable(
+                chaos.command_str, chaos._actions)
+            self.assertEqual(
+                [line for line in script.splitlines()
+                 if line.startswith('-A ')], expected)
+            compared.append(chaos.command_str)
+        self.assertEqual(compared, [
+            'deny-all', 'deny-incoming', 'deny-outgoing', 'deny-state-server',
+            'deny-api-server', 'deny-sys-log'])
+
+    def test_chain_names_are_short(self):
+        chains = IptablesBackend.chain_names('x' * 40)
+        self.assertTrue(all(len(c) <= 28 for c in chains.values()))
+
+    def test_enable_disable(self):
+        chaos = self.get_deny_all()
+        with patch('utility._check_output', autospec=True) as mock:
+            chaos.enable()
+            chaos.disable()
+        self.assertEqual(mock.mock_calls, [
+            call(['iptables-restore', '--noflush'],
+                 input_data=DENY_ALL_ENABLE),
+            call(['ip6tables-restore', '--noflush'],
+                 input_data=DENY_ALL_ENABLE),
+            call(['iptables-restore', '--noflush'],
+                 input_data=DENY_ALL_DISABLE),
+            call(['ip6tables-restore', '--noflush'],
+                 input_data=DENY_ALL_DISABLE),
+        ])
+
+    def test_enable_rolls_back_on_error(self):
+        chaos = self.get_deny_all()
+        error = CalledProcessError(1, 'ip6tables-restore')
+        with patch('utility._check_output', autospec=True,
+                   side_effect=[None, error, None]) as mock:
+            with self.assertRaises(CalledProcessError):
+                chaos.enable()
+        self.assertEqual(mock.mock_calls[2], call(
+            ['iptables-restore', '--noflush'], input_data=DENY_ALL_DISABLE))
+
+    def test_runs_actions_without_iptables_rules(self):
+        delay = FirewallAction.rule('netem delay 1ms')
+        chaos = FirewallChaos('delay', 'Delay.', delay,
+                              backend=IptablesBackend())
+        with patch('utility._check_output', autospec=True) as mock:
+            chaos.enable()
+            chaos.disable()
+        tc_calls = [c for c in mock.mock_calls if c[1][0][0] == 'tc']
+        self.assertEqual(tc_calls, [
+            call('tc qdisc add dev eth0 root netem delay 1ms'.split(' '),
+                 input_data=None),
+            call('tc qdisc del dev eth0 root'.split(' '), input_data=None)])
+        self.assertEqual(len(mock.mock_calls), 6)
+
+    def test_net_configure(self):
+        net = Net()
+        self.assertIsInstance(net.backend, UfwBackend)
+        net.configure({'firewall_backend': 'iptables'})
+        self.assertIsInstance(net.backend, IptablesBackend)
+        self.assertTrue(
+            all(c.backend is net.backend for c in net.get_chaos()))
+        net.configure({})
+        self.assertIsInstance(net.backend, UfwBackend)
+
+    def test_chaos_monkey_configure(self):
+        self.addCleanup(ChaosMonkey.reset_registry)
+        ChaosMonkey.configure(firewall_backend='iptables')
+        chaos = ChaosMonkey.find_command('deny-all').resolve()
+        self.assertIsInstance(chaos.backend, IptablesBackend)
+        ChaosMonkey.reset_registry()
+        chaos = ChaosMonkey.find_command('deny-all').resolve()
+        self.assertIsInstance(chaos.backend, UfwBackend)
+
 
 allow_in_call = call(['ufw', 'allow', 'in', 'to', 'any'])
 deny_in_call = call(['ufw', 'deny', 'in', 'to', 'any'])
@@ -78,7 +264,7 @@ class TestNet(CommonTestBase):
             self.assertEqual('net', c.group)
 
     def get_net_chaos(self, cmd):
-        net = Net()
+        net = Net(interfaces=['eth0'])
         for chaos in net.get_chaos():
             if chaos.command_str == cmd:
                 return chaos
@@ -173,7 +359,397 @@ class TestNet(CommonTestBase):
         self.assert_tc('duplicate', 'duplicate 50% 30%')
 
 
+class FakeIPRoute:
+    """Record the netlink requests made through the pyroute2 API."""
+
+    def __init__(self, links, fail_on=None):
+        self.links = links
+        self.fail_on = fail_on
+        self.requests = []
+
+    def link_lookup(self, ifname):
+        self.requests.append(('link_lookup', ifname))
+        return [self.links[ifname]] if ifname in self.links else []
+
+    def tc(self, command, kind, index, handle, **kwargs):
+        if (command, index) == self.fail_on:
+            raise RuntimeError('netlink error')
+        self.requests.append((command, kind, index, handle, kwargs))
+
+
+class TestNetem(CommonTestBase):
+
+    def setUp(self):
+        self.setup_test_logging()
+
+    def test_parse_netem(self):
+        self.assertEqual(
+            parse_netem('netem delay 300ms 20ms distribution normal'),
+            {'delay': 300000, 'jitter': 20000})
+        self.assertEqual(
+            parse_netem('netem delay 5s 1s 25%'),
+            {'delay': 5000000, 'jitter': 1000000, 'delay_corr': 25.0})
+        self.assertEqual(parse_netem('netem loss 50% 30%'),
+                         {'loss': 50.0, 'loss_corr': 30.0})
+        self.assertEqual(parse_netem('netem corrupt 50% 30%'),
+                         {'prob_corrupt': 50.0, 'corr_corrupt': 30.0})
+        self.assertEqual(parse_netem('netem reorder 25% 50%'),
+                         {'prob_reorder': 25.0, 'corr_reorder': 50.0})
+        self.assertEqual(parse_netem('duplicate 50% limit 100'),
+                         {'duplicate': 2147483647, 'limit': 100})
+
+    @skipIf(sched_netem is None, 'pyroute2 is not installed')
+    def test_parse_netem_pyroute2(self):
+        def encode(netem):
+            return sched_netem.get_parameters(parse_netem(netem))
+
+        half, third = 2147483647, 1288490188
+        corr = {'delay_corr': 0, 'loss_corr': 0, 'dup_corr': 0}
+        opts = encode('netem delay 5s 1s 25%')
+        self.assertEqual(opts['attrs'], [['TCA_NETEM_CORR', dict(
+            corr, delay_corr=1073741823)]])
+        opts = encode('netem loss 50% 30%')
+        self.assertEqual(opts['loss'], half)
+        self.assertEqual(opts['attrs'], [['TCA_NETEM_CORR', dict(
+            corr, loss_corr=third)]])
+        opts = encode('netem duplicate 50% 30%')
+        self.assertEqual(opts['duplicate'], half)
+        self.assertEqual(opts['attrs'], [['TCA_NETEM_CORR', dict(
+            corr, dup_corr=third)]])
+        self.assertEqual(encode('netem corrupt 50% 30%')['attrs'], [[
+            'TCA_NETEM_CORRUPT',
+            {'prob_corrupt': half, 'corr_corrupt': third}]])
+        self.assertEqual(encode('netem reorder 50% 30%')['attrs'], [[
+            'TCA_NETEM_REORDER',
+            {'prob_reorder': half, 'corr_reorder': third}]])
+
+    def test_parse_netem_errors(self):
+        with self.assertRaisesRegexp(BadRequest, 'Unsupported netem option'):
+            parse_netem('netem rate 1mbit')
+        with self.assertRaisesRegexp(BadRequest, 'Missing netem value'):
+            parse_netem('netem delay')
+        with self.assertRaisesRegexp(BadRequest, 'Invalid netem time'):
+            parse_netem('netem delay 3h')
+
+    def test_compile_netem_defaults(self):
+        self.assertEqual(compile_netem('delay', {}),
+                         'netem delay 300ms 20ms distribution normal')
+        self.assertEqual(compile_netem('delay-long', {}),
+                         'netem delay 5s 1s distribution normal')
+        self.assertEqual(compile_netem('drop', {}), 'netem loss 50% 30%')
+        self.assertEqual(compile_netem('corrupt', {}),
+                         'netem corrupt 50% 30%')
+        self.assertEqual(compile_netem('duplicate', {}),
+                         'netem duplicate 50% 30%')
+
+    def test_compile_netem(self):
+        self.assertEqual(
+            compile_netem('delay', {'latency': '100ms', 'jitter': '10ms',
+                                    'correlation': '25%',
+                                    'rate': '1mbit'}),
+            'netem delay 100ms 10ms 25% distribution normal rate 1mbit')
+        self.assertEqual(
+            compile_netem('delay', {'latency': '1.5s', 'jitter': '0us'}),
+            'netem delay 1.5s')
+        self.assertEqual(compile_netem('drop', {'percent': '5%'}),
+                         'netem loss 5% 30%')
+        self.assertEqual(
+            parse_netem(compile_netem('delay', {'correlation': '25%'})),
+            {'delay': 300000, 'jitter': 20000, 'delay_corr': 25.0})
+
+    def test_compile_netem_is_cached(self):
+        params = {'latency': '123ms'}
+        rule = compile_netem('delay', params)
+        self.assertIs(compile_netem('delay', dict(params)), rule)
+
+    def test_compile_netem_errors(self):
+        with self.assertRaisesRegexp(BadRequest,
+                                     'Invalid delay parameter: percent'):
+            compile_netem('delay', {'percent': '1%'})
+        for param, value in (('latency', '1h'), ('latency', '1ms;ls'),
+                             ('correlation', '101%'), ('rate', '1mb')):
+            with self.assertRaisesRegexp(BadRequest, 'Invalid delay value'):
+                compile_netem('delay', {param: value})
+
+    def test_net_parameterize(self):
+        net = Net(interfaces=['ens3'])
+        chaos = net.parameterize('drop', {'percent': '5%', 'rate': '10kbit'})
+        self.assertEqual(chaos.command_str, 'drop(percent=5%,rate=10kbit)')
+        self.assertEqual(chaos.description, 'Drop network packets.')
+        self.assertIs(chaos.backend, net.backend)
+        with patch('utility.check_output', autospec=True) as mock:
+            chaos.enable()
+        mock.assert_called_once_with(
+            'tc qdisc add dev ens3 root netem loss 5% 30% rate 10kbit'.split(
+                ' '))
+        self.assertIsNone(net.parameterize('deny-all', {'port': '1'}))
+
+    def test_netem_action_tc(self):
+        action = NetemAction('netem loss 1%', ['ens3', 'br0'])
+        with patch('utility.check_output', autospec=True) as mock:
+            action.do()
+            action.undo()
+        self.assertEqual(mock.mock_calls, [
+            call('tc qdisc add dev ens3 root netem loss 1%'.split(' ')),
+            call('tc qdisc add dev br0 root netem loss 1%'.split(' ')),
+            call('tc qdisc del dev ens3 root'.split(' ')),
+            call('tc qdisc del dev br0 root'.split(' ')),
+        ])
+
+    def test_tc_qdisc_rolls_back_on_error(self):
+        error = CalledProcessError(2, 'tc')
+        with patch('utility.check_output', autospec=True,
+                   side_effect=[None, error, None]) as mock:
+            with self.assertRaises(CalledProcessError):
+                TcQdisc().add(['ens3', 'br0'], 'netem loss 1%')
+        self.assertEqual(
+            mock.mock_calls[2], call('tc qdisc del dev ens3 root'.split(' ')))
+
+    def test_netlink_qdisc(self):
+        ipr = FakeIPRoute({'ens3': 2, 'br0': 5})
+        action = NetemAction('netem delay 300ms 20ms', ['ens3', 'br0'],
+                             NetlinkQdisc(ipr))
+        with patch('utility.check_output', autospec=True) as mock:
+            action.do()
+            action.undo()
+        self.assertEqual(mock.called, False)
+        params = {'delay': 300000, 'jitter': 20000}
+        self.assertEqual(ipr.requests, [
+            ('link_lookup', 'ens3'),
+            ('link_lookup', 'br0'),
+            ('add', 'netem', 2, 0x10000, params),
+            ('add', 'netem', 5, 0x10000, params),
+            ('del', 'netem', 2, 0x10000, {}),
+            ('del', 'netem', 5, 0x10000, {}),
+        ])
+
+    def test_netlink_qdisc_rolls_back_on_error(self):
+        ipr = FakeIPRoute({'ens3': 2, 'br0': 5}, fail_on=('add', 5))
+        with self.assertRaises(RuntimeError):
+            NetlinkQdisc(ipr).add(['ens3', 'br0'], 'netem loss 1%')
+        self.assertEqual(ipr.requests[-1], ('del', 'netem', 2, 0x10000, {}))
+
+    def test_netlink_qdisc_unknown_interface(self):
+        ipr = FakeIPRoute({'ens3': 2})
+        with self.assertRaisesRegexp(
+                NotFound, 'Network interface not found: eth9'):
+            NetlinkQdisc(ipr).add(['ens3', 'eth9'], 'netem loss 1%')
+        self.assertEqual(len(ipr.requests), 2)
+
+    def test_netlink_qdisc_rejects_rate(self):
+        net = Net(qdisc=NetlinkQdisc(FakeIPRoute({'ens3': 2})),
+                  interfaces=['ens3'])
+        with self.assertRaisesRegexp(
+                BadRequest, 'does not support rate: '
+                            r'delay\(latency=100ms,rate=1mbit\)'):
+            net.parameterize('delay', {'latency': '100ms', 'rate': '1mbit'})
+        chaos = net.parameterize('delay', {'latency': '100ms'})
+        self.assertEqual(chaos.command_str, 'delay(latency=100ms)')
+
+    def test_netlink_qdisc_needs_pyroute2(self):
+        with patch('chaos.net.IPRoute', None):
+            with self.assertRaisesRegexp(BadRequest, 'needs pyroute2'):
+                NetlinkQdisc()
+
+    def test_net_interfaces(self):
+        net = Net(interfaces=['ens3', 'bond0'])
+        for chaos in net.get_chaos():
+            for action in chaos._actions:
+                if isinstance(action, NetemAction):
+                    self.assertEqual(action.devices, ['ens3', 'bond0'])
+
+    def test_net_configure(self):
+        net = Net()
+        with patch('chaos.net.resolve_interfaces', autospec=True,
+                   return_value=['ens3']) as mock:
+            net.configure({'interfaces': 'all', 'netem_backend': 'tc'})
+        mock.assert_called_once_with('all')
+        self.assertEqual(net.interfaces, ['ens3'])
+        self.assertIsInstance(net.qdisc, TcQdisc)
+
+
+PARTITION_SETS = """create cm-partition-4 hash:net family inet -exist
+flush cm-partition-4
+add cm-partition-4 10.0.0.2
+add cm-partition-4 10.1.0.0/16
+create cm-partition-6 hash:net family inet6 -exist
+flush cm-partition-6
+add cm-partition-6 fd00::/64
+create cm-partition-peers list:set -exist
+flush cm-partition-peers
+add cm-partition-peers cm-partition-4
+add cm-partition-peers cm-partition-6
+create cm-partition-ports bitmap:port range 1-65535 -exist
+flush cm-partition-ports
+add cm-partition-ports 37017-37019
+add cm-partition-ports 17070
+"""
+
+PARTITION_ENABLE = """*filter
+:cm-partition-i - [0:0]
+:cm-partition-o - [0:0]
+-A cm-partition-i -i lo -j ACCEPT
+-A cm-partition-o -o lo -j ACCEPT
+-A cm-partition-i -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT
+-A cm-partition-o -m conntrack --ctstate ESTABLISHED,RELATED -j ACCEPT
+-A cm-partition-i -p tcp --dport 22 -j ACCEPT
+-A cm-partition-o -p tcp --sport 22 -j ACCEPT
+-A cm-partition-i -m set --match-set cm-partition-peers src \
+-m set --match-set cm-partition-ports dst -j DROP
+-A cm-partition-i -m set --match-set cm-partition-peers src \
+-m set --match-set cm-partition-ports src -j DROP
+-A cm-partition-o -m set --match-set cm-partition-peers dst \
+-m set --match-set cm-partition-ports dst -j DROP
+-A cm-partition-o -m set --match-set cm-partition-peers dst \
+-m set --match-set cm-partition-ports src -j DROP
+-I INPUT 1 -j cm-partition-i
+-I OUTPUT 1 -j cm-partition-o
+COMMIT
+"""
+
+PARTITION_DESTROY = """destroy cm-partition-ports
+destroy cm-partition-peers
+destroy cm-partition-6
+destroy cm-partition-4
+"""
+
+
+class TestPartition(CommonTestBase):
+
+    def setUp(self):
+        self.setup_test_logging()
+
+    def make_action(self):
+        return PartitionAction('partition', *parse_partition({
+            'peers': '10.0.0.2+fd00::/64+10.1.0.0/16',
+            'ports': '37017-37019+17070'}))
+
+    def test_parse_partition(self):
+        self.assertEqual(parse_partition({}), (None, None))
+        self.assertEqual(
+            parse_partition({'peers': '10.0.0.2+fd00::/64',
+                             'ports': '17070+37017-37019'}),
+            (['10.0.0.2', 'fd00::/64'], ['17070', '37017-37019']))
+        self.assertEqual(parse_partition({'ports': '22'}), (None, ['22']))
+
+    def test_parse_partition_errors(self):
+        with self.assertRaisesRegexp(BadRequest,
+                                     'Invalid partition parameter: port'):
+            parse_partition({'port': '22'})
+        for param, value in (('peers', '10.0.0.256'), ('peers', '10.0.0.0/0'),
+                             ('peers', 'fd00::/129'), ('peers', 'host'),
+                             ('peers', '10.0.0.1+'), ('ports', '0'),
+                             ('ports', '65536'), ('ports', '30-20'),
+                             ('ports', '1-2-3')):
+            with self.assertRaisesRegexp(BadRequest,
+                                         'Invalid partition value'):
+                parse_partition({param: value})
+
+    def test_short_name(self):
+        self.assertEqual(short_name('deny-all'), 'deny-all')
+        first = short_name('partition(peers=10.0.0.2)')
+        second = short_name('partition(peers=10.0.0.3)')
+        self.assertTrue(first.startswith('partition-'))
+        self.assertNotEqual(first, second)
+        self.assertTrue(all(len(n) <= 20 for n in (first, second)))
+
+    def test_compile_sets(self):
+        action = self.make_action()
+        self.assertEqual(IptablesBackend.compile_create_sets([action]),
+                         PARTITION_SETS)
+        self.assertEqual(IptablesBackend.compile_destroy_sets([action]),
+                         PARTITION_DESTROY)
+        self.assertEqual(IptablesBackend.compile_create_sets(
+            [FirewallAction.rule('deny in to any')]), '')
+
+    def test_compile_enable(self):
+        self.assertEqual(
+            IptablesBackend.compile_enable('partition', [self.make_action()]),
+            PARTITION_ENABLE)
+
+    def test_rule_count_does_not_grow_with_peers(self):
+        peers = '+'.join('10.0.{}.{}'.format(i // 250, i % 250 + 1)
+                         for i in range(500))
+        few = PartitionAction('partition', ['10.0.0.1'], ['37017'])
+        many = PartitionAction('partition', *parse_partition(
+            {'peers': peers, 'ports': '37017'}))
+        self.assertEqual(len(many.iptables), len(few.iptables))
+        self.assertEqual(len(many.ipsets[0][2]), 500)
+
+    def test_rules_without_sets(self):
+        action = PartitionAction('partition')
+        self.assertEqual(action.ipsets, [])
+        self.assertEqual(action.iptables[2:], [('INPUT', '-j DROP'),
+                                               ('OUTPUT', '-j DROP')])
+        action = PartitionAction('partition', ports=['22'])
+        self.assertEqual([s[0] for s in action.ipsets],
+                         ['cm-partition-ports'])
+        self.assertEqual(len(action.iptables), 6)
+
+    def test_enable_disable(self):
+        chaos = FirewallChaos('partition', 'Partition.', self.make_action(),
+                              backend=IptablesBackend())
+        with patch('utility._check_output', autospec=True) as mock:
+            chaos.enable()
+            chaos.disable()
+        self.assertEqual(mock.mock_calls, [
+            call(['ipset', 'restore'], input_data=PARTITION_SETS),
+            call(['iptables-restore', '--noflush'],
+                 input_data=PARTITION_ENABLE),
+            call(['ip6tables-restore', '--noflush'],
+                 input_data=PARTITION_ENABLE),
+            call(['iptables-restore', '--noflush'],
+                 input_data=IptablesBackend.compile_disable('partition')),
+            call(['ip6tables-restore', '--noflush'],
+                 input_data=IptablesBackend.compile_disable('partition')),
+            call(['ipset', 'restore'], input_data=PARTITION_DESTROY),
+        ])
+
+    def test_enable_destroys_sets_on_error(self):
+        chaos = FirewallChaos('partition', 'Partition.', self.make_action(),
+                              backend=IptablesBackend())
+        error = CalledProcessError(1, 'iptables-restore')
+        with patch('utility._check_output', autospec=True,
+                   side_effect=[None, error, None]) as mock:
+            with self.assertRaises(CalledProcessError):
+                chaos.enable()
+        self.assertEqual(mock.mock_calls[-1], call(
+            ['ipset', 'restore'], input_data=PARTITION_DESTROY))
+
+    def test_ufw_backend_uses_iptables(self):
+        chaos = FirewallChaos('partition', 'Partition.', self.make_action())
+        self.assertIsInstance(chaos.backend, UfwBackend)
+        with patch('utility._check_output', autospec=True) as mock:
+            chaos.enable()
+        self.assertEqual(mock.mock_calls[:2], [
+            call(['ipset', 'restore'], input_data=PARTITION_SETS),
+            call(['iptables-restore', '--noflush'],
+                 input_data=PARTITION_ENABLE)])
+
+    def test_net_parameterize(self):
+        net = Net(backend=IptablesBackend())
+        chaos = net.parameterize(
+            'partition', {'ports': '37017', 'peers': '10.0.0.2+10.0.0.3'})
+        self.assertEqual(chaos.command_str,
+                         'partition(peers=10.0.0.2+10.0.0.3,ports=37017)')
+        self.assertIs(chaos.backend, net.backend)
+        self.assertEqual(chaos.resources, frozenset(['firewall']))
+        action, = chaos._actions
+        prefix = 'cm-{}-'.format(short_name(chaos.command_str))
+        self.assertEqual([s[0] for s in action.ipsets], [
+            prefix + '4', prefix + '6', prefix + 'peers', prefix + 'ports'])
+        self.assertTrue(all(len(s[0]) <= 31 for s in action.ipsets))
+
+    def test_find_command(self):
+        self.addCleanup(ChaosMonkey.reset_registry)
+        chaos = ChaosMonkey.find_command('partition(peers=10.0.0.2)')
+        self.assertEqual(chaos.resolve().command_str,
+                         'partition(peers=10.0.0.2)')
+        with self.assertRaisesRegexp(BadRequest, 'Invalid partition value'):
+            ChaosMonkey.find_command('partition(peers=10.0.0.0/0)')
+
+
 def get_all_net_commands():
     return ['deny-all', 'deny-incoming', 'deny-outgoing',  'deny-state-server',
             'deny-api-server', 'deny-sys-log', 'delay', 'delay-long',
-            'drop', 'corrupt', 'duplicate']
+            'drop', 'corrupt', 'duplicate', 'partition']
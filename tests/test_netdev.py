@@ -0,0 +1,75 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+
+from tests.common_test_base import CommonTestBase
+from utility import (
+    BadRequest,
+    temp_dir,
+)
+from utils.netdev import (
+    all_interfaces,
+    default_route_interfaces,
+    resolve_interfaces,
+)
+
+__metaclass__ = type
+
+
+ROUTE = """\
+Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask
+ens3\t00000000\t010200C0\t0003\t0\t0\t0\t00000000
+ens3\t000200C0\t00000000\t0001\t0\t0\t0\t00FFFFFF
+bond0\t00000000\t010300C0\t0003\t0\t0\t100\t00000000
+"""
+
+DEV = """\
+Inter-|   Receive                            |  Transmit
+ face |bytes    packets errs drop fifo frame |bytes    packets
+    lo: 20722744    4181    0    0    0     0 20722744    4181
+  ens3:       0       0    0    0    0     0        0       0
+ lxdbr0:       0       0    0    0    0     0        0       0
+"""
+
+
+class TestNetdev(CommonTestBase):
+
+    def make_proc(self, directory, route=ROUTE, dev=DEV):
+        os.mkdir(os.path.join(directory, 'net'))
+        with open(os.path.join(directory, 'net', 'route'), 'w') as f:
+            f.write(route)
+        with open(os.path.join(directory, 'net', 'dev'), 'w') as f:
+            f.write(dev)
+
+    def test_default_route_interfaces(self):
+        with temp_dir() as directory:
+            self.make_proc(directory)
+            self.assertEqual(
+                default_route_interfaces(directory), ['ens3', 'bond0'])
+
+    def test_all_interfaces(self):
+        with temp_dir() as directory:
+            self.make_proc(directory)
+            self.assertEqual(all_interfaces(directory), ['ens3', 'lxdbr0'])
+
+    def test_resolve_interfaces(self):
+        with temp_dir() as directory:
+            self.make_proc(directory)
+            self.assertEqual(resolve_interfaces('default', directory),
+                             ['ens3', 'bond0'])
+            self.assertEqual(resolve_interfaces('all', directory),
+                             ['ens3', 'lxdbr0'])
+        self.assertEqual(resolve_interfaces('br0,ens4'), ['br0', 'ens4'])
+        self.assertEqual(resolve_interfaces(['br0']), ['br0'])
+
+    def test_resolve_interfaces_fallback(self):
+        with temp_dir() as directory:
+            self.make_proc(directory, route=ROUTE.splitlines()[0] + '\n')
+            self.assertEqual(resolve_interfaces('default', directory),
+                             ['eth0'])
+        with temp_dir() as directory:
+            self.assertEqual(resolve_interfaces('all', directory), ['eth0'])
+
+    def test_resolve_interfaces_empty(self):
+        with self.assertRaisesRegexp(BadRequest, 'No network interface'):
+            resolve_interfaces('')
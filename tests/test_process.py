@@ -0,0 +1,145 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+import shutil
+from tempfile import mkdtemp
+from time import time
+
+from tests.common_test_base import CommonTestBase
+from utils.process import (
+    Process,
+    ProcessFinder,
+)
+
+__metaclass__ = type
+
+
+class TestProcessFinder(CommonTestBase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_find_by_name(self):
+        make_proc(self.root, 10, 'jujud', ['/var/lib/juju/tools/jujud'])
+        make_proc(self.root, 11, 'mongod', ['/usr/bin/mongod'])
+        make_proc(self.root, 12, 'jujud', ['jujud', 'machine'], start=200)
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(name='jujud'), [12, 10])
+        self.assertEqual(finder.find(name='mongod'), [11])
+        self.assertEqual(finder.find(name='foo'), [])
+
+    def test_find_by_name_truncated_comm(self):
+        make_proc(self.root, 10, 'a-very-long-pro',
+                  ['/bin/a-very-long-process-name'])
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(name='a-very-long-process-name'), [10])
+        self.assertEqual(finder.find(name='a-very-long-pro'), [10])
+
+    def test_find_by_exe(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'], exe='/a/jujud')
+        make_proc(self.root, 11, 'jujud', ['jujud'], exe='/b/jujud')
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(exe='/b/jujud'), [11])
+
+    def test_find_by_cmdline(self):
+        make_proc(self.root, 10, 'jujud', ['jujud', 'machine', '--id', '0'])
+        make_proc(self.root, 11, 'jujud', ['jujud', 'unit', '--id', 'a/0'])
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(cmdline=r'unit --id a/\d'), [11])
+        self.assertEqual(
+            finder.find(name='jujud', cmdline='machine --id 0'), [10])
+
+    def test_find_by_cgroup_and_unit(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'], cgroup=(
+            '1:name=systemd:/system.slice/jujud-machine-0.service\n'))
+        make_proc(self.root, 11, 'jujud', ['jujud'], cgroup=(
+            '0::/lxc/juju-1/system.slice/jujud-machine-1.service\n'))
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(unit='jujud-machine-1.service'), [11])
+        self.assertEqual(finder.find(cgroup='/lxc/juju-1/'), [11])
+        self.assertEqual(finder.find(unit='jujud-machine.service'), [])
+
+    def test_comm_with_spaces(self):
+        make_proc(self.root, 10, 'a) b', ['a) b'], start=77)
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.get_process(10).start_time, 77)
+
+    def test_cache(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'])
+        finder = ProcessFinder(self.root)
+        process = finder.get_process(10)
+        self.assertIs(finder.get_process(10), process)
+
+    def test_cache_invalidated_by_start_time(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'], start=100)
+        finder = ProcessFinder(self.root)
+        self.assertEqual(finder.find(name='jujud'), [10])
+        # The PID is reused by another process.
+        shutil.rmtree(os.path.join(self.root, '10'))
+        make_proc(self.root, 10, 'mongod', ['mongod'], start=300)
+        self.assertEqual(finder.find(name='jujud'), [])
+        self.assertEqual(finder.find(name='mongod'), [10])
+
+    def test_exited_process(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'])
+        finder = ProcessFinder(self.root)
+        finder.find()
+        shutil.rmtree(os.path.join(self.root, '10'))
+        self.assertIsNone(finder.get_process(10))
+        self.assertEqual(finder.find(), [])
+        self.assertEqual(finder._cache, {})
+
+    def test_ignores_non_pid_entries(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'])
+        os.mkdir(os.path.join(self.root, 'net'))
+        open(os.path.join(self.root, 'uptime'), 'w').close()
+        self.assertEqual(ProcessFinder(self.root).find(), [10])
+
+    def test_started_at(self):
+        make_proc(self.root, 10, 'jujud', ['jujud'], start=250)
+        with open(os.path.join(self.root, 'stat'), 'w') as f:
+            f.write('cpu  1 2 3\nbtime 1000\nprocesses 5\n')
+        finder = ProcessFinder(self.root)
+        ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        self.assertEqual(finder.started_at(10), 1000 + 250.0 / ticks)
+        self.assertIsNone(finder.started_at(11))
+
+    def test_real_proc(self):
+        finder = ProcessFinder()
+        self.assertIn(os.getpid(), finder.find())
+        self.assertLessEqual(finder.started_at(os.getpid()), time())
+
+
+class TestProcess(CommonTestBase):
+
+    def test_name(self):
+        process = Process(1, 0, 'comm', ['/usr/bin/jujud', 'machine'], None,
+                          '')
+        self.assertEqual(process.name, 'jujud')
+        process = Process(1, 0, 'kthreadd', [], None, '')
+        self.assertEqual(process.name, 'kthreadd')
+
+    def test_units(self):
+        process = Process(1, 0, 'jujud', [], None, (
+            '12:pids:/system.slice/jujud-machine-0.service\n'
+            '1:name=systemd:/user.slice/session-1.scope\n'))
+        self.assertEqual(
+            process.units, ['jujud-machine-0.service', 'session-1.scope'])
+
+
+def make_proc(root, pid, comm, cmdline, start=100, exe=None, cgroup=''):
+    """Create the /proc/<pid> files read by ProcessFinder under root."""
+    pid_dir = os.path.join(root, str(pid))
+    os.mkdir(pid_dir)
+    fields = ['S'] + ['0'] * 18 + [str(start)] + ['0'] * 30
+    with open(os.path.join(pid_dir, 'stat'), 'w') as f:
+        f.write('{} ({}) {}\n'.format(pid, comm, ' '.join(fields)))
+    with open(os.path.join(pid_dir, 'comm'), 'w') as f:
+        f.write(comm + '\n')
+    with open(os.path.join(pid_dir, 'cmdline'), 'w') as f:
+        f.write('\0'.join(cmdline) + '\0')
+    with open(os.path.join(pid_dir, 'cgroup'), 'w') as f:
+        f.write(cgroup)
+    if exe:
+        os.symlink(exe, os.path.join(pid_dir, 'exe'))
@@ -0,0 +1,102 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from StringIO import StringIO
+from unittest import TestCase
+
+from event_log import (
+    DISABLE,
+    ENABLE,
+    EventMessage,
+)
+from replay import (
+    DriftHistogram,
+    read_replay,
+)
+from utility import BadRequest
+
+__metaclass__ = type
+
+
+class TestReadReplay(TestCase):
+
+    def test_read_replay_yaml_flow(self):
+        data = '- [deny-all, 2]\n- [deny-incoming, 3.5]\n'
+        commands = list(read_replay(StringIO(data)))
+        self.assertEqual(commands, [('deny-all', 2, None, 16),
+                                    ('deny-incoming', 3.5, None, len(data))])
+
+    def test_read_replay_yaml_block(self):
+        data = '- - deny-all\n  - 2\n- - deny-incoming\n  - 3\n'
+        commands = list(read_replay(StringIO(data)))
+        self.assertEqual(commands, [('deny-all', 2, None, 19),
+                                    ('deny-incoming', 3, None, len(data))])
+
+    def test_read_replay_event_log(self):
+        data = ''.join(str(m) + '\n' for m in [
+            EventMessage(ENABLE, 'deny-all', 2),
+            EventMessage(DISABLE, 'deny-all', latency=0.2),
+            EventMessage(ENABLE, 'kill-mongod', 1)])
+        commands = list(read_replay(StringIO(data)))
+        self.assertEqual([c[:2] for c in commands],
+                         [('deny-all', 2), ('kill-mongod', 1)])
+        self.assertEqual(commands[-1][3], len(data))
+
+    def test_read_replay_json_array(self):
+        data = '["deny-all", 2]\n\n# comment\n["kill-mongod", 1]'
+        commands = list(read_replay(StringIO(data)))
+        self.assertEqual([c[:2] for c in commands],
+                         [('deny-all', 2), ('kill-mongod', 1)])
+
+    def test_read_replay_start(self):
+        data = ('- [deny-all, 2, 0.5]\n["kill-mongod", 1, 4]\n' +
+                str(EventMessage(ENABLE, 'deny-incoming', 3, offset=9)))
+        commands = list(read_replay(StringIO(data)))
+        self.assertEqual([c[:3] for c in commands],
+                         [('deny-all', 2, 0.5), ('kill-mongod', 1, 4),
+                          ('deny-incoming', 3, 9)])
+
+    def test_read_replay_from_offset(self):
+        data = '- [deny-all, 2]\n- [deny-incoming, 3]\n- [kill-mongod, 1]\n'
+        f = StringIO(data)
+        commands = read_replay(f)
+        first = next(commands)
+        commands = list(read_replay(f, first[3]))
+        self.assertEqual([c[0] for c in commands],
+                         ['deny-incoming', 'kill-mongod'])
+        self.assertEqual(list(read_replay(f, len(data))), [])
+
+    def test_read_replay_is_lazy(self):
+        data = '- [deny-all, 2]\nnot a command\n'
+        commands = read_replay(StringIO(data))
+        self.assertEqual(next(commands)[0], 'deny-all')
+        with self.assertRaisesRegexp(BadRequest, 'Invalid replay line'):
+            next(commands)
+
+    def test_read_replay_invalid(self):
+        for data in ('- deny-all\n', '- [deny-all]\n', '["deny-all", "2"]\n',
+                     '{"event": "enable"\n', '- [deny-all, 2\n',
+                     '- [deny-all, 2, "0"]\n', '["deny-all", 2, 0, 1]\n'):
+            with self.assertRaises(BadRequest):
+                list(read_replay(StringIO(data)))
+
+
+class TestDriftHistogram(TestCase):
+
+    def test_add(self):
+        histogram = DriftHistogram()
+        for drift in (0, 0.001, 0.05, 0.5, 30):
+            histogram.add(drift)
+        self.assertEqual(histogram.counts, [2, 0, 1, 1, 0, 1])
+        self.assertEqual(histogram.max, 30)
+        self.assertEqual(
+            str(histogram),
+            '<=0.001s: 2, <=0.01s: 0, <=0.1s: 1, <=1s: 1, <=10s: 0, '
+            '>10s: 1, max 30.000s, 0 skipped')
+
+    def test_skip(self):
+        histogram = DriftHistogram()
+        histogram.add(0.5)
+        histogram.skip(12)
+        self.assertEqual(histogram.counts, [0, 0, 0, 1, 0, 1])
+        self.assertEqual((histogram.max, histogram.skipped), (12, 1))
+        self.assertTrue(str(histogram).endswith('max 12.000s, 1 skipped'))
@@ -1,6 +1,7 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
 from argparse import Namespace
+import os
 
 from mock import patch
 from unittest import TestCase
@@ -9,6 +10,8 @@ from scripts.restart_chaos_monkey import (
     parse_args,
     restart_chaos_monkey,
 )
+from utility import temp_dir
+from utils.run_state import write_run_state
 
 __metaclass__ = type
 
@@ -16,22 +19,51 @@ __metaclass__ = type
 class TestRestartChaosMonkey(TestCase):
 
     def test_parse_args(self):
-        args = parse_args([
-            '--runner-path', '/path/runner.py',
-            '--expire-time', '123.00',
-            '--cmd-arg', '--include-command deny-all workspace'])
-        self.assertEqual(args, Namespace(
-            runner_path='/path/runner.py',
-            expire_time=123.00,
-            cmd_arg='--include-command deny-all workspace'))
+        args = parse_args(['--state-file', '/var/lib/state.json'])
+        self.assertEqual(args, Namespace(state_file='/var/lib/state.json',
+                                         exec_runner=False))
 
     def test_execute_chaos_monkey(self):
-        args = parse_args([
-            '--runner-path', '/path/runner.py',
-            '--expire-time', '123.0',
-            '--cmd-arg', '--include-command deny-all workspace'])
-        with patch('subprocess.Popen', autospec=True) as mock:
-            restart_chaos_monkey(args)
+        with temp_dir() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            write_run_state(state_file, {
+                'runner_path': '/path/runner.py',
+                'argv': ['--include-command', 'deny-all', 'workspace'],
+                'expire_time': 123.0})
+            args = parse_args(['--state-file', state_file])
+            with patch('subprocess.Popen', autospec=True) as mock:
+                restart_chaos_monkey(args)
         mock.assert_called_once_with(
             ['python', '/path/runner.py', '--include-command', 'deny-all',
-             'workspace', '--expire-time', '123.0', '--restart'])
+             'workspace', '--restart'])
+
+    def test_execute_chaos_monkey_restarted_before(self):
+        with temp_dir() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            write_run_state(state_file, {
+                'runner_path': '/path/runner.py',
+                'argv': ['workspace', '--restart']})
+            args = parse_args(['--state-file', state_file])
+            with patch('subprocess.Popen', autospec=True) as mock:
+                restart_chaos_monkey(args)
+        mock.assert_called_once_with(
+            ['python', '/path/runner.py', 'workspace', '--restart'])
+
+    def test_execute_chaos_monkey_exec(self):
+        with temp_dir() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            write_run_state(state_file, {
+                'runner_path': '/path/runner.py', 'argv': ['workspace']})
+            args = parse_args(['--state-file', state_file, '--exec'])
+            with patch('os.execvp', autospec=True) as mock:
+                with patch('subprocess.Popen', autospec=True) as p_mock:
+                    restart_chaos_monkey(args)
+        cmd = ['python', '/path/runner.py', 'workspace', '--restart']
+        mock.assert_called_once_with('python', cmd)
+        self.assertEqual(p_mock.call_count, 0)
+
+    def test_execute_chaos_monkey_without_state(self):
+        args = parse_args(['--state-file', '/does/not/exist'])
+        with patch('subprocess.Popen', autospec=True) as mock:
+            restart_chaos_monkey(args)
+        self.assertEqual(mock.call_count, 0)
@@ -2,27 +2,57 @@
 # Licensed under the AGPLv3, see LICENCE file for details.
 from argparse import Namespace
 from contextlib import contextmanager
+import json
 import os
+import random
 import signal
 import subprocess
 from StringIO import StringIO
 from tempfile import NamedTemporaryFile
 from time import time
 
-from mock import patch, call
-import yaml
+from mock import (
+    call,
+    MagicMock,
+    patch,
+)
 
 from chaos.kill import Kill
 from chaos_monkey import ChaosMonkey
 from chaos_monkey_base import Chaos
+from event_log import (
+    DISABLE,
+    ENABLE,
+    EventMessage,
+)
 from chaos.net import Net
+from coordinator import (
+    Coordinator,
+    FleetPolicy,
+    LeaseAgent,
+    LoopbackTransport,
+)
 from runner import (
     display_all_commands,
     parse_args,
     Runner,
     setup_sig_handlers,
 )
+from replay import read_replay
+from selection import SelectionPolicy
+from scheduler import (
+    read_plan,
+    VirtualClock,
+    write_plan,
+)
 from tests.test_chaos_monkey import CommonTestBase
+from utils.init import Init
+from utils.process import ProcessFinder
+from utils.run_state import (
+    read_run_state,
+    write_run_state,
+)
+from utils.waiter import Waiter
 from utility import (
     BadRequest,
     NotFound,
@@ -37,6 +67,20 @@ class TestRunner(CommonTestBase):
 
     def setUp(self):
         self.setup_test_logging()
+        # Never signal real jujud or mongod processes from random chaos.
+        find_patcher = patch('utils.process.ProcessFinder.find',
+                             autospec=True, return_value=[4321])
+        find_patcher.start()
+        self.addCleanup(find_patcher.stop)
+        kill_patcher = patch('chaos.kill.os.kill', autospec=True)
+        self.kill_mock = kill_patcher.start()
+        self.addCleanup(kill_patcher.stop)
+        # Nor feed real ipset or iptables-restore scripts, as partition does.
+        popen_patcher = patch('utility.Popen', autospec=True)
+        self.popen_mock = popen_patcher.start()
+        self.popen_mock.return_value.communicate.return_value = ('', None)
+        self.popen_mock.return_value.returncode = 0
+        self.addCleanup(popen_patcher.stop)
 
     def test_factory(self):
         with temp_dir() as directory:
@@ -53,9 +97,9 @@ class TestRunner(CommonTestBase):
         expected_cmd_file = os.path.join(expected_log_dir_path,
                                          'chaos_run_list.log')
         self.assertEqual(sl_mock.mock_calls, [
-            call(log_path=expected_log_file, log_count=1),
+            call(log_path=expected_log_file, log_count=1, queue_size=0),
             call(log_path=expected_cmd_file, log_count=1, name='cmd_log',
-                 add_stream=False, disable_formatter=True)
+                 add_stream=False, disable_formatter=True, queue_size=0)
         ])
         cm_mock.assert_called_with()
         self.assertIsInstance(runner, Runner)
@@ -63,13 +107,17 @@ class TestRunner(CommonTestBase):
     def test_acquire_lock(self):
         with temp_dir() as directory:
             expected_file = os.path.join(directory, 'chaos_runner.lock')
-            expected_pid = str(os.getpid())
             runner = Runner(directory, None)
             runner.acquire_lock()
             self.assertTrue(os.path.exists(expected_file))
             with open(expected_file, 'r') as lock_file:
-                pid = lock_file.read()
-            self.assertEqual(pid, expected_pid)
+                pid, start_time = lock_file.read().split()
+            runner.cleanup()
+        self.assertEqual(pid, str(os.getpid()))
+        self.assertAlmostEqual(
+            float(start_time), ProcessFinder().started_at(os.getpid()),
+            delta=0.01)
+        self.assertIsNone(runner.lock_fd)
 
     def test_acquire_lock_fails_without_workspace(self):
         with temp_dir() as directory:
@@ -79,65 +127,112 @@ class TestRunner(CommonTestBase):
         with self.assertRaises(SystemExit):
             runner.acquire_lock()
 
-    def test_acquire_lock_fails_when_existing_lockfile(self):
+    def test_acquire_lock_fails_when_locked(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, None)
+            runner.acquire_lock()
+            other = Runner(directory, None)
+            with self.assertRaises(SystemExit):
+                other.acquire_lock()
+            runner.cleanup()
+            other.acquire_lock()
+            other.cleanup()
+
+    def test_acquire_lock_when_runner_died(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, None)
+            runner.acquire_lock()
+            # The kernel releases the flock of a dead runner.
+            os.close(runner.lock_fd)
+            other = Runner(directory, None)
+            other.acquire_lock()
+            other.cleanup()
+
+    def test_acquire_lock_fails_when_legacy_runner_alive(self):
         with temp_dir() as directory:
             expected_file = os.path.join(directory, 'chaos_runner.lock')
-            open(expected_file, 'a').close()
+            with open(expected_file, 'w') as lock_file:
+                lock_file.write(str(os.getppid()))
             runner = Runner(directory, None)
             with self.assertRaises(SystemExit):
                 runner.acquire_lock()
+            self.assertIsNone(runner.lock_fd)
+            runner.acquire_lock(restart=True)
+            runner.cleanup()
 
-    def test_verify_lock(self):
+    def test_acquire_lock_when_legacy_pid_reused(self):
         with temp_dir() as directory:
             expected_file = os.path.join(directory, 'chaos_runner.lock')
             with open(expected_file, 'w') as lock_file:
-                lock_file.write(str(os.getpid()))
+                lock_file.write(str(os.getppid()))
+            # The process started after the lock file was written.
+            os.utime(expected_file, (0, 0))
             runner = Runner(directory, None)
-            runner.workspace_lock = True
-            runner.lock_file = expected_file
+            runner.acquire_lock()
+            runner.cleanup()
+
+    def test_lock_owner_alive(self):
+        pid = os.getppid()
+        started_at = ProcessFinder().started_at(pid)
+        owner = '{} {}'.format(pid, started_at)
+        self.assertTrue(Runner._lock_owner_alive(owner, 0))
+        self.assertFalse(Runner._lock_owner_alive(
+            '{} {}'.format(pid, started_at - 10), time()))
+        self.assertTrue(Runner._lock_owner_alive(str(pid), time()))
+        self.assertFalse(Runner._lock_owner_alive(str(os.getpid()), time()))
+        self.assertFalse(Runner._lock_owner_alive('', time()))
+        self.assertFalse(Runner._lock_owner_alive('bad_pid', time()))
+
+    def test_verify_lock(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, None)
+            runner.acquire_lock()
             runner.verify_lock()
+            runner.cleanup()
 
     def test_verify_lock_workspace_lock_false(self):
             runner = Runner(None, None)
             with self.assertRaisesRegexp(NotFound, 'Workspace is not locked.'):
                 runner.verify_lock()
 
-    def test_verify_lock_empty_lock_file(self):
+    def test_verify_lock_removed_lock_file(self):
         with temp_dir() as directory:
-            expected_file = os.path.join(directory, 'chaos_runner.lock')
-            open(expected_file, 'a').close()
             runner = Runner(directory, None)
-            runner.workspace_lock = True
-            runner.lock_file = expected_file
-            with self.assertRaisesRegexp(NotFound, 'Unexpected pid:'):
+            runner.acquire_lock()
+            os.unlink(runner.lock_file)
+            with self.assertRaisesRegexp(NotFound, 'Lock file removed'):
                 runner.verify_lock()
+            runner.cleanup(restart=True)
 
-    def test_verify_lock_bad_pid_in_lock_file(self):
+    def test_verify_lock_replaced_lock_file(self):
         with temp_dir() as directory:
-            expected_file = os.path.join(directory, 'chaos_runner.lock')
-            with open(expected_file, 'w') as lock_file:
-                lock_file.write('bad_pid')
             runner = Runner(directory, None)
-            runner.workspace_lock = True
-            runner.lock_file = expected_file
-            with self.assertRaisesRegexp(NotFound, 'Unexpected pid:'):
+            runner.acquire_lock()
+            os.unlink(runner.lock_file)
+            open(runner.lock_file, 'w').close()
+            with self.assertRaisesRegexp(NotFound, 'or replaced'):
                 runner.verify_lock()
+            runner.cleanup()
 
     def test_random(self):
         with patch('utility.check_output', autospec=True) as mock:
             with temp_dir() as directory:
                 runner = Runner(directory, ChaosMonkey.factory())
                 runner.random_chaos(run_timeout=1, enablement_timeout=1,
-                                    exclude_command=Kill.restart_cmd)
+                                    exclude_group=Kill.group,
+                                    exclude_command='partition')
         self.assertEqual(mock.called, True)
+        self.assertEqual(self.kill_mock.called, False)
 
     def test_random_enablement_zero(self):
         with patch('utility.check_output', autospec=True) as mock:
             with temp_dir() as directory:
                 runner = Runner(directory, ChaosMonkey.factory())
                 runner.random_chaos(run_timeout=1, enablement_timeout=0,
-                                    exclude_command=Kill.restart_cmd)
+                                    exclude_group=Kill.group,
+                                    exclude_command='partition')
         self.assertEqual(mock.called, True)
+        self.assertEqual(self.kill_mock.called, False)
 
     def test_random_verify_timeout(self):
         run_timeout = 6
@@ -147,10 +242,32 @@ class TestRunner(CommonTestBase):
                 runner = Runner(directory, ChaosMonkey.factory())
                 runner.random_chaos(run_timeout=run_timeout,
                                     enablement_timeout=2,
-                                    exclude_command=Kill.restart_cmd)
+                                    exclude_group=Kill.group,
+                                    exclude_command='partition')
             end_time = time()
         self.assertEqual(run_timeout, int(end_time-current_time))
         self.assertEqual(mock.called, True)
+        self.assertEqual(self.kill_mock.called, False)
+
+    def test_random_partition(self):
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.random_chaos(run_timeout=1, enablement_timeout=0,
+                                    include_command='partition')
+        self.assertEqual(mock.called, False)
+        self.assertEqual(self.popen_mock.call_args_list[0][0][0],
+                         ['iptables-restore', '--noflush'])
+
+    def test_random_kill(self):
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.random_chaos(run_timeout=1, enablement_timeout=0,
+                                    include_group=Kill.group,
+                                    exclude_command=Kill.restart_cmd)
+        self.assertEqual(mock.called, False)
+        self.kill_mock.assert_called_with(4321, signal.SIGKILL)
 
     def test_random_assert_run_command_method_called(self):
         with patch('utility.check_output', autospec=True):
@@ -161,6 +278,8 @@ class TestRunner(CommonTestBase):
         cm_mock.assert_called_with(runner, 1)
 
     def test_random_assert_chaos_methods_called(self):
+        ChaosMonkey.reset_registry()
+        self.addCleanup(ChaosMonkey.reset_registry)
         net_ctx = patch('chaos.net.Net', autospec=True)
         kill_ctx = patch('chaos.kill.Kill', autospec=True)
         with patch('utility.check_output', autospec=True):
@@ -171,8 +290,11 @@ class TestRunner(CommonTestBase):
                             runner = Runner(directory, ChaosMonkey.factory())
                             runner.random_chaos(
                                 run_timeout=1, enablement_timeout=1)
-        net_mock.factory.return_value.get_chaos.assert_called_with()
-        kill_mock.factory.return_value.get_chaos.assert_called_with()
+                        # Selecting commands does not import the chaos.
+                        self.assertEqual(net_mock.factory.call_count, 0)
+                        ChaosMonkey.find_command('deny-all').plugin.load()
+        net_mock.factory.return_value.get_chaos.assert_called_once_with()
+        self.assertEqual(kill_mock.factory.call_count, 0)
 
     def test_random_chaos_passes_timeout(self):
         with patch('utility.check_output', autospec=True):
@@ -208,6 +330,8 @@ class TestRunner(CommonTestBase):
             runner = Runner(directory, ChaosMonkey.factory())
             runner.filter_commands()
         self.verify_equals_to_all_chaos(runner.chaos_monkey.chaos)
+        self.assertItemsEqual(runner.metrics.commands,
+                              ChaosMonkey.get_all_commands())
 
     def test_filter_commands_include_group_none(self):
         include_group = None
@@ -453,6 +577,8 @@ class TestRunner(CommonTestBase):
         self.assertItemsEqual(arg, ['net', Kill.group])
         arg = split_arg_string('net')
         self.assertItemsEqual(arg, ['net'])
+        arg = split_arg_string('delay(latency=1s,jitter=0ms),drop')
+        self.assertEqual(arg, ['delay(latency=1s,jitter=0ms)', 'drop'])
 
     def test_validate_group(self):
         groups = "net"
@@ -479,6 +605,27 @@ class TestRunner(CommonTestBase):
         commands = Runner._validate(commands, all_commands)
         self.assertItemsEqual(commands, ['deny-all'])
 
+    def test_validate_parameterized_commands(self):
+        commands = "deny-all,delay(latency=1s,jitter=0ms)"
+        registry = ChaosMonkey.registry()
+        commands = Runner._validate(
+            commands, registry.commands, registry.find)
+        self.assertEqual(
+            commands, ['deny-all', 'delay(latency=1s,jitter=0ms)'])
+        with self.assertRaisesRegexp(
+                BadRequest, "Invalid value given on command line: foo"):
+            Runner._validate('foo(a=1)', registry.commands, registry.find)
+
+    def test_filter_commands_parameterized(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory())
+            runner.filter_commands(
+                include_command='delay(latency=1s),delay(latency=2s),drop',
+                exclude_command='delay(latency=2s)')
+        self.assertEqual(
+            [c.command_str for c in runner.chaos_monkey.chaos],
+            ['delay(latency=1s)', 'drop'])
+
     def test_validate_commands(self):
         commands = "deny-all,{},deny-api-server".format(Kill.jujud_cmd)
         all_commands = ChaosMonkey.get_all_commands()
@@ -533,9 +680,16 @@ class TestRunner(CommonTestBase):
             args, Namespace(path='path', enablement_timeout=60,
                             total_timeout=60, log_count=2, include_group=None,
                             exclude_group=None, include_command=None,
-                            exclude_command=None, dry_run=False,
+                            exclude_command=None, max_faults=1,
+                            min_enablement_timeout=None, stagger=0,
+                            weights=None, seed=None, seed_key=None,
+                            dry_run=False,
                             run_once=False, restart=False, expire_time=None,
-                            replay=None))
+                            replay=None, log_queue=0, shell_helper=False,
+                            firewall_backend='ufw', interfaces='default',
+                            metrics=None, coordinator=None, unit=None,
+                            role=None, netem_backend='tc', jujud_match=None,
+                            mongod_match=None))
 
     def test_parse_args_non_default_values(self):
         args = parse_args(['path',
@@ -546,18 +700,43 @@ class TestRunner(CommonTestBase):
                            '--exclude-group', Kill.group,
                            '--include-command', 'deny-all',
                            '--exclude-command', 'deny-incoming',
+                           '--max-faults', '3',
+                           '--min-enablement-timeout', '10',
+                           '--stagger', '5',
+                           '--weights', '/path/to/weights',
+                           '--seed', '42',
+                           '--seed-key', 'unit-0',
                            '--dry-run',
                            '--restart',
                            '--expire-time', '111.11',
-                           '--replay', '/path/to/foo'])
+                           '--replay', '/path/to/foo',
+                           '--log-queue', '1000',
+                           '--shell-helper',
+                           '--firewall-backend', 'iptables',
+                           '--interfaces', 'ens3,br0',
+                           '--metrics', '127.0.0.1:9107',
+                           '--netem-backend', 'netlink',
+                           '--jujud-match', 'unit=jujud-machine-0.service',
+                           '--mongod-match', 'exe=/usr/bin/mongod'])
         self.assertEqual(
             args, Namespace(path='path', enablement_timeout=30,
                             total_timeout=600, log_count=4,
                             include_group='net', exclude_group=Kill.group,
                             include_command='deny-all',
-                            exclude_command='deny-incoming', dry_run=True,
-                            run_once=False, restart=True, expire_time=111.11,
-                            replay='/path/to/foo'))
+                            exclude_command='deny-incoming', max_faults=3,
+                            min_enablement_timeout=10, stagger=5,
+                            weights='/path/to/weights', seed=42,
+                            seed_key='unit-0',
+                            dry_run=True, run_once=False, restart=True,
+                            expire_time=111.11,
+                            replay='/path/to/foo', log_queue=1000,
+                            shell_helper=True,
+                            firewall_backend='iptables',
+                            interfaces='ens3,br0', metrics='127.0.0.1:9107',
+                            coordinator=None, unit=None, role=None,
+                            netem_backend='netlink',
+                            jujud_match='unit=jujud-machine-0.service',
+                            mongod_match='exe=/usr/bin/mongod'))
 
     def test_parse_args_non_default_values_set_run_once(self):
         args = parse_args(['path',
@@ -574,9 +753,16 @@ class TestRunner(CommonTestBase):
                             total_timeout=30, log_count=4,
                             include_group='net', exclude_group=Kill.group,
                             include_command='deny-all',
-                            exclude_command='deny-incoming', dry_run=True,
+                            exclude_command='deny-incoming', max_faults=1,
+                            min_enablement_timeout=None, stagger=0,
+                            weights=None, seed=None, seed_key=None,
+                            dry_run=True,
                             run_once=True, restart=False, expire_time=None,
-                            replay=None))
+                            replay=None, log_queue=0, shell_helper=False,
+                            firewall_backend='ufw', interfaces='default',
+                            metrics=None, coordinator=None, unit=None,
+                            role=None, netem_backend='tc', jujud_match=None,
+                            mongod_match=None))
 
     def test_parse_args_error_enablement_greater_than_total_timeout(self):
         with parse_error(self) as stderr:
@@ -612,6 +798,343 @@ class TestRunner(CommonTestBase):
                     run_timeout=2, enablement_timeout=1, run_once=True)
         mock.assert_called_once_with(runner, 1)
 
+    def test_random_chaos_max_faults_uses_scheduler(self):
+        with patch('runner.FaultScheduler', autospec=True) as fs_mock:
+            with patch('runner.Runner._run_command',
+                       autospec=True) as rc_mock:
+                with temp_dir() as directory:
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    runner.random_chaos(
+                        run_timeout=2, enablement_timeout=1, max_faults=3,
+                        min_enablement_timeout=0, stagger=1)
+        fs_mock.assert_called_once_with(
+            runner.chaos_monkey.chaos, runner._enable_chaos,
+            runner._disable_chaos, 3, 1, min_duration=0, stagger=1,
+            wait=runner.waiter.wait,
+            selector=runner.chaos_monkey.selector())
+        self.assertEqual(fs_mock.return_value.run.call_count, 1)
+        self.assertEqual(rc_mock.call_count, 0)
+
+    def test_random_chaos_runs_leased_commands(self):
+        coordinator = Coordinator(FleetPolicy())
+        with patch('utility.check_output', autospec=True):
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.agent = LeaseAgent(
+                    LoopbackTransport(coordinator), 'unit-0')
+                runner.random_chaos(
+                    run_timeout=2, enablement_timeout=0,
+                    include_command='deny-all', run_once=True)
+        self.assertEqual(coordinator.leases, {})
+        self.assertEqual(runner.metrics.commands['deny-all'].enabled, [1, 0])
+        self.assertEqual(
+            runner.metrics.commands['deny-all'].disabled, [1, 0])
+
+    def test_run_leased_command_waits_when_denied(self):
+        coordinator = Coordinator(FleetPolicy(max_faults=0, retry=3))
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory())
+            runner.agent = LeaseAgent(
+                LoopbackTransport(coordinator), 'unit-0')
+            runner.expire_time = time() + 60
+            with patch.object(Waiter, 'wait', autospec=True) as w_mock:
+                with patch.object(runner, '_enable_chaos',
+                                  autospec=True) as e_mock:
+                    self.assertFalse(runner._run_leased_command(10))
+        self.assertEqual(w_mock.call_args[0][1], 3)
+        self.assertEqual(e_mock.call_count, 0)
+
+    def test_run_leased_command_keeps_restart_lease(self):
+        coordinator = Coordinator(FleetPolicy())
+        with patch('utility.check_output', autospec=True):
+            with temp_dir() as directory:
+                init = fake_init(directory)
+                with patch('runner.Init.detect', autospec=True,
+                           return_value=init):
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    runner.chaos_monkey.include_command([Kill.restart_cmd])
+                    runner.agent = LeaseAgent(
+                        LoopbackTransport(coordinator), 'unit-0')
+                    runner.expire_time = time() + 60
+                    self.assertTrue(runner._run_leased_command(10))
+        self.assertEqual(
+            [lease.command_str for lease in coordinator.leases.values()],
+            [Kill.restart_cmd])
+
+    def test_enable_chaos_restart_stops(self):
+        enable = MagicMock()
+        chaos = Chaos(enable, None, Kill.group, Kill.restart_cmd, 'restart')
+        with temp_dir() as directory:
+            init = fake_init(directory)
+            with patch('runner.Init.detect', autospec=True,
+                       return_value=init):
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.expire_time = 10
+                runner.active_chaos.add('deny-all')
+                with patch('sys.argv', ['runner.py', '--restart', 'ws']):
+                    self.assertFalse(runner._enable_chaos(chaos, 1))
+            self.assertTrue(os.path.isfile(init.init_path))
+            state = read_run_state(init.state_path)
+        self.assertTrue(runner.stop_chaos)
+        enable.assert_called_once_with()
+        self.assertEqual(state['argv'], ['--restart', 'ws'])
+        self.assertEqual(state['runner_path'], init.runner_path)
+        self.assertEqual(state['expire_time'], 10)
+        self.assertEqual(state['active_faults'], ['deny-all'])
+        self.assertIsNone(state['replay_offset'])
+        self.assertEqual(state['plan_position'], 0)
+        self.assertEqual(state['selection_history'], {})
+
+    def test_enable_and_disable_chaos_track_active_chaos(self):
+        chaos = Chaos(MagicMock(), MagicMock(), 'net', 'deny-all', 'deny')
+        kill = Chaos(MagicMock(), None, 'kill', 'kill-mongod', 'kill')
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory())
+            runner._enable_chaos(chaos, 1)
+            runner._enable_chaos(kill, 1)
+            self.assertEqual(runner.active_chaos, set(['deny-all']))
+            runner._disable_chaos(chaos)
+        self.assertEqual(runner.active_chaos, set())
+
+    def test_resume(self):
+        random.seed(1)
+        rng_state = random.getstate()
+        expected = [random.random() for _ in range(3)]
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                init = fake_init(directory)
+                write_run_state(init.state_path, {
+                    'runner_path': init.runner_path, 'argv': [],
+                    'expire_time': 1234.5, 'replay_offset': 10,
+                    'plan_position': 3, 'rng_state': rng_state,
+                    'active_faults': ['deny-all', 'unknown']})
+                with patch('runner.Init.detect', autospec=True,
+                           return_value=init):
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    self.assertEqual(runner.resume(), 1234.5)
+                    self.assertFalse(os.path.isfile(init.state_path))
+                    self.assertIsNone(runner.resume())
+        self.assertEqual([random.random() for _ in range(3)], expected)
+        self.assertEqual(runner.replay_offset, 10)
+        self.assertEqual(runner.plan_position, 3)
+        # Only the known command is disabled.
+        self.assertEqual(mock.mock_calls, [
+            call(['ufw', 'disable']),
+            call(['ufw', 'delete', 'deny', 'out', 'to', 'any']),
+            call(['ufw', 'delete', 'deny', 'in', 'to', 'any']),
+            call(['ufw', 'delete', 'allow', 'ssh'])])
+
+    def test_acquire_lock_removes_stale_run_state(self):
+        with temp_dir() as directory:
+            init = fake_init(directory)
+            write_run_state(init.state_path, {})
+            with patch('runner.Init.detect', autospec=True,
+                       return_value=init):
+                runner = Runner(directory, None)
+                runner.acquire_lock()
+            self.assertFalse(os.path.isfile(init.state_path))
+
+    def test_parse_args_error_max_faults(self):
+        with parse_error(self) as stderr:
+            parse_args(['path', '--max-faults', '0'])
+        self.assertIn('Invalid max-faults value:', stderr.getvalue())
+
+    def test_parse_args_error_min_enablement_timeout(self):
+        with parse_error(self) as stderr:
+            parse_args(['path', '--enablement-timeout', '5',
+                        '--min-enablement-timeout', '6'])
+        self.assertIn('Invalid min-enablement-timeout value:',
+                      stderr.getvalue())
+
+    def test_parse_args_error_seed_key_without_seed(self):
+        with parse_error(self) as stderr:
+            parse_args(['path', '--seed-key', 'unit-0'])
+        self.assertIn('seed-key requires seed', stderr.getvalue())
+
+    def test_parse_args_metrics(self):
+        for address in ('9107', ':9107', '0.0.0.0:9107', '/run/cm.sock'):
+            args = parse_args(['path', '--metrics', address])
+            self.assertEqual(args.metrics, address)
+        with parse_error(self) as stderr:
+            parse_args(['path', '--metrics', 'metrics.sock'])
+        self.assertIn('Invalid metrics value:', stderr.getvalue())
+
+    def test_parse_args_error_process_match(self):
+        with parse_error(self) as stderr:
+            parse_args(['path', '--jujud-match', 'pid=1'])
+        self.assertIn(
+            'Invalid jujud-match value: Invalid process match: pid=1',
+            stderr.getvalue())
+        with parse_error(self) as stderr:
+            parse_args(['path', '--mongod-match', 'name='])
+        self.assertIn('Invalid mongod-match value:', stderr.getvalue())
+
+    def test_parse_args_coordinator(self):
+        args = parse_args(['path', '--coordinator', '10.0.0.1:9108',
+                           '--unit', 'juju-0', '--role', 'state-server'])
+        self.assertEqual(
+            (args.coordinator, args.unit, args.role),
+            ('10.0.0.1:9108', 'juju-0', 'state-server'))
+        with parse_error(self) as stderr:
+            parse_args(['path', '--coordinator', '9108', '--seed', '1'])
+        self.assertIn('coordinator can not be used with', stderr.getvalue())
+        with parse_error(self) as stderr:
+            parse_args(['path', '--role', 'state-server'])
+        self.assertIn('unit and role require coordinator', stderr.getvalue())
+
+    def test_random_chaos_seed_is_reproducible(self):
+        plans = []
+        for seed_key in (None, None, 'unit-1'):
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory(),
+                                dry_run=True)
+                runner.random_chaos(
+                    run_timeout=600, enablement_timeout=10, max_faults=2,
+                    min_enablement_timeout=1, seed=7, seed_key=seed_key)
+                with open(runner.plan_file) as f:
+                    # The duration of the last commands is cut at the
+                    # expire time, which depends on the current time.
+                    plans.append([line.rsplit(',', 1)[0]
+                                  for line in f.read().splitlines()[1:]])
+        self.assertEqual(plans[0], plans[1])
+        self.assertNotEqual(plans[0], plans[2])
+        self.assertGreater(len(plans[0]), 60)
+
+    def test_random_chaos_seed_dry_run_writes_plan(self):
+        with patch('runner.Runner._enable_chaos', autospec=True) as e_mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory(),
+                                dry_run=True)
+                runner.random_chaos(
+                    run_timeout=60, enablement_timeout=10, seed=1)
+                header, entries = read_plan(runner.plan_file)
+                entries = list(entries)
+        self.assertEqual(e_mock.call_count, 0)
+        self.assertEqual(header['seed'], 1)
+        self.assertEqual([e[0] for e in entries], [0, 10, 20, 30, 40, 50])
+
+    def test_random_chaos_dry_run_simulates(self):
+        with patch('runner.Runner._enable_chaos', autospec=True) as e_mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory(),
+                                dry_run=True)
+                runner.random_chaos(
+                    run_timeout=3 * 24 * 3600, enablement_timeout=60,
+                    max_faults=2, min_enablement_timeout=10)
+                with open(runner.simulation_file) as f:
+                    report = json.load(f)
+        self.assertEqual(e_mock.call_count, 0)
+        self.assertAlmostEqual(report['run_ms'], 3 * 24 * 3600 * 1000,
+                               delta=1000)
+        events = report['events']
+        self.assertEqual(events[0][:2], [0, ENABLE])
+        self.assertEqual(len([e for e in events if e[1] == ENABLE]),
+                         len([e for e in events if e[1] == DISABLE]))
+        self.assertEqual(
+            sorted(report['fault_ms']),
+            sorted(c.command_str for c in runner.chaos_monkey.chaos))
+        self.assertGreater(report['coverage']['commands'], 0.5)
+        self.assertGreater(report['coverage']['time'], 0.99)
+
+    def test_random_chaos_dry_run_once(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory(), dry_run=True)
+            runner.random_chaos(run_timeout=600, enablement_timeout=60,
+                                max_faults=3, run_once=True)
+            with open(runner.simulation_file) as f:
+                report = json.load(f)
+        self.assertEqual([e[1] for e in report['events']], [ENABLE, DISABLE])
+        self.assertEqual(report['events'][0][3], 60000)
+
+    def test_random_chaos_seed_dry_run_simulates_plan(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory(), dry_run=True)
+            runner.random_chaos(
+                run_timeout=600, enablement_timeout=10, max_faults=2,
+                min_enablement_timeout=1, seed=7)
+            header, entries = read_plan(runner.plan_file)
+            entries = list(entries)
+            with open(runner.simulation_file) as f:
+                report = json.load(f)
+        enabled = [(e[0], e[2], e[3]) for e in report['events']
+                   if e[1] == ENABLE]
+        self.assertEqual(enabled, [
+            (int(round(o * 1000)), c, int(round(d * 1000)))
+            for o, c, d in entries])
+
+    def test_random_chaos_seed_runs_plan(self):
+        with patch('runner.FaultScheduler.run_plan', autospec=True) as r_mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.random_chaos(
+                    run_timeout=60, enablement_timeout=10, seed=1)
+                header, entries = read_plan(runner.plan_file)
+                entries = list(entries)
+                scheduler, run_entries, start_time, should_stop = (
+                    r_mock.call_args[0])
+                self.assertEqual(list(run_entries), entries)
+        self.assertIsInstance(scheduler.rng, random.Random)
+        self.assertEqual(start_time, header['start_time'])
+        self.assertFalse(should_stop())
+
+    def test_random_chaos_seed_resumes_plan_after_restart(self):
+        with patch('runner.FaultScheduler.run_plan', autospec=True) as r_mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory(),
+                                dry_run=True)
+                expire_time = time() + 60
+                runner.random_chaos(
+                    run_timeout=None, enablement_timeout=10, seed=1,
+                    expire_time=expire_time)
+                header, entries = read_plan(runner.plan_file)
+                entries = list(entries)
+                header['start_time'] -= 35
+                write_plan(runner.plan_file, entries, **header)
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.random_chaos(
+                    run_timeout=None, enablement_timeout=10, seed=1,
+                    expire_time=round(expire_time, 2))
+                run_entries, start_time = r_mock.call_args[0][1:3]
+                self.assertEqual(list(run_entries), entries)
+        self.assertEqual(start_time, header['start_time'])
+
+    def test_random_chaos_seed_resumes_plan_after_restart_entry(self):
+        expire_time = time() + 60
+        with temp_dir() as directory:
+            init = fake_init(directory)
+            runner = Runner(directory, ChaosMonkey.factory(), dry_run=True)
+            runner.random_chaos(
+                run_timeout=None, enablement_timeout=10, seed=1,
+                expire_time=expire_time)
+            header, _ = read_plan(runner.plan_file)
+            # The unit restarts long before the restart window ends.
+            write_plan(runner.plan_file, [
+                (0, Kill.restart_cmd, 30), (40, 'deny-all', 10)], **header)
+            with patch('runner.Init.detect', autospec=True,
+                       return_value=init):
+                with patch('utility.check_output', autospec=True):
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    runner.random_chaos(
+                        run_timeout=None, enablement_timeout=10, seed=1,
+                        expire_time=expire_time)
+                self.assertEqual(
+                    read_run_state(init.state_path)['plan_position'], 1)
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.resume()
+            with patch('runner.FaultScheduler.run_plan',
+                       autospec=True) as r_mock:
+                runner.random_chaos(
+                    run_timeout=None, enablement_timeout=10, seed=1,
+                    expire_time=expire_time)
+                run_entries = list(r_mock.call_args[0][1])
+        self.assertEqual(run_entries, [(40, 'deny-all', 10)])
+        self.assertEqual(runner.plan_position, 2)
+
+    def test_parse_args_error_stagger(self):
+        with parse_error(self) as stderr:
+            parse_args(['path', '--stagger', '-1'])
+        self.assertIn('Invalid stagger value:', stderr.getvalue())
+
     def test_list_all_commands(self):
         cmd = Runner.list_all_commands()
         self.assertItemsEqual(cmd.keys(), ChaosMonkey.get_all_groups())
@@ -646,17 +1169,83 @@ class TestRunner(CommonTestBase):
                     runner._run_command(enablement_timeout=0)
         self.assertEqual(mock.mock_calls, self._deny_port_call_list())
 
+    def test_run_command_disables_chaos_on_signal(self):
+        chaos = Chaos(MagicMock(), MagicMock(), 'net', 'deny-all', 'deny')
+        with patch('runner.random.choice', autospec=True,
+                   return_value=chaos):
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                self.addCleanup(runner.waiter.close)
+
+                def enable():
+                    runner.sig_handler(signal.SIGTERM, None)
+                chaos.enable.side_effect = enable
+                start = time()
+                runner._run_command(enablement_timeout=60)
+        self.assertLess(time() - start, 10)
+        chaos.disable.assert_called_once_with()
+
+    def test_run_command_disables_chaos_at_expire_time(self):
+        chaos = Chaos(MagicMock(), MagicMock(), 'net', 'deny-all', 'deny')
+        with patch('runner.random.choice', autospec=True,
+                   return_value=chaos):
+            with patch.object(Waiter, 'wait', autospec=True) as w_mock:
+                with temp_dir() as directory:
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    runner.expire_time = time() + 5
+                    runner._run_command(enablement_timeout=60)
+        self.assertLessEqual(w_mock.call_args[0][1], 5)
+        chaos.disable.assert_called_once_with()
+
+    def test_run_command_waits_when_rate_limited(self):
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory())
+            runner.chaos_monkey.include_command(['deny-all'])
+            runner.chaos_monkey.policy = SelectionPolicy.from_dict(
+                {'commands': {'deny-all': {'max-per-hour': 0}}})
+            with patch.object(runner, '_enable_chaos',
+                              autospec=True) as e_mock:
+                with patch.object(Waiter, 'wait', autospec=True) as w_mock:
+                    runner._run_command(enablement_timeout=5)
+        self.assertEqual(e_mock.call_count, 0)
+        self.assertEqual(w_mock.call_args[0][1], 5)
+        self.assertEqual(runner.metrics.loop_iterations, 1)
+        self.assertEqual(runner.metrics.rate_limited, 1)
+
     def test_run_command_select_restart_unit(self):
         chaos = self._get_chaos_object(Kill(), Kill.restart_cmd)
         with patch('utility.check_output', autospec=True) as mock:
             with patch(
                     'runner.random.choice', autospec=True, return_value=chaos):
-                with patch('runner.Init', autospec=True) as ri_mock:
-                    with temp_dir() as directory:
+                with temp_dir() as directory:
+                    with patch('runner.Init.detect', autospec=True,
+                               return_value=fake_init(directory)) as ri_mock:
                         runner = Runner(directory, ChaosMonkey.factory())
                         runner._run_command(enablement_timeout=0)
         self.assertEqual(mock.mock_calls, [call(['shutdown', '-r', 'now'])])
-        ri_mock.upstart.assert_called_once_with()
+        ri_mock.assert_called_once_with()
+
+    def test_run_command_rate_limits_hold_across_restart(self):
+        policy = SelectionPolicy.from_dict(
+            {'commands': {Kill.restart_cmd: {'min-interval': 1800}}})
+        with temp_dir() as directory:
+            init = fake_init(directory)
+            with patch('runner.Init.detect', autospec=True,
+                       return_value=init):
+                with patch('utility.check_output', autospec=True):
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    runner.chaos_monkey.policy = policy
+                    runner.chaos_monkey.include_command([Kill.restart_cmd])
+                    runner._run_command(enablement_timeout=0)
+                self.assertTrue(runner.stop_chaos)
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.resume()
+            runner.chaos_monkey.policy = policy
+            runner.chaos_monkey.include_command([Kill.restart_cmd])
+            now = time()
+            selector = runner.chaos_monkey.selector()
+            self.assertIsNone(selector.choose(now))
+            self.assertGreater(selector.next_allowed_time(now), now + 1700)
 
     def test_replay_commands(self):
         with patch('utility.check_output', autospec=True) as mock:
@@ -670,28 +1259,241 @@ class TestRunner(CommonTestBase):
         expected.extend(self._deny_port_call_list('17017'))
         self.assertEqual(mock.mock_calls, expected)
 
+    def test_replay_parameterized_commands(self):
+        commands = ("- ['drop(percent=5%)', 0.01]\n"
+                    "- ['drop(percent=10%,correlation=0%)', 0.01]\n")
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(temp_file, commands)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    runner.replay_commands(args)
+        rules = [' '.join(c[1][0][c[1][0].index('netem'):])
+                 for c in mock.mock_calls if 'add' in c[1][0]]
+        self.assertEqual(rules[0], 'netem loss 5% 30%')
+        self.assertEqual(rules[-1], 'netem loss 10% 0%')
+
+    def test_replay_commands_from_event_log(self):
+        events = ''.join(str(m) + '\n' for m in [
+            EventMessage(ENABLE, 'deny-state-server', 1),
+            EventMessage(DISABLE, 'deny-state-server', latency=0.1),
+            EventMessage(ENABLE, 'deny-api-server', 1)])
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(temp_file, data=events)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    runner.replay_commands(args)
+        expected = self._deny_port_call_list()
+        expected.extend(self._deny_port_call_list('17017'))
+        self.assertEqual(mock.mock_calls, expected)
+
+    def test_replay_commands_rejects_invalid_entry_before_any_chaos(self):
+        commands = "- [deny-api-server, 1]\n- [foo, 1]\n"
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(
+                        temp_file, data=commands)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    with self.assertRaisesRegexp(
+                            BadRequest, 'Invalid command in replay file: foo'):
+                        runner.replay_commands(args)
+        self.assertEqual(mock.mock_calls, [])
+
+    def test_replay_commands_does_not_filter_commands(self):
+        with patch('utility.check_output', autospec=True):
+            with patch('runner.Runner.filter_commands',
+                       autospec=True) as fc_mock:
+                with temp_dir() as directory:
+                    runner = Runner(directory, ChaosMonkey.factory())
+                    with NamedTemporaryFile() as temp_file:
+                        self._write_command_list_to_file(temp_file)
+                        args = Namespace(
+                            replay=temp_file.name, restart=False)
+                        runner.replay_commands(args)
+        self.assertEqual(fc_mock.call_count, 0)
+
+    def test_replay_commands_catches_up_on_lag(self):
+        commands = ('- [deny-api-server, 5, 10]\n'
+                    '- [deny-state-server, 5, 15]\n')
+        clock = VirtualClock(100)
+
+        def enable(chaos, duration):
+            # The first command takes 7 seconds to enable.
+            if chaos.command_str == 'deny-api-server':
+                clock.wait(7)
+            return True
+
+        with patch('runner.monotonic', side_effect=clock.time):
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.waiter.wait = clock.wait
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(temp_file, data=commands)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    with patch.object(runner, '_enable_chaos',
+                                      side_effect=enable) as enable_mock:
+                        with patch.object(runner, '_disable_chaos'):
+                            with patch('logging.info') as log_mock:
+                                runner.replay_commands(args)
+        self.assertEqual(
+            [(c[0][0].command_str, c[0][1])
+             for c in enable_mock.call_args_list],
+            [('deny-api-server', 5), ('deny-state-server', 3)])
+        self.assertEqual(clock.time(), 110)
+        log_mock.assert_called_with(
+            'Replay drift: <=0.001s: 1, <=0.01s: 0, <=0.1s: 0, <=1s: 0, '
+            '<=10s: 1, >10s: 0, max 2.000s, 0 skipped')
+
+    def test_replay_commands_logs_skipped_commands(self):
+        commands = ('- [deny-api-server, 5, 10]\n'
+                    '- [deny-state-server, 2, 12]\n'
+                    '- [deny-sys-log, 5, 15]\n')
+        clock = VirtualClock(100)
+
+        def enable(chaos, duration):
+            # The first command takes 7 seconds to enable, past the end of
+            # the second one.
+            if chaos.command_str == 'deny-api-server':
+                clock.wait(7)
+            return True
+
+        with patch('runner.monotonic', side_effect=clock.time):
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                runner.waiter.wait = clock.wait
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(temp_file, data=commands)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    with patch.object(runner, '_enable_chaos',
+                                      side_effect=enable) as enable_mock:
+                        with patch.object(runner, '_disable_chaos'):
+                            with patch('logging.warning') as warning_mock:
+                                with patch('logging.info') as info_mock:
+                                    runner.replay_commands(args)
+        self.assertEqual(
+            [c[0][0].command_str for c in enable_mock.call_args_list],
+            ['deny-api-server', 'deny-sys-log'])
+        warning_mock.assert_called_once_with(
+            'Skipped deny-state-server: the replay is 5.000s late, past the '
+            'end of the command.')
+        info_mock.assert_called_with(
+            'Replay drift: <=0.001s: 1, <=0.01s: 0, <=0.1s: 0, <=1s: 0, '
+            '<=10s: 2, >10s: 0, max 5.000s, 1 skipped')
+
+    def test_replay_commands_dry_run(self):
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory(),
+                                dry_run=True)
+                with NamedTemporaryFile() as temp_file:
+                    self._write_command_list_to_file(temp_file)
+                    args = Namespace(replay=temp_file.name, restart=False)
+                    runner.replay_commands(args)
+        self.assertEqual(mock.mock_calls, [])
+
+    def test_enable_and_disable_chaos_log_events(self):
+        chaos = Chaos(MagicMock(), MagicMock(side_effect=OSError),
+                      'net', 'deny-all', 'deny')
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory(),
+                            cmd_log_name='test_cmd_log')
+            with patch('logging.Logger.info', autospec=True) as log_mock:
+                self.assertTrue(runner._enable_chaos(chaos, 7))
+                with self.assertRaises(OSError):
+                    runner._disable_chaos(chaos)
+        events = [json.loads(str(c[0][1])) for c in log_mock.call_args_list
+                  if c[0][0].name == 'test_cmd_log']
+        self.assertEqual(
+            [(e['event'], e['command'], e['duration'], e['outcome'])
+             for e in events],
+            [(ENABLE, 'deny-all', 7, 'ok'),
+             (DISABLE, 'deny-all', None, 'OSError')])
+        self.assertTrue(all(e['latency'] >= 0 for e in events))
+
+    def test_enable_and_disable_chaos_count_metrics(self):
+        chaos = Chaos(MagicMock(), MagicMock(side_effect=OSError),
+                      'net', 'deny-all', 'deny')
+        with temp_dir() as directory:
+            runner = Runner(directory, ChaosMonkey.factory())
+            runner._enable_chaos(chaos, 7)
+            self.assertEqual(runner.metrics.active_faults, 1)
+            with self.assertRaises(OSError):
+                runner._disable_chaos(chaos)
+        command = runner.metrics.commands['deny-all']
+        self.assertEqual(command.enabled, [1, 0])
+        self.assertEqual(command.disabled, [0, 1])
+        self.assertEqual(sum(command.enable_latency.counts), 1)
+        # The chaos is still active, since the disable failed.
+        self.assertEqual(runner.metrics.active_faults, 1)
+
     def test_replay_commands_with_restart_command(self):
         commands = "- [restart-unit, 1]\n- [deny-api-server, 1]\n"
         with patch('utility.check_output', autospec=True) as mock:
-            with patch('runner.Init.install'):
-                with temp_dir() as directory:
+            with temp_dir() as directory:
+                init = fake_init(directory)
+                with patch('runner.Init.detect', autospec=True,
+                           return_value=init):
                     runner = Runner(directory, ChaosMonkey.factory())
                     with NamedTemporaryFile() as temp_file:
                         self._write_command_list_to_file(
                             temp_file, data=commands)
                         args = Namespace(replay=temp_file.name, restart=False)
                         runner.replay_commands(args)
-                        # Verify a temporary file is created because there
-                        # is a restart-unit command in the list.
-                        self.assertIs(os.path.isfile(
-                            temp_file.name + runner.replay_filename_ext), True)
+                        # The run state has the offset of the next command.
+                        state = read_run_state(init.state_path)
+                        runner = Runner(directory, ChaosMonkey.factory())
+                        runner.resume()
                         args = Namespace(replay=temp_file.name, restart=True)
-                        file_content = runner._get_command_list(args)
-                        # Verify the temporary files is deleted.
-                        self.assertIsNot(os.path.isfile(
-                            temp_file.name + runner.replay_filename_ext), True)
+                        f, offset = runner._get_replay_position(args)
+                        with f:
+                            file_content = list(read_replay(f, offset))
         self.assertEqual(mock.mock_calls, [call(['shutdown', '-r', 'now'])])
-        self.assertEqual(file_content, [yaml.load(commands)[1]])
+        self.assertEqual(state['replay_offset'], commands.index('\n') + 1)
+        self.assertEqual(file_content,
+                         [('deny-api-server', 1, None, len(commands))])
+
+    def test_replay_commands_after_reboot_from_offset(self):
+        data = self._write_command_list_to_file(StringIO())
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                replay = os.path.join(directory, 'replay.yaml')
+                with open(replay, 'w') as f:
+                    f.write(data)
+                args = Namespace(replay=replay, restart=True)
+                runner.replay_offset = data.index('\n') + 1
+                runner.replay_commands(args)
+        self.assertEqual(mock.mock_calls, self._deny_port_call_list('17017'))
+
+    def test_replay_commands_after_reboot_from_legacy_offset(self):
+        data = self._write_command_list_to_file(StringIO())
+        with patch('utility.check_output', autospec=True) as mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                replay = os.path.join(directory, 'replay.yaml')
+                with open(replay, 'w') as f:
+                    f.write(data)
+                with open(replay + runner.replay_filename_ext, 'w') as f:
+                    f.write(str(data.index('\n') + 1))
+                args = Namespace(replay=replay, restart=True)
+                runner.replay_commands(args)
+                self.assertFalse(os.path.isfile(
+                    replay + runner.replay_filename_ext))
+        self.assertEqual(mock.mock_calls, self._deny_port_call_list('17017'))
+
+    def test_replay_commands_after_reboot_nothing_left(self):
+        with patch('runner.Runner.random_chaos', autospec=True) as rc_mock:
+            with temp_dir() as directory:
+                runner = Runner(directory, ChaosMonkey.factory())
+                args = Namespace(replay=os.path.join(directory, 'replay'),
+                                 restart=True)
+                runner.replay_commands(args)
+        self.assertEqual(rc_mock.call_count, 0)
 
     def test_replay_commands_after_reboot(self):
         with patch('utility.check_output', autospec=True) as mock:
@@ -709,28 +1511,17 @@ class TestRunner(CommonTestBase):
         expected.extend(self._deny_port_call_list('17017'))
         self.assertEqual(mock.mock_calls, expected)
 
-    def test_get_command_list(self):
+    def test_get_replay_position(self):
         with temp_dir() as directory:
             runner = Runner(directory, ChaosMonkey.factory())
             with NamedTemporaryFile() as temp_file:
                 self._write_command_list_to_file(temp_file)
                 args = Namespace(replay=temp_file.name, restart=False)
-                commands = runner._get_command_list(args)
-        expected = [['deny-state-server', 1], ['deny-api-server', 1]]
-        self.assertItemsEqual(commands, expected)
-
-    def test_save_replay_command_list(self):
-        commands = [['deny-state-server', 1], ['deny-api-server', 1]]
-        with temp_dir() as directory:
-            runner = Runner(directory, ChaosMonkey.factory())
-            with NamedTemporaryFile(
-                    suffix=runner.replay_filename_ext) as temp_file:
-                args = Namespace(replay=temp_file.name.split('.')[0],
-                                 restart=False)
-                runner._save_command_list(commands, args)
-                file_content = temp_file.read()
-        expected = yaml.dump(commands)
-        self.assertItemsEqual(file_content, expected)
+                f, offset = runner._get_replay_position(args)
+                with f:
+                    commands = [c[:2] for c in read_replay(f, offset)]
+        expected = [('deny-state-server', 1), ('deny-api-server', 1)]
+        self.assertEqual(commands, expected)
 
     def _get_chaos_object(self, obj, command_str):
         for chaos in obj.get_chaos():
@@ -757,6 +1548,16 @@ class TestRunner(CommonTestBase):
             call(['ufw', 'delete', 'deny', port])]
 
 
+def fake_init(directory):
+    """Return an Init installing its files in directory."""
+    return Init(
+        init_path=os.path.join(directory, 'chaos-monkey-restart.conf'),
+        init_script_path=Init.upstart().init_script_path,
+        restart_script_path='/path/restart_chaos_monkey.py',
+        runner_path='/path/runner.py',
+        state_path=os.path.join(directory, 'run-state.json'))
+
+
 def add_fake_group(chaos_monkey):
     chaos = Chaos(None, None, 'fake_group', 'fake_command_str', 'description')
     chaos_monkey.append(chaos)
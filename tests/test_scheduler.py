@@ -0,0 +1,265 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+import random
+from unittest import TestCase
+
+from chaos_monkey_base import (
+    Chaos,
+    EXCLUSIVE,
+)
+from scheduler import (
+    conflicts,
+    derive_seed,
+    FaultScheduler,
+    read_plan,
+    read_plan_header,
+    VirtualClock,
+    write_plan,
+)
+from selection import (
+    SelectionPolicy,
+    WeightedSelector,
+)
+from utility import temp_dir
+
+__metaclass__ = type
+
+
+def noop():
+    pass
+
+
+def make_chaos(command_str, resources=(), disable=noop):
+    return Chaos(noop, disable, 'group', command_str, command_str,
+                 resources=resources)
+
+
+class TestConflicts(TestCase):
+
+    def test_conflicts(self):
+        a = make_chaos('a', ['firewall'])
+        b = make_chaos('b', ['firewall'])
+        c = make_chaos('c', ['qdisc-root:eth0'])
+        self.assertTrue(conflicts(a, b))
+        self.assertFalse(conflicts(a, c))
+        self.assertFalse(conflicts(make_chaos('d'), make_chaos('e')))
+
+    def test_conflicts_with_itself(self):
+        self.assertTrue(conflicts(make_chaos('d'), make_chaos('d')))
+
+    def test_exclusive_conflicts_with_everything(self):
+        exclusive = make_chaos('x', [EXCLUSIVE])
+        self.assertTrue(conflicts(exclusive, make_chaos('d')))
+        self.assertTrue(conflicts(make_chaos('d'), exclusive))
+
+
+class TestFaultScheduler(TestCase):
+
+    def run_scheduler(self, chaos, expire_time=100, **kwargs):
+        clock = VirtualClock()
+        events = []
+
+        def enable(c, duration):
+            events.append(('enable', c.command_str, clock.now, duration))
+            self.assertLess(len(scheduler.active), scheduler.max_faults)
+
+        def disable(c):
+            events.append(('disable', c.command_str, clock.now))
+
+        kwargs.setdefault('max_faults', 2)
+        kwargs.setdefault('max_duration', 10)
+        scheduler = FaultScheduler(
+            chaos, enable, disable, clock=clock.time, wait=clock.wait,
+            rng=random.Random(1), **kwargs)
+        scheduler.run(expire_time)
+        return events, scheduler
+
+    def test_run_max_faults(self):
+        chaos = [make_chaos(str(i), ['r{}'.format(i)]) for i in range(5)]
+        events, scheduler = self.run_scheduler(chaos, max_faults=3)
+        enabled = [e for e in events if e[0] == 'enable']
+        self.assertEqual(len(enabled), 30)
+        self.assertEqual([e[2] for e in enabled[:3]], [0, 0, 0])
+        self.assertEqual(scheduler.active, [])
+        self.assertEqual(
+            len([e for e in events if e[0] == 'disable']), len(enabled))
+
+    def test_run_skips_conflicting_chaos(self):
+        chaos = [make_chaos('a', ['firewall']), make_chaos('b', ['firewall'])]
+        events, _ = self.run_scheduler(chaos, expire_time=30)
+        active = set()
+        for event in events:
+            if event[0] == 'enable':
+                self.assertEqual(active, set())
+                active.add(event[1])
+            else:
+                active.remove(event[1])
+
+    def test_run_stagger(self):
+        chaos = [make_chaos(str(i), ['r{}'.format(i)]) for i in range(5)]
+        events, _ = self.run_scheduler(
+            chaos, expire_time=20, max_faults=4, stagger=3)
+        starts = [e[2] for e in events if e[0] == 'enable']
+        self.assertEqual(starts[:4], [0, 3, 6, 9])
+
+    def test_run_random_duration(self):
+        chaos = [make_chaos('a')]
+        events, _ = self.run_scheduler(
+            chaos, max_faults=1, min_duration=2, max_duration=5)
+        durations = [e[3] for e in events if e[0] == 'enable']
+        self.assertTrue(all(2 <= d <= 5 for d in durations))
+        self.assertGreater(len(set(durations)), 1)
+
+    def test_run_chaos_without_disable_holds_slot(self):
+        chaos = [make_chaos('kill', disable=None)]
+        events, scheduler = self.run_scheduler(
+            chaos, expire_time=20, max_faults=1)
+        self.assertEqual([e[2] for e in events if e[0] == 'enable'], [0, 10])
+        self.assertEqual(scheduler.active, [])
+
+    def test_run_exclusive_runs_alone(self):
+        chaos = [make_chaos('x', [EXCLUSIVE]), make_chaos('a'),
+                 make_chaos('b')]
+        events, _ = self.run_scheduler(chaos, expire_time=50)
+        active = set()
+        for event in events:
+            if event[0] == 'enable':
+                if event[1] == 'x' or 'x' in active:
+                    self.assertEqual(active, set())
+                active.add(event[1])
+            else:
+                active.remove(event[1])
+
+    def test_run_stops_when_enable_returns_false(self):
+        chaos = [make_chaos('a', ['a']), make_chaos('b', ['b'])]
+        clock = VirtualClock()
+        calls = []
+
+        def enable(c, duration):
+            calls.append(c)
+            return len(calls) < 2
+
+        disabled = []
+        scheduler = FaultScheduler(
+            chaos, enable, disabled.append, 2, 10, clock=clock.time,
+            wait=clock.wait)
+        scheduler.run(100)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(disabled, calls[:1])
+
+    def test_run_should_stop_disables_active(self):
+        chaos = [make_chaos('a')]
+        clock = VirtualClock()
+        disabled = []
+        scheduler = FaultScheduler(
+            chaos, lambda c, d: None, disabled.append, 1, 10,
+            clock=clock.time, wait=clock.wait)
+        scheduler.run(100, should_stop=lambda: clock.now >= 5)
+        self.assertEqual(disabled, chaos)
+        self.assertEqual(clock.now, 10)
+
+    def test_run_waits_for_rate_limited_chaos(self):
+        chaos = [make_chaos('a')]
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'a': {'min-interval': 30}}})
+        events, _ = self.run_scheduler(
+            chaos, expire_time=100, max_faults=2,
+            selector=WeightedSelector(chaos, policy))
+        self.assertEqual(
+            [e[2] for e in events if e[0] == 'enable'], [0, 30, 60, 90])
+
+    def test_run_no_chaos(self):
+        clock = VirtualClock()
+        scheduler = FaultScheduler(
+            [], None, None, 1, 10, clock=clock.time, wait=clock.wait)
+        scheduler.run(100)
+        self.assertEqual(clock.now, 0)
+
+
+class TestPlan(TestCase):
+
+    def make_scheduler(self, chaos, seed, **kwargs):
+        return FaultScheduler(chaos, None, None, kwargs.pop('max_faults', 2),
+                              10, min_duration=2, rng=random.Random(seed),
+                              **kwargs)
+
+    def test_plan_is_reproducible(self):
+        chaos = [make_chaos(str(i), ['r{}'.format(i)]) for i in range(5)]
+        plan = self.make_scheduler(chaos, 3).plan(600)
+        self.assertEqual(plan, self.make_scheduler(chaos, 3).plan(600))
+        self.assertNotEqual(plan, self.make_scheduler(chaos, 4).plan(600))
+        self.assertEqual(plan, sorted(plan))
+        self.assertTrue(all(o + d <= 600 for o, _, d in plan))
+
+    def test_derive_seed(self):
+        self.assertEqual(derive_seed(5), 5)
+        self.assertEqual(derive_seed(5, 'unit/0'), derive_seed(5, 'unit/0'))
+        self.assertNotEqual(derive_seed(5, 'unit/0'), derive_seed(5, 'unit/1'))
+
+    def test_write_and_read_plan(self):
+        entries = [(0, 'b', 1.5), (0.25, 'a', 2), (3, 'b', 1)]
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'plan')
+            write_plan(path, entries, seed=1)
+            with open(path) as f:
+                lines = f.read().splitlines()
+            header, read_entries = read_plan(path)
+            self.assertEqual(list(read_entries), entries)
+            self.assertEqual(read_plan_header(path), header)
+        self.assertEqual(header, {'seed': 1, 'commands': ['a', 'b']})
+        self.assertEqual(lines[1:], ['[0,1,1.5]', '[0.25,0,2]', '[3,1,1]'])
+
+    def test_read_plan_header_missing(self):
+        self.assertIsNone(read_plan_header('/no/such/plan'))
+
+    def test_run_plan(self):
+        chaos = [make_chaos('a', ['a']), make_chaos('b', ['b'])]
+        clock = VirtualClock(100)
+        events = []
+        scheduler = FaultScheduler(
+            chaos, lambda c, d: events.append((clock.now, c.command_str, d)),
+            lambda c: events.append((clock.now, c.command_str)), 2, 10,
+            clock=clock.time, wait=clock.wait)
+        scheduler.run_plan([(0, 'a', 5), (1, 'b', 2), (6, 'a', 1)], 100)
+        self.assertEqual(events, [
+            (100, 'a', 5), (101, 'b', 2), (103, 'b'), (105, 'a'),
+            (106, 'a', 1), (107, 'a')])
+
+    def test_run_plan_disables_conflicting_fault_first(self):
+        chaos = [make_chaos('a', ['a'])]
+        clock = VirtualClock(100)
+        events = []
+        scheduler = FaultScheduler(
+            chaos, lambda c, d: events.append(('enable', clock.now)),
+            lambda c: events.append(('disable', clock.now)), 2, 10,
+            clock=clock.time, wait=clock.wait)
+        # The first fault ends a little after 107.925, by a rounding error.
+        scheduler.run_plan([(2.358, 'a', 5.567), (7.925, 'a', 1)], 100)
+        self.assertEqual([e[0] for e in events],
+                         ['enable', 'disable', 'enable', 'disable'])
+
+    def test_run_plan_skips_past_entries(self):
+        chaos = [make_chaos('a', ['a'])]
+        clock = VirtualClock(104)
+        events = []
+        scheduler = FaultScheduler(
+            chaos, lambda c, d: events.append((clock.now, d)),
+            lambda c: None, 1, 10, clock=clock.time, wait=clock.wait)
+        skipped = []
+        scheduler.run_plan([(0, 'a', 2), (2, 'a', 4), (6, 'a', 1)], 100,
+                           skipped=lambda *args: skipped.append(args))
+        self.assertEqual(events, [(104, 2), (106, 1)])
+        self.assertEqual(skipped, [('a', 4)])
+
+    def test_run_plan_stops(self):
+        chaos = [make_chaos('a', ['a'])]
+        clock = VirtualClock()
+        disabled = []
+        scheduler = FaultScheduler(
+            chaos, lambda c, d: None, disabled.append, 1, 10,
+            clock=clock.time, wait=clock.wait)
+        scheduler.run_plan([(0, 'a', 5), (5, 'a', 5)], 0,
+                           should_stop=lambda: clock.now >= 2)
+        self.assertEqual(disabled, chaos)
+        self.assertEqual(clock.now, 5)
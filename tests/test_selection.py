@@ -0,0 +1,156 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from collections import Counter
+import os
+import random
+from unittest import TestCase
+
+from chaos_monkey_base import Chaos
+from selection import (
+    AliasTable,
+    SelectionPolicy,
+    UniformSelector,
+    WeightedSelector,
+)
+from utility import (
+    BadRequest,
+    temp_dir,
+)
+
+__metaclass__ = type
+
+
+def make_chaos(command_str, group='net'):
+    return Chaos(None, None, group, command_str, command_str)
+
+
+class TestAliasTable(TestCase):
+
+    def test_sample_follows_weights(self):
+        table = AliasTable([1, 0, 3, 6])
+        rng = random.Random(1)
+        counts = Counter(table.sample(rng) for _ in range(20000))
+        self.assertEqual(counts[1], 0)
+        self.assertAlmostEqual(counts[0] / 20000.0, 0.1, delta=0.01)
+        self.assertAlmostEqual(counts[2] / 20000.0, 0.3, delta=0.015)
+        self.assertAlmostEqual(counts[3] / 20000.0, 0.6, delta=0.015)
+
+    def test_no_positive_weight(self):
+        with self.assertRaises(ValueError):
+            AliasTable([0, 0])
+        with self.assertRaises(ValueError):
+            AliasTable([])
+
+
+class TestSelectionPolicy(TestCase):
+
+    def test_from_file(self):
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'weights.yaml')
+            with open(path, 'w') as f:
+                f.write('groups:\n'
+                        '  kill: 3\n'
+                        'commands:\n'
+                        '  deny-all: 0.5\n'
+                        '  restart-unit:\n'
+                        '    weight: 0.1\n'
+                        '    min-interval: 1800\n'
+                        '    max-per-hour: 1\n')
+            policy = SelectionPolicy.from_file(path)
+        self.assertEqual(policy.group_weights, {'kill': 3})
+        self.assertEqual(policy.command_weights,
+                         {'deny-all': 0.5, 'restart-unit': 0.1})
+        limit = policy.limits['restart-unit']
+        self.assertEqual((limit.min_interval, limit.max_per_hour), (1800, 1))
+        self.assertAlmostEqual(
+            policy.weight(make_chaos('restart-unit', 'kill')), 0.3)
+        self.assertEqual(policy.weight(make_chaos('deny-all')), 0.5)
+        self.assertEqual(policy.weight(make_chaos('deny-incoming')), 1)
+
+    def test_from_dict_invalid(self):
+        for data in ({'groups': {'net': -1}},
+                     {'commands': {'deny-all': 'many'}},
+                     {'commands': {'deny-all': {'min-interval': -5}}},
+                     {'groups': ['net']}):
+            with self.assertRaisesRegexp(BadRequest, 'Invalid selection'):
+                SelectionPolicy.from_dict(data)
+
+    def test_validate(self):
+        policy = SelectionPolicy.from_dict({'groups': {'net': 2},
+                                            'commands': {'deny-all': 2}})
+        policy.validate(['deny-all'], ['net'])
+        with self.assertRaisesRegexp(BadRequest, 'Invalid command'):
+            policy.validate(['deny-incoming'], ['net'])
+        with self.assertRaisesRegexp(BadRequest, 'Invalid group'):
+            policy.validate(['deny-all'], ['kill'])
+
+
+class TestSelectors(TestCase):
+
+    def test_uniform_selector(self):
+        chaos = [make_chaos('a'), make_chaos('b')]
+        selector = UniformSelector(chaos)
+        self.assertIn(selector.choose(0, random.Random(1)), chaos)
+        self.assertEqual(
+            selector.choose(0, accept=lambda c: c.command_str == 'b'),
+            chaos[1])
+        self.assertIsNone(selector.choose(0, accept=lambda c: False))
+        self.assertIsNone(selector.next_allowed_time(0))
+
+    def test_weighted_selector_skips_zero_weight(self):
+        chaos = [make_chaos('a'), make_chaos('b', 'kill')]
+        policy = SelectionPolicy.from_dict({'groups': {'kill': 0}})
+        selector = WeightedSelector(chaos, policy)
+        rng = random.Random(2)
+        self.assertEqual(
+            set(selector.choose(0, rng).command_str for _ in range(50)),
+            set(['a']))
+
+    def test_weighted_selector_min_interval(self):
+        chaos = [make_chaos('a'), make_chaos('b')]
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'b': {'weight': 100, 'min-interval': 60}}})
+        selector = WeightedSelector(chaos, policy)
+        rng = random.Random(3)
+        self.assertEqual(selector.choose(0, rng).command_str, 'b')
+        picks = [selector.choose(t, rng).command_str for t in range(1, 60)]
+        self.assertEqual(set(picks), set(['a']))
+        self.assertEqual(selector.choose(60, rng).command_str, 'b')
+
+    def test_weighted_selector_max_per_hour(self):
+        chaos = [make_chaos('a')]
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'a': {'max-per-hour': 2}}})
+        selector = WeightedSelector(chaos, policy)
+        self.assertEqual(selector.choose(0), chaos[0])
+        self.assertEqual(selector.choose(10), chaos[0])
+        self.assertIsNone(selector.choose(20))
+        self.assertEqual(selector.next_allowed_time(20), 3600)
+        self.assertIsNone(selector.choose(3599))
+        self.assertEqual(selector.choose(3600), chaos[0])
+        self.assertEqual(selector.next_allowed_time(3600), 3610)
+
+    def test_weighted_selector_max_per_hour_zero(self):
+        chaos = [make_chaos('a')]
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'a': {'max-per-hour': 0}}})
+        selector = WeightedSelector(chaos, policy)
+        self.assertIsNone(selector.choose(0))
+        self.assertIsNone(selector.next_allowed_time(0))
+
+    def test_weighted_selector_accept(self):
+        chaos = [make_chaos('a'), make_chaos('b')]
+        policy = SelectionPolicy.from_dict({'commands': {'a': 1000}})
+        selector = WeightedSelector(chaos, policy)
+        self.assertEqual(
+            selector.choose(0, accept=lambda c: c.command_str == 'b'),
+            chaos[1])
+
+    def test_with_empty_history(self):
+        chaos = [make_chaos('a')]
+        policy = SelectionPolicy.from_dict(
+            {'commands': {'a': {'max-per-hour': 1}}})
+        selector = WeightedSelector(chaos, policy)
+        selector.choose(0)
+        self.assertIsNone(selector.choose(1))
+        self.assertEqual(selector.with_empty_history().choose(1), chaos[0])
@@ -0,0 +1,105 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import json
+from StringIO import StringIO
+from subprocess import CalledProcessError
+
+from mock import (
+    MagicMock,
+    patch,
+)
+
+from tests.common_test_base import CommonTestBase
+from utility import (
+    run_shell_command,
+    set_shell_helper,
+)
+from utils.shell_helper import (
+    HelperError,
+    serve,
+    ShellHelper,
+)
+
+__metaclass__ = type
+
+
+class TestShellHelper(CommonTestBase):
+
+    def setUp(self):
+        self.setup_test_logging()
+        self.helper = ShellHelper.start()
+        self.addCleanup(self.helper.stop)
+
+    def test_run(self):
+        output = self.helper.run(['echo', 'hello'])
+        self.assertEqual(output, 'hello\n')
+        self.assertIsInstance(output, str)
+
+    def test_run_input_data(self):
+        output = self.helper.run(['cat'], input_data='a\xffb')
+        self.assertEqual(output, 'a\xffb')
+
+    def test_run_error(self):
+        with self.assertRaises(CalledProcessError) as ctx:
+            self.helper.run(['ls', '-W'])
+        self.assertEqual(ctx.exception.returncode, 2)
+        self.assertEqual(ctx.exception.cmd, ['ls', '-W'])
+
+    def test_run_missing_command(self):
+        with self.assertRaises(CalledProcessError) as ctx:
+            self.helper.run(['no-such-command-8765'])
+        self.assertEqual(ctx.exception.returncode, 127)
+
+    def test_run_after_stop(self):
+        self.helper.stop()
+        with self.assertRaises(HelperError):
+            self.helper.run(['true'])
+
+    def test_latency_report(self):
+        self.helper.run(['true'])
+        self.helper.run(['true'])
+        self.helper.run(['echo'])
+        report = self.helper.latency_report()
+        self.assertItemsEqual(report.keys(), ['true', 'echo'])
+        self.assertEqual(report['true']['count'], 2)
+        self.assertEqual(report['echo']['count'], 1)
+        self.assertGreaterEqual(report['true']['max'],
+                                report['true']['mean'])
+
+    def test_run_shell_command_uses_helper(self):
+        set_shell_helper(self.helper)
+        self.addCleanup(set_shell_helper, None)
+        with patch('utility.check_output', autospec=True) as mock:
+            output = run_shell_command('echo hello')
+        self.assertEqual(output, 'hello\n')
+        self.assertEqual(mock.called, False)
+        self.assertEqual(self.helper.latency_report()['echo']['count'], 1)
+
+    def test_run_shell_command_falls_back_when_helper_fails(self):
+        helper = MagicMock()
+        helper.run.side_effect = HelperError('gone')
+        set_shell_helper(helper)
+        self.addCleanup(set_shell_helper, None)
+        with patch('utility.check_output', autospec=True,
+                   return_value='out') as mock:
+            self.assertEqual(run_shell_command('foo'), 'out')
+            self.assertEqual(run_shell_command('foo'), 'out')
+        self.assertEqual(helper.run.call_count, 1)
+        self.assertEqual(mock.call_count, 2)
+
+
+class TestServe(CommonTestBase):
+
+    def test_serve(self):
+        requests = StringIO(
+            json.dumps({'cmd': ['echo', 'a']}) + '\n' +
+            json.dumps({'cmd': ['false']}) + '\n')
+        responses = StringIO()
+        serve(requests, responses)
+        lines = [
+            json.loads(line) for line in responses.getvalue().splitlines()]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['output'], 'a\n')
+        self.assertEqual(lines[0]['returncode'], 0)
+        self.assertEqual(lines[1]['returncode'], 1)
+        self.assertGreaterEqual(lines[1]['elapsed'], 0)
@@ -0,0 +1,92 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import json
+import os
+import random
+from unittest import TestCase
+
+from chaos_monkey_base import Chaos
+from event_log import (
+    DISABLE,
+    ENABLE,
+)
+from scheduler import FaultScheduler
+from simulation import (
+    Simulation,
+    write_report,
+)
+from utility import temp_dir
+
+__metaclass__ = type
+
+
+def make_chaos(command_str, resources=()):
+    return Chaos(None, None, 'group', command_str, command_str,
+                 resources=resources)
+
+
+class TestSimulation(TestCase):
+
+    def test_run(self):
+        chaos = [make_chaos('a')]
+        scheduler = FaultScheduler(chaos, None, None, 1, 10)
+        simulation = Simulation()
+        simulation.run(scheduler, 25)
+        self.assertEqual(simulation.events, [
+            (0, ENABLE, 'a', 10), (10, DISABLE, 'a', None),
+            (10, ENABLE, 'a', 10), (20, DISABLE, 'a', None),
+            (20, ENABLE, 'a', 5), (25, DISABLE, 'a', None)])
+        self.assertEqual(simulation.clock.time(), 25)
+
+    def test_run_is_reproducible(self):
+        chaos = [make_chaos(c, [c]) for c in 'abcd']
+        runs = []
+        for _ in range(2):
+            scheduler = FaultScheduler(
+                chaos, None, None, 2, 10, min_duration=1,
+                rng=random.Random(3))
+            simulation = Simulation()
+            simulation.run(scheduler, 3600)
+            runs.append(simulation.events)
+        self.assertEqual(runs[0], runs[1])
+        self.assertGreater(len(runs[0]), 100)
+
+    def test_run_plan(self):
+        chaos = [make_chaos('a', ['a']), make_chaos('b', ['b'])]
+        scheduler = FaultScheduler(chaos, None, None, 2, 10)
+        simulation = Simulation()
+        simulation.run_plan(scheduler, [(0, 'a', 5), (1, 'b', 2)])
+        self.assertEqual(simulation.events, [
+            (0, ENABLE, 'a', 5), (1, ENABLE, 'b', 2), (3, DISABLE, 'b', None),
+            (5, DISABLE, 'a', None)])
+
+    def test_report(self):
+        simulation = Simulation()
+        simulation.events = [
+            (0, ENABLE, 'a', 5), (1, ENABLE, 'b', 2.5),
+            (3.5, DISABLE, 'b', None), (5, DISABLE, 'a', None),
+            (8, ENABLE, 'a', 2), (10, DISABLE, 'a', None)]
+        report = simulation.report(20, ['a', 'b', 'c', 'd'])
+        self.assertEqual(report, {
+            'run_ms': 20000,
+            'events': [
+                [0, ENABLE, 'a', 5000], [1000, ENABLE, 'b', 2500],
+                [3500, DISABLE, 'b', None], [5000, DISABLE, 'a', None],
+                [8000, ENABLE, 'a', 2000], [10000, DISABLE, 'a', None]],
+            'fault_ms': {'a': 7000, 'b': 2500, 'c': 0, 'd': 0},
+            'coverage': {'commands': 0.5, 'time': 0.35},
+        })
+
+    def test_report_without_commands(self):
+        report = Simulation().report(0, [])
+        self.assertEqual(report['coverage'], {'commands': 0.0, 'time': 0.0})
+
+    def test_write_report(self):
+        simulation = Simulation()
+        simulation.events = [(0, ENABLE, 'a', 1), (1, DISABLE, 'a', None)]
+        report = simulation.report(1, ['a'])
+        with temp_dir() as directory:
+            path = os.path.join(directory, 'report.json')
+            write_report(path, report)
+            with open(path) as f:
+                self.assertEqual(json.load(f), report)
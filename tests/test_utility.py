@@ -10,9 +10,14 @@ from mock import patch
 from yaml import dump
 
 from common_test_base import CommonTestBase
+from metrics import Metrics
 from utility import (
+    BadRequest,
     ensure_dir,
+    monotonic,
     run_shell_command,
+    set_metrics,
+    split_address,
     setup_logging,
     StructuredMessage,
     temp_dir,
@@ -24,6 +29,22 @@ class TestUtility(CommonTestBase):
     def setUp(self):
         self.setup_test_logging()
 
+    def test_monotonic(self):
+        readings = [monotonic() for _ in range(100)]
+        self.assertEqual(readings, sorted(readings))
+        self.assertIsInstance(readings[0], float)
+
+    def test_monotonic_loads_librt_on_first_call(self):
+        with patch('utility._monotonic', None):
+            with patch('utility.ctypes.CDLL', autospec=True,
+                       side_effect=OSError) as cdll_mock:
+                with patch('utility.time', autospec=True,
+                           return_value=12.5):
+                    self.assertEqual(cdll_mock.call_count, 0)
+                    self.assertEqual(monotonic(), 12.5)
+                    self.assertEqual(monotonic(), 12.5)
+        cdll_mock.assert_called_once_with('librt.so.1', use_errno=True)
+
     def test_ensure_dir(self):
         with temp_dir() as directory:
             expected_dir = os.path.join(directory, 'new_dir')
@@ -54,6 +75,36 @@ class TestUtility(CommonTestBase):
         output = run_shell_command('echo "hello"')
         self.assertEqual(output, '"hello"\n')
 
+    def test_run_shell_command_input_data(self):
+        output = run_shell_command('cat', input_data='hello\n')
+        self.assertEqual(output, 'hello\n')
+
+    def test_run_shell_command_input_data_error(self):
+        with self.assertRaises(CalledProcessError):
+            run_shell_command('false', input_data='hello')
+        self.assertIsNone(
+            run_shell_command('false', quiet_mode=True, input_data='hello'))
+
+    def test_run_shell_command_metrics(self):
+        metrics = Metrics()
+        set_metrics(metrics)
+        self.addCleanup(set_metrics, None)
+        run_shell_command('true')
+        with self.assertRaises(CalledProcessError):
+            run_shell_command('false')
+        run_shell_command('false', quiet_mode=True)
+        self.assertEqual(metrics.programs['true'].calls, [1, 0, 0])
+        self.assertEqual(metrics.programs['false'].calls, [0, 1, 1])
+        self.assertEqual(sum(metrics.programs['false'].latency.counts), 2)
+
+    def test_split_address(self):
+        self.assertEqual(split_address('9107'), ('127.0.0.1', 9107))
+        self.assertEqual(split_address(':9107'), ('127.0.0.1', 9107))
+        self.assertEqual(split_address('0.0.0.0:9107'), ('0.0.0.0', 9107))
+        self.assertEqual(split_address('/run/cm.sock'), '/run/cm.sock')
+        with self.assertRaisesRegexp(BadRequest, 'Invalid address: cm.sock'):
+            split_address('cm.sock')
+
     def test_setup_logging(self):
         with NamedTemporaryFile() as temp_file:
             setup_logging(temp_file.name, log_count=1, log_level=logging.DEBUG)
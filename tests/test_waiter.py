@@ -0,0 +1,48 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import signal
+from time import time
+from unittest import TestCase
+
+from utils.waiter import Waiter
+
+__metaclass__ = type
+
+
+class TestWaiter(TestCase):
+
+    def setUp(self):
+        self.waiter = Waiter()
+        self.addCleanup(self.waiter.close)
+
+    def test_wait_timeout(self):
+        start = time()
+        self.assertFalse(self.waiter.wait(0.05))
+        self.assertGreaterEqual(time() - start, 0.05)
+
+    def test_wait_after_wake(self):
+        self.waiter.wake()
+        start = time()
+        self.assertTrue(self.waiter.wait(10))
+        self.assertLess(time() - start, 1)
+
+    def test_wake_many_times(self):
+        for i in range(100000):
+            self.waiter.wake()
+        self.assertTrue(self.waiter.wait(10))
+
+    def test_wake_from_signal_handler(self):
+        def handler(sig_num, frame):
+            self.waiter.wake()
+
+        old_handler = signal.signal(signal.SIGALRM, handler)
+        self.addCleanup(signal.signal, signal.SIGALRM, old_handler)
+        signal.setitimer(signal.ITIMER_REAL, 0.05)
+        start = time()
+        self.assertTrue(self.waiter.wait(10))
+        self.assertLess(time() - start, 5)
+
+    def test_close(self):
+        self.waiter.wait(0)
+        self.waiter.close()
+        self.assertIsNone(self.waiter._pipe)
@@ -2,20 +2,37 @@
 # Licensed under the AGPLv3, see LICENCE file for details.
 from __future__ import print_function
 
+import ctypes
 import errno
 import logging
 from logging.handlers import RotatingFileHandler
 import os
+from Queue import Queue
 from shutil import rmtree
 from subprocess import (
     CalledProcessError,
     check_output,
+    PIPE,
+    Popen,
 )
 from tempfile import mkdtemp
+from time import time
 
 from contextlib import contextmanager
 from yaml import dump
 
+from utils.log_queue import (
+    QueueHandler,
+    QueueListener,
+)
+from utils.shell_helper import HelperError
+
+
+# The chaos commands log through this logger rather than the root logger,
+# so using them does not configure logging. The runner logs it through
+# the handlers of the root logger.
+log = logging.getLogger('chaos_monkey')
+
 
 def ensure_dir(path):
     """Ensure a directory exists. If it doesn't exist, it will be created."""
@@ -26,46 +43,164 @@ def ensure_dir(path):
             raise
 
 
-def run_shell_command(cmd, quiet_mode=False):
+_shell_helper = None
+
+
+_metrics = None
+
+
+def set_metrics(metrics):
+    """Count the shell commands run in metrics, or None to stop."""
+    global _metrics
+    _metrics = metrics
+
+
+def set_shell_helper(helper):
+    """Route run_shell_command through a ShellHelper, or None to stop."""
+    global _shell_helper
+    _shell_helper = helper
+
+
+def _check_output(shell_cmd, input_data=None):
+    global _shell_helper
+    if _shell_helper is not None:
+        try:
+            return _shell_helper.run(shell_cmd, input_data=input_data)
+        except HelperError as e:
+            log.warning('{}: running commands directly.'.format(e))
+            _shell_helper = None
+    if input_data is None:
+        return check_output(shell_cmd)
+    process = Popen(shell_cmd, stdin=PIPE, stdout=PIPE)
+    output, _ = process.communicate(input_data)
+    if process.returncode:
+        raise CalledProcessError(process.returncode, shell_cmd, output)
+    return output
+
+
+def run_shell_command(cmd, quiet_mode=False, input_data=None):
     """Run a shell command.
 
     :param quiet_mode: When False, generate a CalledProcessError
        exception on error.
+    :param input_data: String written to the standard input of the command.
     """
     shell_cmd = cmd.split(' ') if type(cmd) is str else cmd
     output = None
+    start = monotonic()
+    outcome = 'error'
     try:
-        output = check_output(shell_cmd)
+        output = _check_output(shell_cmd, input_data=input_data)
+        outcome = 'ok'
     except CalledProcessError:
-        logging.error("Command generated error: %s " % cmd)
+        log.error("Command generated error: %s " % cmd)
         if not quiet_mode:
             raise
+        outcome = 'ignored'
+    finally:
+        if _metrics is not None:
+            _metrics.shell_command(shell_cmd[0], monotonic() - start, outcome)
     return output
 
 
+# QueueHandler and QueueListener pairs installed by setup_logging().
+_log_queues = []
+
+
 def setup_logging(log_path, log_count, log_level=logging.INFO, name=None,
-                  add_stream=True, disable_formatter=False):
-    """Install log handlers to output to file and stream."""
+                  add_stream=True, disable_formatter=False, queue_size=0):
+    """Install log handlers to output to file and stream.
+
+    :param queue_size: When greater than zero, the logger puts records on
+        a queue of that size and a background thread writes them, so
+        logging never waits for disk I/O. Records that do not fit in the
+        queue are dropped.
+    """
     formatter = None if disable_formatter else logging.Formatter(
         '%(asctime)s %(levelname)s %(message)s', '%Y-%m-%d %H:%M:%S')
     logger = logging.getLogger(name)
     logger.propagate = 0
+    handlers = []
     rf_handler = RotatingFileHandler(
         log_path, maxBytes=1024 * 1024 * 512, backupCount=log_count)
     rf_handler.setFormatter(formatter)
-    logger.addHandler(rf_handler)
+    handlers.append(rf_handler)
     if add_stream:
         s_handler = logging.StreamHandler()
         s_handler.setFormatter(formatter)
-        logger.addHandler(s_handler)
+        handlers.append(s_handler)
+    if queue_size > 0:
+        queue = Queue(queue_size)
+        q_handler = QueueHandler(queue)
+        listener = QueueListener(queue, handlers)
+        listener.start()
+        _log_queues.append((q_handler, listener))
+        handlers = [q_handler]
+    for handler in handlers:
+        logger.addHandler(handler)
     logger.setLevel(log_level)
 
 
+def stop_log_queues():
+    """Write the queued log records and stop the logging threads.
+
+    :return: Number of log records dropped because a queue was full.
+    """
+    dropped = sum(h.dropped for h, _ in _log_queues)
+    while _log_queues:
+        q_handler, listener = _log_queues.pop()
+        listener.stop()
+    return dropped
+
+
 def split_arg_string(arg_string):
-    """Split string using comma as delimiter."""
+    """Split string using comma as delimiter.
+
+    Commas between parentheses, which separate the parameters of a command
+    such as 'delay(latency=100ms,jitter=10ms)', do not split the string.
+    """
     if not arg_string:
         return []
-    return arg_string.split(',') if ',' in arg_string else [arg_string]
+    if '(' not in arg_string:
+        return arg_string.split(',') if ',' in arg_string else [arg_string]
+    items = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(arg_string):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == ',' and depth == 0:
+            items.append(arg_string[start:i])
+            start = i + 1
+    items.append(arg_string[start:])
+    return items
+
+
+def split_address(address):
+    """Split the address of a local server.
+
+    :param address: The absolute path of a Unix socket, a port or a
+        host:port. The host defaults to 127.0.0.1.
+    :return: The socket path, or a (host, port) tuple.
+    :raises BadRequest: When address is not valid.
+    """
+    if address.startswith('/'):
+        return address
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise BadRequest('Invalid address: {}'.format(address))
+    return host or '127.0.0.1', int(port)
+
+
+def remove_socket(path):
+    """Remove the Unix socket at path, if it exists."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
 
 
 @contextmanager
@@ -88,6 +223,42 @@ class BadRequest(Exception):
     error_code = 400
 
 
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_clock():
+    """Return a function reading CLOCK_MONOTONIC, or time() if missing."""
+    try:
+        clock_gettime = ctypes.CDLL('librt.so.1', use_errno=True).clock_gettime
+    except (AttributeError, OSError):
+        return time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    # CLOCK_MONOTONIC on Linux.
+    clock_id = 1
+
+    def monotonic():
+        timespec = _Timespec()
+        if clock_gettime(clock_id, ctypes.byref(timespec)) != 0:
+            errno_ = ctypes.get_errno()
+            raise OSError(errno_, os.strerror(errno_))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+
+    return monotonic
+
+
+# Loaded on the first call to monotonic().
+_monotonic = None
+
+
+def monotonic():
+    """Return seconds from an arbitrary point that never goes back."""
+    global _monotonic
+    if _monotonic is None:
+        _monotonic = _monotonic_clock()
+    return _monotonic()
+
+
 class StructuredMessage:
     """Create YAML structured message."""
     def __init__(self, *args):
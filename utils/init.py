@@ -1,29 +1,55 @@
 # Copyright 2015 Canonical Ltd.
 # Licensed under the AGPLv3, see LICENCE file for details.
 import errno
+import glob
 import logging
 import os
+import sys
 
 __metaclass__ = type
 
 
+INIT_FILENAME = 'chaos-monkey-restart'
+
+
+def _paths(root):
+    """Return the scripts directory, runner path and run state path."""
+    dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    scripts_dir_path = os.path.join(dir, 'scripts')
+    runner_path = os.path.join(dir, 'runner.py')
+    # Full path to the run state read by the restart script.
+    state_path = os.path.join(root, 'var', 'lib', INIT_FILENAME + '.json')
+    return scripts_dir_path, runner_path, state_path
+
+
 class Init:
-    """Generate Upstart init script."""
+    """Install the Upstart boot hook restarting Chaos Monkey.
+
+    The hook is the same for every run: at boot, it restarts the run saved
+    in the run state file, if any, see utils/run_state.py.
+    """
 
     def __init__(self, init_path, init_script_path, restart_script_path,
-                 runner_path):
+                 runner_path, state_path):
         self.init_path = init_path
         self.init_script_path = init_script_path
         self.restart_script_path = restart_script_path
         self.runner_path = runner_path
+        self.state_path = state_path
+
+    @classmethod
+    def detect(cls, root='/'):
+        """Return the Init of the init system running under root."""
+        if os.path.isdir(os.path.join(root, 'run', 'systemd', 'system')):
+            return SystemdInit.systemd(root)
+        return cls.upstart(root)
 
     @classmethod
-    def upstart(cls):
-        dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-        scripts_dir_path = os.path.join(dir, 'scripts')
-        init_filename = 'chaos-monkey-restart.conf'
+    def upstart(cls, root='/'):
+        scripts_dir_path, runner_path, state_path = _paths(root)
+        init_filename = INIT_FILENAME + '.conf'
         # Full path to upstart conf file.
-        init_path = os.path.join('/etc/init/', init_filename)
+        init_path = os.path.join(root, 'etc', 'init', init_filename)
         # Full path to upstart script file.
         # This file contains upstart conf script.
         init_script_path = os.path.join(scripts_dir_path,  init_filename)
@@ -32,41 +58,33 @@ class Init:
         # Full path to restart script file.
         restart_script_path = os.path.join(scripts_dir_path,
                                            restart_script_filename)
-        runner_path = os.path.join(dir, 'runner.py')
-        return cls(
-            init_path, init_script_path, restart_script_path, runner_path)
+        return cls(init_path, init_script_path, restart_script_path,
+                   runner_path, state_path)
 
-    def install(self, cmd_arg, expire_time):
-        """Install an Upstart script in the /etc/init directory."""
-        cmd_arg = Init._remove_args(cmd_arg=cmd_arg)
+    def render(self):
+        """Return the content of the Upstart script."""
         with open(self.init_script_path, 'r') as f:
-            data = f.read().format(
+            return f.read().format(
                 restart_script_path=self.restart_script_path,
-                runner_path=self.runner_path,
-                cmd_arg=cmd_arg,
-                expire_time=expire_time,
-            )
+                state_path=self.state_path)
+
+    def install(self):
+        """Install the Upstart script in the /etc/init directory.
+
+        The script is only written when it is missing or out of date.
+        """
+        data = self.render()
+        try:
+            with open(self.init_path) as f:
+                if f.read() == data:
+                    return
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
         # Write to /etc/init dir
         with open(self.init_path, 'w') as f:
             f.write(data)
-        logging.info("Init script generated:\n cmd: {} \n expire_time: {} \n "
-                     "runner_path: {}".format(cmd_arg,  expire_time,
-                                              self.runner_path))
-
-    @staticmethod
-    def _remove_args(cmd_arg):
-        cmd_arg = cmd_arg.replace('--restart ', '').replace('--restart', '')
-        if '--expire-time' in cmd_arg:
-            cmd_list = cmd_arg.split()
-            remove_index = cmd_list.index('--expire-time')
-            # Delete --expire-time
-            del cmd_list[remove_index]
-            # Delete expire-time's argument, which is the next item in the
-            # list. "remove_index" is going to be the same because an item has
-            # been removed and the size has been reduced.
-            del cmd_list[remove_index]
-            cmd_arg = ' '.join(cmd_list)
-        return cmd_arg
+        logging.info("Init script generated: {}".format(self.init_path))
 
     def uninstall(self):
         """Remove the Upstart script from /etc/init directory."""
@@ -76,3 +94,73 @@ class Init:
         except OSError as e:
             if e.errno != errno.ENOENT:
                 raise
+
+
+class SystemdInit(Init):
+    """Install a systemd unit as the boot hook restarting Chaos Monkey.
+
+    The unit starts after the Juju agents and runs the restarted Chaos Monkey
+    in its own process, so it stays in the unit's control group.
+    """
+
+    def __init__(self, init_path, init_script_path, restart_script_path,
+                 runner_path, state_path, wants_path, after=()):
+        """
+        :param wants_path: Path of the link enabling the unit at boot.
+        :param after: Units the unit starts after, such as the Juju agents.
+        """
+        super(SystemdInit, self).__init__(
+            init_path, init_script_path, restart_script_path, runner_path,
+            state_path)
+        self.wants_path = wants_path
+        self.after = after
+
+    @classmethod
+    def systemd(cls, root='/'):
+        scripts_dir_path, runner_path, state_path = _paths(root)
+        unit_filename = INIT_FILENAME + '.service'
+        system_dir = os.path.join(root, 'etc', 'systemd', 'system')
+        init_path = os.path.join(system_dir, unit_filename)
+        wants_path = os.path.join(
+            system_dir, 'multi-user.target.wants', unit_filename)
+        init_script_path = os.path.join(scripts_dir_path, unit_filename)
+        restart_script_path = os.path.join(
+            scripts_dir_path, 'restart_chaos_monkey.py')
+        return cls(init_path, init_script_path, restart_script_path,
+                   runner_path, state_path, wants_path,
+                   juju_units(root))
+
+    def render(self):
+        with open(self.init_script_path, 'r') as f:
+            return f.read().format(
+                python=sys.executable,
+                restart_script_path=self.restart_script_path,
+                state_path=self.state_path,
+                after=' '.join(('network-online.target',) + self.after))
+
+    def install(self):
+        """Install the unit and enable it, as systemctl enable does."""
+        super(SystemdInit, self).install()
+        if not os.path.islink(self.wants_path):
+            wants_dir = os.path.dirname(self.wants_path)
+            if not os.path.isdir(wants_dir):
+                os.makedirs(wants_dir)
+            os.symlink(self.init_path, self.wants_path)
+
+    def uninstall(self):
+        """Disable and remove the unit."""
+        try:
+            os.remove(self.wants_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        super(SystemdInit, self).uninstall()
+
+
+def juju_units(root='/'):
+    """Return the names of the Juju agent units installed under root."""
+    units = set()
+    for unit_dir in ('etc/systemd/system', 'lib/systemd/system'):
+        pattern = os.path.join(root, unit_dir, 'jujud-*.service')
+        units.update(os.path.basename(p) for p in glob.glob(pattern))
+    return tuple(sorted(units))
@@ -0,0 +1,114 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+from contextlib import contextmanager
+import logging
+from Queue import (
+    Empty,
+    Full,
+)
+import threading
+
+__metaclass__ = type
+
+
+class QueueHandler(logging.Handler):
+    """Put log records on a bounded queue instead of writing them.
+
+    Records that do not fit in the queue are dropped and counted, so
+    logging never blocks the caller.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Make record safe to handle in another thread."""
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # Tracebacks keep frames alive; format them now.
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+@contextmanager
+def deferred_flush(handler):
+    """Flush handler once, when the block exits, not once per record."""
+    # StreamHandler.emit() calls self.flush() after every record.
+    handler.flush = lambda: None
+    try:
+        yield
+    finally:
+        del handler.flush
+        handler.flush()
+
+
+class QueueListener:
+    """Pass the records of a queue to handlers in a background thread.
+
+    Records are taken from the queue in batches of up to batch_size, and
+    each handler is flushed once per batch.
+    """
+
+    _stop = None
+
+    def __init__(self, queue, handlers, batch_size=64):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _monitor(self):
+        stop = False
+        while not stop:
+            batch = []
+            record = self.queue.get()
+            try:
+                while True:
+                    if record is self._stop:
+                        stop = True
+                        break
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        break
+                    record = self.queue.get_nowait()
+            except Empty:
+                pass
+            if batch:
+                self.handle(batch)
+
+    def handle(self, records):
+        for handler in self.handlers:
+            handler.acquire()
+            try:
+                with deferred_flush(handler):
+                    for record in records:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+            finally:
+                handler.release()
+
+    def stop(self):
+        """Write the queued records and wait for the thread to exit."""
+        if self._thread is not None:
+            self.queue.put(self._stop)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,60 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import os
+
+from utility import (
+    BadRequest,
+    split_arg_string,
+)
+
+__metaclass__ = type
+
+
+# Used when no interface can be detected.
+FALLBACK_INTERFACE = 'eth0'
+
+
+def default_route_interfaces(proc_root='/proc'):
+    """Return the interfaces that have a default route."""
+    interfaces = []
+    with open(os.path.join(proc_root, 'net', 'route')) as f:
+        next(f)
+        for line in f:
+            fields = line.split()
+            if (len(fields) > 1 and fields[1] == '00000000' and
+                    fields[0] not in interfaces):
+                interfaces.append(fields[0])
+    return interfaces
+
+
+def all_interfaces(proc_root='/proc'):
+    """Return every network interface except loopback."""
+    interfaces = []
+    with open(os.path.join(proc_root, 'net', 'dev')) as f:
+        for line in f:
+            name, sep, _ = line.partition(':')
+            name = name.strip()
+            if sep and name != 'lo':
+                interfaces.append(name)
+    return interfaces
+
+
+def resolve_interfaces(spec='default', proc_root='/proc'):
+    """Return the interface names selected by spec.
+
+    :param spec: 'default' for the interfaces with a default route, 'all'
+        for every interface except loopback, or a comma separated list of
+        interface names.
+    """
+    if spec in ('default', 'all'):
+        detect = (default_route_interfaces if spec == 'default'
+                  else all_interfaces)
+        try:
+            interfaces = detect(proc_root)
+        except IOError:
+            interfaces = []
+        return interfaces or [FALLBACK_INTERFACE]
+    interfaces = split_arg_string(spec) if isinstance(spec, str) else spec
+    if not interfaces:
+        raise BadRequest('No network interface given.')
+    return list(interfaces)
@@ -0,0 +1,146 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import errno
+import os
+import re
+
+__metaclass__ = type
+
+
+class Process:
+    """Details of a running process read from /proc."""
+
+    def __init__(self, pid, start_time, comm, cmdline, exe, cgroup):
+        self.pid = pid
+        self.start_time = start_time
+        self.comm = comm
+        self.cmdline = cmdline
+        self.exe = exe
+        self.cgroup = cgroup
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(
+            self.__class__.__name__, self.pid, self.comm)
+
+    @property
+    def name(self):
+        """Return the name matched by pidof: the base name of argv[0]."""
+        if self.cmdline:
+            return os.path.basename(self.cmdline[0])
+        return self.comm
+
+    @property
+    def units(self):
+        """Return the systemd units the process belongs to."""
+        units = []
+        for line in self.cgroup.splitlines():
+            path = line.split(':', 2)[-1]
+            units.extend(p for p in path.split('/')
+                         if p.endswith(('.service', '.scope')))
+        return units
+
+
+class ProcessFinder:
+    """Find processes by scanning /proc instead of running pidof.
+
+    Process details are cached by PID and reread only when the start time
+    of the PID changes, which means the PID has been reused.
+    """
+
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        self._cache = {}
+        self._boot_time = None
+
+    def _read(self, pid, name):
+        with open(os.path.join(self.proc_root, str(pid), name)) as f:
+            return f.read()
+
+    def _start_time(self, pid):
+        stat = self._read(pid, 'stat')
+        # The command name may contain spaces, so split after its ')'.
+        fields = stat[stat.rindex(')') + 2:].split()
+        return int(fields[19])
+
+    def _load(self, pid, start_time):
+        comm = self._read(pid, 'comm').rstrip('\n')
+        cmdline = [a for a in self._read(pid, 'cmdline').split('\0') if a]
+        try:
+            exe = os.readlink(os.path.join(self.proc_root, str(pid), 'exe'))
+        except OSError:
+            exe = None
+        try:
+            cgroup = self._read(pid, 'cgroup')
+        except IOError:
+            cgroup = ''
+        return Process(pid, start_time, comm, cmdline, exe, cgroup)
+
+    def get_process(self, pid):
+        """Return the Process for pid, or None if it no longer exists."""
+        try:
+            start_time = self._start_time(pid)
+            process = self._cache.get(pid)
+            if process is None or process.start_time != start_time:
+                process = self._cache[pid] = self._load(pid, start_time)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ENOENT, errno.ESRCH):
+                raise
+            self._cache.pop(pid, None)
+            return None
+        return process
+
+    def boot_time(self):
+        """Return the boot time of the system, as a UNIX timestamp."""
+        if self._boot_time is None:
+            with open(os.path.join(self.proc_root, 'stat')) as f:
+                for line in f:
+                    if line.startswith('btime '):
+                        self._boot_time = int(line.split()[1])
+                        break
+        return self._boot_time
+
+    def started_at(self, pid):
+        """Return when pid started, as a UNIX timestamp, or None if it does
+        not exist.
+        """
+        process = self.get_process(pid)
+        if process is None:
+            return None
+        ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        return self.boot_time() + process.start_time / float(ticks)
+
+    def processes(self):
+        """Return every running Process."""
+        pids = [int(p) for p in os.listdir(self.proc_root) if p.isdigit()]
+        for pid in set(self._cache) - set(pids):
+            del self._cache[pid]
+        processes = (self.get_process(pid) for pid in pids)
+        return [p for p in processes if p is not None]
+
+    def find(self, name=None, exe=None, cmdline=None, cgroup=None,
+             unit=None):
+        """Return the PIDs of the matching processes, newest first.
+
+        :param name: Process name, as matched by pidof.
+        :param exe: Full path of the process executable.
+        :param cmdline: Regular expression searched for in the command line.
+        :param cgroup: Substring of the process control group paths.
+        :param unit: Name of the systemd unit the process belongs to.
+        """
+        cmdline_re = re.compile(cmdline) if cmdline else None
+        matches = []
+        for process in self.processes():
+            if name is not None and name not in (process.name, process.comm):
+                continue
+            if exe is not None and process.exe != exe:
+                continue
+            if cmdline_re and not cmdline_re.search(
+                    ' '.join(process.cmdline)):
+                continue
+            if cgroup is not None and cgroup not in process.cgroup:
+                continue
+            if unit is not None and unit not in process.units:
+                continue
+            matches.append(process)
+        matches.sort(key=lambda p: (p.start_time, p.pid), reverse=True)
+        return [p.pid for p in matches]
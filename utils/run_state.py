@@ -0,0 +1,48 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+"""Save what a run needs to continue after the unit restarts.
+
+The run state is a JSON object:
+    {"runner_path": "/path/runner.py", "argv": ["--include-group", "net",
+     "workspace"], "expire_time": 1445000000.5, "replay_offset": null,
+     "plan_position": 0, "selection_history": {"restart-unit": [1444990000.2]},
+     "rng_state": [3, [...], null], "active_faults": ["deny-all"]}
+
+The boot hook restarts the runner with argv, and the runner reads the rest
+of the state back, see Runner.resume().
+"""
+import errno
+import json
+import os
+
+__metaclass__ = type
+
+
+def write_run_state(path, state):
+    """Write state to path, replacing the previous state atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_run_state(path):
+    """Return the state saved at path, or None if there is no valid state.
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return state if isinstance(state, dict) else None
+
+
+def remove_run_state(path):
+    """Remove the state at path, so it is not resumed again."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
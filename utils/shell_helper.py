@@ -0,0 +1,124 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import json
+import os
+import subprocess
+import sys
+from time import time
+
+__metaclass__ = type
+
+
+class HelperError(Exception):
+    """The helper process stopped responding."""
+
+
+class ShellHelper:
+    """Run shell commands through a persistent helper process.
+
+    The helper only imports the standard library, so forking commands from
+    it is cheaper than forking them from the runner.
+    """
+
+    def __init__(self, process):
+        self.process = process
+        # Command name -> [count, total seconds, max seconds].
+        self.latency = {}
+
+    @classmethod
+    def start(cls, python=None):
+        """Start a helper process and return a ShellHelper talking to it."""
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        process = subprocess.Popen(
+            [python or sys.executable, script], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, close_fds=True)
+        return cls(process)
+
+    def run(self, cmd, input_data=None):
+        """Run cmd in the helper and return its output.
+
+        :param input_data: String written to the standard input of cmd.
+
+        :raises CalledProcessError: The command exited with non-zero status.
+        :raises HelperError: The helper process is gone.
+        """
+        try:
+            request = {'cmd': cmd}
+            if input_data is not None:
+                request['input'] = input_data.decode('latin-1')
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (IOError, ValueError) as e:
+            raise HelperError('Shell helper failed: {}'.format(e))
+        if not line:
+            raise HelperError('Shell helper exited: {}'.format(
+                self.process.poll()))
+        response = json.loads(line)
+        self._record(cmd[0], response['elapsed'])
+        output = response['output'].encode('latin-1')
+        if response['returncode']:
+            raise subprocess.CalledProcessError(
+                response['returncode'], cmd, output)
+        return output
+
+    def _record(self, name, elapsed):
+        stats = self.latency.get(name)
+        if stats is None:
+            stats = self.latency[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    def latency_report(self):
+        """Return count, mean and max seconds of each command run."""
+        return dict(
+            (name, {'count': count, 'mean': total / count, 'max': max_})
+            for name, (count, total, max_) in self.latency.items())
+
+    def stop(self):
+        """Ask the helper process to exit and wait for it."""
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+
+
+def execute(cmd, input_data=None):
+    """Run cmd and return a response dict."""
+    start = time()
+    try:
+        # Keep commands off stdin, which carries the requests.
+        with open(os.devnull) as devnull:
+            process = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE,
+                stdin=devnull if input_data is None else subprocess.PIPE)
+            output, _ = process.communicate(input_data)
+        returncode = process.returncode
+    except OSError as e:
+        output, returncode = str(e), 127
+    return {
+        'returncode': returncode,
+        'output': output.decode('latin-1'),
+        'elapsed': time() - start,
+    }
+
+
+def serve(requests, responses):
+    """Answer requests until the requests stream is closed.
+
+    Each request and response is a JSON object on its own line:
+        request:  {"cmd": ["ufw", "disable"], "input": "optional stdin"}
+        response: {"returncode": 0, "output": "...", "elapsed": 0.012}
+    """
+    for line in iter(requests.readline, ''):
+        request = json.loads(line)
+        input_data = request.get('input')
+        if input_data is not None:
+            input_data = input_data.encode('latin-1')
+        response = execute(request['cmd'], input_data)
+        responses.write(json.dumps(response) + '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    serve(sys.stdin, sys.stdout)
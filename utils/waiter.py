@@ -0,0 +1,62 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the AGPLv3, see LICENCE file for details.
+import errno
+import fcntl
+import os
+import select
+from time import time
+
+__metaclass__ = type
+
+
+class Waiter:
+    """Sleep for a number of seconds unless woken up.
+
+    wake() only sets a flag and writes a byte to a pipe, so it can be
+    called from a signal handler: a wait in progress returns as soon as the
+    handler has run, and every later wait returns immediately.
+    """
+
+    def __init__(self):
+        self.woken = False
+        self._pipe = None
+
+    def _fds(self):
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            for fd in self._pipe:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        return self._pipe
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds and return True if woken up."""
+        read_fd = self._fds()[0]
+        deadline = time() + timeout
+        while not self.woken:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            try:
+                select.select([read_fd], [], [], remaining)
+            except select.error as e:
+                # A signal arrived; its handler may have woken us.
+                if e.args[0] != errno.EINTR:
+                    raise
+        return self.woken
+
+    def wake(self):
+        """Stop the current and all future waits."""
+        self.woken = True
+        try:
+            os.write(self._fds()[1], b'x')
+        except OSError as e:
+            # The pipe is full, so a wake up is already pending.
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        if self._pipe is not None:
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None